@@ -1,11 +1,11 @@
 import { supabase } from "@/config/supabase";
 
-export type PipelineJobStage = "parse" | "extract" | "diff" | "generate";
-export type PipelineJobStatus = "queued" | "processing" | "done" | "error";
+export type PipelineJobStage = "parse" | "extract" | "diff" | "generate" | "backfill";
+export type PipelineJobStatus = "queued" | "processing" | "done" | "error" | "dead";
 
 export interface PipelineJobRow {
   id: string;
-  document_id: string;
+  document_id: string | null;
   stage: PipelineJobStage;
   status: PipelineJobStatus;
   error_message: string | null;
@@ -20,7 +20,7 @@ export interface JobStageSummary {
   status: "Online" | "Processing" | "Unhealthy";
 }
 
-const STAGES: PipelineJobStage[] = ["parse", "extract", "diff", "generate"];
+const STAGES: PipelineJobStage[] = ["parse", "extract", "diff", "generate", "backfill"];
 
 function summarize(jobs: PipelineJobRow[]): Record<PipelineJobStage, JobStageSummary> {
   const summary = Object.fromEntries(
@@ -32,7 +32,7 @@ function summarize(jobs: PipelineJobRow[]): Record<PipelineJobStage, JobStageSum
     if (!bucket) continue;
     if (job.status === "queued") bucket.queued += 1;
     if (job.status === "processing") bucket.processing += 1;
-    if (job.status === "error") bucket.failedRecent += 1;
+    if (job.status === "error" || job.status === "dead") bucket.failedRecent += 1;
   }
 
   for (const stage of STAGES) {
@@ -236,7 +236,9 @@ export interface PipelineGeneratedDocRow {
   kind: "zusammenfassung" | "kickoff_brief" | "deviation_report" | "ab_draft";
   title: string | null;
   content: string | null;
+  status: "streaming" | "done" | "error";
   created_at: string;
+  updated_at: string;
 }
 
 export async function fetchGeneratedDocs(projectId?: string): Promise<PipelineGeneratedDocRow[]> {
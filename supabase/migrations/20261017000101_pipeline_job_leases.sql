@@ -0,0 +1,28 @@
+-- ============================================================
+-- Kostencheck worker: job leases, retries and dead-lettering
+-- ============================================================
+-- A claimed job carries a lease the worker keeps extending while it runs.
+-- If the worker dies (systemd restart, OOM during OCR) the lease expires and
+-- the reaper re-queues the job with exponential backoff (run_after), until
+-- it has used up its attempts and is parked as 'dead'.
+
+ALTER TABLE public.pipeline_jobs
+  ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS run_after TIMESTAMPTZ NOT NULL DEFAULT now(),
+  ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMPTZ,
+  ADD COLUMN IF NOT EXISTS locked_by TEXT;
+
+ALTER TABLE public.pipeline_jobs DROP CONSTRAINT IF EXISTS pipeline_jobs_status_check;
+ALTER TABLE public.pipeline_jobs
+  ADD CONSTRAINT pipeline_jobs_status_check
+  CHECK (status IN ('queued', 'processing', 'done', 'error', 'dead'));
+
+-- Claim path: oldest runnable job per stage.
+CREATE INDEX IF NOT EXISTS pipeline_jobs_queued_idx
+  ON public.pipeline_jobs (stage, created_at)
+  WHERE status = 'queued';
+
+-- Reaper path: expired leases only.
+CREATE INDEX IF NOT EXISTS pipeline_jobs_lease_idx
+  ON public.pipeline_jobs (lease_expires_at)
+  WHERE status = 'processing';
@@ -0,0 +1,13 @@
+-- ============================================================
+-- Kostencheck worker: content-addressed uploads
+-- ============================================================
+-- The worker stores uploads by SHA-256 and, when a company re-posts a file it
+-- already sent (ERP retry/resend), copies the earlier parse/extraction results
+-- instead of running parse, OCR and LLM extraction again.
+
+ALTER TABLE public.pipeline_documents
+  ADD COLUMN IF NOT EXISTS content_sha256 TEXT;
+
+CREATE INDEX IF NOT EXISTS pipeline_documents_content_sha256_idx
+  ON public.pipeline_documents (company_id, content_sha256)
+  WHERE content_sha256 IS NOT NULL;
@@ -0,0 +1,27 @@
+-- ============================================================
+-- Kostencheck worker: embedding backfill jobs
+-- ============================================================
+-- Embedding a company's imported project history runs as a 'backfill' job in
+-- the same queue as document stages. Those jobs belong to a company rather
+-- than a document, and keep their resume position (last embedded row id) in
+-- payload so a restarted worker carries on where the previous one stopped.
+
+ALTER TABLE public.pipeline_jobs
+  ALTER COLUMN document_id DROP NOT NULL,
+  ADD COLUMN IF NOT EXISTS company_id UUID REFERENCES public.pipeline_companies(id) ON DELETE CASCADE,
+  ADD COLUMN IF NOT EXISTS payload JSONB NOT NULL DEFAULT '{}'::jsonb;
+
+ALTER TABLE public.pipeline_jobs DROP CONSTRAINT IF EXISTS pipeline_jobs_stage_check;
+ALTER TABLE public.pipeline_jobs
+  ADD CONSTRAINT pipeline_jobs_stage_check
+  CHECK (stage IN ('parse', 'extract', 'diff', 'generate', 'backfill'));
+
+-- One pending backfill per company (enqueue_backfill checks against this).
+CREATE INDEX IF NOT EXISTS pipeline_jobs_backfill_idx
+  ON public.pipeline_jobs (company_id)
+  WHERE stage = 'backfill' AND status IN ('queued', 'processing');
+
+-- Keyset pagination over the rows still missing an embedding.
+CREATE INDEX IF NOT EXISTS pipeline_historical_projects_missing_embedding_idx
+  ON public.pipeline_historical_projects (company_id, id)
+  WHERE embedding IS NULL;
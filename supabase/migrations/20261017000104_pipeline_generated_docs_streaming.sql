@@ -0,0 +1,15 @@
+-- ============================================================
+-- Kostencheck worker: streamed generated documents
+-- ============================================================
+-- The generate stage inserts each document up front and writes its text as
+-- the LLM streams it, so the dashboard can show it while it's being written.
+-- status tells a partial document ('streaming') from a finished one.
+
+ALTER TABLE public.pipeline_generated_docs
+  ADD COLUMN IF NOT EXISTS status TEXT NOT NULL DEFAULT 'done',
+  ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+ALTER TABLE public.pipeline_generated_docs DROP CONSTRAINT IF EXISTS pipeline_generated_docs_status_check;
+ALTER TABLE public.pipeline_generated_docs
+  ADD CONSTRAINT pipeline_generated_docs_status_check
+  CHECK (status IN ('streaming', 'done', 'error'));
@@ -0,0 +1,22 @@
+-- ============================================================
+-- Kostencheck worker: API-key cache invalidation
+-- ============================================================
+-- Workers cache API key -> company in memory. Any change to a company's key
+-- (rotation, new company, deletion) is announced on the
+-- pipeline_companies_changed channel with the company id, so every worker
+-- drops the stale entry immediately instead of waiting for its TTL.
+
+CREATE OR REPLACE FUNCTION public.notify_pipeline_company_changed()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  PERFORM pg_notify('pipeline_companies_changed', COALESCE(NEW.id, OLD.id)::text);
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS pipeline_companies_changed ON public.pipeline_companies;
+CREATE TRIGGER pipeline_companies_changed
+  AFTER INSERT OR DELETE OR UPDATE OF api_key ON public.pipeline_companies
+  FOR EACH ROW EXECUTE FUNCTION public.notify_pipeline_company_changed();
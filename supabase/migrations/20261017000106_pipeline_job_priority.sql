@@ -0,0 +1,16 @@
+-- ============================================================
+-- Kostencheck worker: job priorities
+-- ============================================================
+-- Documents from the bulk intake endpoint (customer migrations, thousands of
+-- historical files) and embedding backfills are queued at a lower priority
+-- than interactive uploads, so a big import never delays a live Bestellung.
+-- Lower value = claimed first; follow-up stages inherit the priority.
+
+ALTER TABLE public.pipeline_jobs
+  ADD COLUMN IF NOT EXISTS priority SMALLINT NOT NULL DEFAULT 0;
+
+-- Claim path: best priority, then oldest, per stage.
+DROP INDEX IF EXISTS public.pipeline_jobs_queued_idx;
+CREATE INDEX IF NOT EXISTS pipeline_jobs_queued_idx
+  ON public.pipeline_jobs (stage, priority, created_at)
+  WHERE status = 'queued';
@@ -0,0 +1,10 @@
+-- ============================================================
+-- Kostencheck worker: document progress streams
+-- ============================================================
+-- Workers publish every job transition on the pipeline_document_progress
+-- channel (pg_notify, no table). A client opening a progress stream first
+-- gets the document's current state, read from its latest job.
+
+CREATE INDEX IF NOT EXISTS pipeline_jobs_document_idx
+  ON public.pipeline_jobs (document_id, created_at DESC)
+  WHERE document_id IS NOT NULL;
@@ -0,0 +1,11 @@
+-- ============================================================
+-- Kostencheck worker: look up documents by stored file
+-- ============================================================
+-- Uploads are content-addressed, so one stored file can back documents of
+-- several requests. Before an aborted batch removes a file it stored, the
+-- worker checks that no document (e.g. from a concurrent upload of the same
+-- content) has been recorded against it in the meantime.
+
+CREATE INDEX IF NOT EXISTS pipeline_documents_file_url_idx
+  ON public.pipeline_documents (file_url)
+  WHERE file_url IS NOT NULL;
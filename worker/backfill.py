@@ -0,0 +1,67 @@
+"""Embedding backfill for a company's historical projects, as a queue job.
+
+When a company imports its project history, every row needs a
+multilingual-e5 embedding before the copilot can find it. Instead of a
+hand-run loop, a 'backfill' job (db.enqueue_backfill) walks the company's
+un-embedded rows in id order, BACKFILL_BATCH_SIZE at a time:
+
+- embeds each page with one batched embed_passages call,
+- writes the vectors back with one UPDATE ... FROM (VALUES ...) per page,
+- checkpoints the last id into the job's payload, so a retry or a job the
+  reaper re-queued after a crash resumes there instead of starting over,
+- yields to document jobs: when any document stage is waiting, it queues a
+  continuation job BACKFILL_YIELD_SECONDS out and finishes, freeing its
+  slot (the scheduler caps backfills at BACKFILL_CONCURRENCY anyway).
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from typing import Any
+
+import db
+from config import BACKFILL_BATCH_SIZE, BACKFILL_YIELD_SECONDS
+from embeddings import embed_passages
+from vector_search import vector_search
+
+logger = logging.getLogger("kostencheck.backfill")
+
+
+def project_text(row: dict[str, Any]) -> str:
+    return f'{row["title"]}. {row.get("summary") or ""} {row.get("outcome") or ""}'.strip()
+
+
+def run_backfill(job: dict[str, Any]) -> None:
+    """Process one backfill job. Leaves the job finished, either complete or handed to a continuation."""
+    company_id = job["company_id"]
+    payload = dict(job.get("payload") or {})
+    cursor = payload.get("cursor")
+    embedded = int(payload.get("embedded") or 0)
+    started = time.monotonic()
+
+    while True:
+        rows = db.historical_projects_missing_embeddings(company_id, after_id=cursor, limit=BACKFILL_BATCH_SIZE)
+        if not rows:
+            break
+        vectors = embed_passages([project_text(row) for row in rows])
+        db.set_historical_embeddings([(row["id"], vector) for row, vector in zip(rows, vectors)])
+        cursor = str(rows[-1]["id"])
+        embedded += len(rows)
+        db.checkpoint_job(job["id"], {"cursor": cursor, "embedded": embedded})
+        vector_search.invalidate(company_id)
+
+        if len(rows) < BACKFILL_BATCH_SIZE:
+            break
+        if db.live_jobs_waiting():
+            with db.session():
+                # If the lease was lost, whoever holds the job now carries on instead.
+                if db.finish_job(job["id"], job["locked_by"], "done"):
+                    db.enqueue_backfill(company_id, cursor=cursor, delay_seconds=BACKFILL_YIELD_SECONDS,
+                                        embedded=embedded)
+            logger.info("backfill for %s yielded to document jobs after %d rows (%.1fs)",
+                        company_id, embedded, time.monotonic() - started)
+            return
+
+    db.finish_job(job["id"], job["locked_by"], "done")
+    logger.info("backfill for %s done: %d rows embedded (%.1fs)", company_id, embedded, time.monotonic() - started)
@@ -0,0 +1,199 @@
+"""Unpacking for the bulk intake endpoint (POST /api/v1/documents/batch).
+
+A batch is any number of PDFs and/or ZIP archives. Each ZIP entry is
+streamed straight into upload_store (never extracted to a temp dir or held
+in memory), subject to the same per-file size limit as single uploads.
+
+Which file is an Angebot and which a Bestellung comes from a manifest —
+a `manifest.json` / `manifest.csv` inside the ZIP or posted alongside:
+
+    [{"file": "2023/A-1001.pdf", "kind": "angebot", "doc_number": "A-1001"}, ...]
+
+    file;kind;doc_number
+    2023/A-1001.pdf;angebot;A-1001
+
+Files not listed in a manifest fall back to the request's `kind`.
+
+A BatchBudget caps what one batch may write in total (BATCH_UPLOAD_MAX_MB,
+the same as the request limit), so a small ZIP of highly compressible
+entries can't inflate to BATCH_MAX_FILES x UPLOAD_MAX_MB on disk. Going
+over aborts the batch and removes what it had stored.
+"""
+
+from __future__ import annotations
+
+import csv
+import io
+import json
+import logging
+import os
+import zipfile
+from dataclasses import dataclass, field
+from pathlib import PurePosixPath
+from typing import Any, BinaryIO
+
+import db
+from config import BATCH_UPLOAD_MAX_MB
+from upload_store import MAX_UPLOAD_BYTES, StoredUpload, UploadTooLarge, store_upload
+
+logger = logging.getLogger("kostencheck.batch_upload")
+
+KINDS = ("angebot", "bestellung")
+MANIFEST_NAMES = ("manifest.json", "manifest.csv")
+MAX_MANIFEST_BYTES = 16 * 1024 * 1024
+BATCH_UPLOAD_MAX_BYTES = int(BATCH_UPLOAD_MAX_MB * 1024 * 1024)
+
+
+class BatchError(ValueError):
+    """The batch as a whole is unusable (bad archive or manifest, too many files)."""
+
+
+class BatchTooLarge(BatchError):
+    """The batch's files add up to more than BATCH_UPLOAD_MAX_MB once stored (inflated)."""
+
+
+@dataclass
+class BatchBudget:
+    """Bytes one batch has stored so far, against `max_bytes`, and the files it created."""
+
+    max_bytes: int = BATCH_UPLOAD_MAX_BYTES
+    used: int = 0
+    stored: list[StoredUpload] = field(default_factory=list)
+
+    def file_limit(self) -> int:
+        # Cap each file at what's left, so a single entry can't overshoot the batch limit while inflating.
+        return max(0, min(MAX_UPLOAD_BYTES, self.max_bytes - self.used))
+
+    def over_budget(self) -> bool:
+        """Whether a file cut off at file_limit() was stopped by the batch limit rather than the per-file one."""
+        return self.max_bytes - self.used < MAX_UPLOAD_BYTES
+
+    def add(self, upload: StoredUpload) -> None:
+        self.stored.append(upload)
+        self.used += upload.size
+
+    def too_large(self) -> BatchTooLarge:
+        return BatchTooLarge(f"batch exceeds {self.max_bytes} bytes once unpacked")
+
+    def discard(self) -> None:
+        """Remove the files this batch stored (not ones that were already in the store).
+
+        A concurrent request may have uploaded the same content meanwhile and
+        recorded a document against the file; such files are kept. If that
+        can't be checked, everything is kept: an orphaned file is cheaper than
+        a document whose file is gone.
+        """
+        created = [upload for upload in self.stored if upload.created]
+        try:
+            in_use = db.referenced_files([str(upload.path) for upload in created])
+        except Exception:  # noqa: BLE001 — the batch is being rejected anyway
+            logger.warning("could not check which files of an aborted batch are in use; keeping them", exc_info=True)
+            in_use = {str(upload.path) for upload in created}
+        removed = 0
+        for upload in created:
+            if str(upload.path) in in_use:
+                continue
+            try:
+                os.unlink(upload.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        logger.info("discarded %d of %d stored files (%d bytes) of an aborted batch",
+                    removed, len(self.stored), self.used)
+        self.stored.clear()
+
+
+@dataclass
+class BatchItem:
+    file: str
+    upload: StoredUpload | None = None
+    kind: str | None = None
+    doc_number: str | None = None
+    error: str | None = None
+
+
+def parse_manifest(data: bytes, name: str) -> dict[str, dict[str, Any]]:
+    """Manifest entries keyed by file path."""
+    try:
+        text = data.decode("utf-8-sig")
+        if name.lower().endswith(".csv"):
+            dialect = csv.Sniffer().sniff(text.splitlines()[0] if text else ",", delimiters=",;\t")
+            rows = list(csv.DictReader(io.StringIO(text), dialect=dialect))
+        else:
+            rows = json.loads(text)
+            if isinstance(rows, dict):
+                rows = rows.get("documents") or rows.get("files") or []
+    except (UnicodeDecodeError, ValueError, csv.Error) as exc:
+        raise BatchError(f"unreadable manifest {name}: {exc}") from exc
+    entries = {}
+    for row in rows:
+        if not isinstance(row, dict) or not row.get("file"):
+            raise BatchError(f"manifest {name}: every entry needs a 'file'")
+        entries[normalise_path(str(row["file"]))] = {
+            "kind": (row.get("kind") or "").strip().lower() or None,
+            "doc_number": (row.get("doc_number") or "").strip() or None,
+        }
+    return entries
+
+
+def normalise_path(path: str) -> str:
+    return str(PurePosixPath(path.replace("\\", "/").lstrip("/")))
+
+
+def store_zip(source: BinaryIO, archive_name: str, max_files: int,
+              budget: BatchBudget) -> tuple[list[BatchItem], dict[str, dict[str, Any]]]:
+    """Store every PDF in the archive; returns the items and the archive's own manifest (if any). Blocking.
+
+    Raises BatchTooLarge once the batch's `budget` is used up; the caller discards what was stored.
+    """
+    try:
+        archive = zipfile.ZipFile(source)
+    except zipfile.BadZipFile as exc:
+        raise BatchError(f"{archive_name} is not a valid ZIP archive") from exc
+    items: list[BatchItem] = []
+    manifest: dict[str, dict[str, Any]] = {}
+    with archive:
+        members = [m for m in archive.infolist() if not m.is_dir() and not _is_junk(m.filename)]
+        documents = [m for m in members if m.filename.lower().endswith(".pdf")]
+        if len(documents) > max_files:
+            raise BatchError(f"{archive_name} holds {len(documents)} PDFs, at most {max_files} per batch")
+        for member in members:
+            name = normalise_path(member.filename)
+            if PurePosixPath(name).name.lower() in MANIFEST_NAMES:
+                if member.file_size > MAX_MANIFEST_BYTES:
+                    raise BatchError(f"manifest {name} is too large")
+                manifest.update(parse_manifest(archive.read(member), name))
+        for member in documents:
+            item = BatchItem(file=normalise_path(member.filename))
+            # file_size is what the archive claims; store_upload enforces the real size while inflating.
+            if member.file_size > MAX_UPLOAD_BYTES:
+                item.error = f"exceeds {MAX_UPLOAD_BYTES} bytes"
+            else:
+                try:
+                    with archive.open(member) as entry:
+                        item.upload = store_upload(entry, member.filename, max_bytes=budget.file_limit())
+                    budget.add(item.upload)
+                except UploadTooLarge as exc:
+                    if budget.over_budget():
+                        raise budget.too_large() from exc
+                    item.error = str(exc)
+                except (zipfile.BadZipFile, RuntimeError, NotImplementedError) as exc:  # corrupt / encrypted
+                    item.error = f"unreadable entry: {exc}"
+            items.append(item)
+    return items, manifest
+
+
+def _is_junk(name: str) -> bool:
+    parts = PurePosixPath(name).parts
+    return any(part.startswith(".") or part == "__MACOSX" for part in parts)
+
+
+def apply_manifest(items: list[BatchItem], manifest: dict[str, dict[str, Any]], default_kind: str | None) -> None:
+    """Fill in kind/doc_number from the manifest (by path, then by bare file name) or the default kind."""
+    by_name = {PurePosixPath(path).name: entry for path, entry in manifest.items()}
+    for item in items:
+        entry = manifest.get(item.file) or by_name.get(PurePosixPath(item.file).name) or {}
+        item.kind = entry.get("kind") or default_kind
+        item.doc_number = entry.get("doc_number") or item.doc_number
+        if item.error is None and item.kind not in KINDS:
+            item.error = "kind must be 'angebot' or 'bestellung' (set it in the manifest or as ?kind=)"
@@ -6,6 +6,7 @@ Loaded from a local .env file (see .env.example). Never commit real secrets.
 from __future__ import annotations
 
 import os
+import socket
 
 from dotenv import load_dotenv
 
@@ -22,6 +23,142 @@ def _require(name: str) -> str:
 DATABASE_URL = _require("DATABASE_URL")
 GROQ_API_KEY = _require("GROQ_API_KEY")
 GROQ_MODEL = os.environ.get("GROQ_MODEL", "llama-3.3-70b-versatile")
+# Per-process cap on concurrent Groq requests (see groq_client.gather).
+GROQ_MAX_CONCURRENCY = int(os.environ.get("GROQ_MAX_CONCURRENCY", "4"))
+# Groq account limits for GROQ_MODEL (console.groq.com/settings/limits); see llm_scheduler.py.
+GROQ_RPM_LIMIT = int(os.environ.get("GROQ_RPM_LIMIT", "30"))
+GROQ_TPM_LIMIT = int(os.environ.get("GROQ_TPM_LIMIT", "12000"))
+GROQ_MAX_RETRIES = int(os.environ.get("GROQ_MAX_RETRIES", "5"))
 EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "intfloat/multilingual-e5-small")
+# "torch" or "onnx" (see embeddings.py); the ONNX file is relative to the model repo.
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "torch")
+EMBEDDING_ONNX_FILE = os.environ.get("EMBEDDING_ONNX_FILE", "onnx/model_qint8_arm64.onnx")
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "32"))
+# Embedding vector cache (embedding_cache.py): in-memory LRU in front of a SQLite file.
+EMBEDDING_CACHE_ENABLED = os.environ.get("EMBEDDING_CACHE_ENABLED", "true").lower() not in ("0", "false", "no")
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", "/var/lib/kostencheck/embedding_cache.sqlite3")
+EMBEDDING_CACHE_MEMORY_ITEMS = int(os.environ.get("EMBEDDING_CACHE_MEMORY_ITEMS", "20000"))
+EMBEDDING_CACHE_MAX_MB = float(os.environ.get("EMBEDDING_CACHE_MAX_MB", "512"))
+EMBEDDING_CACHE_DTYPE = os.environ.get("EMBEDDING_CACHE_DTYPE", "float16")
 PORT = int(os.environ.get("PORT", "8200"))
-POLL_INTERVAL_SECONDS = float(os.environ.get("POLL_INTERVAL_SECONDS", "3"))
+# Idle runners are woken by NOTIFY on JOB_NOTIFY_CHANNEL (see job_notify.py);
+# polling is only the safety net, so the interval can be long.
+POLL_INTERVAL_SECONDS = float(os.environ.get("POLL_INTERVAL_SECONDS", "30"))
+JOB_NOTIFY_CHANNEL = os.environ.get("JOB_NOTIFY_CHANNEL", "pipeline_jobs")
+
+# Connection pool towards the Supavisor session pooler. Keep DB_POOL_MAX_SIZE
+# below the pooler's per-user session limit, summed over all worker instances.
+# DB_POOL_MAX_SIZE itself is defined below the settings its default is derived from.
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_LIFETIME_SECONDS = float(os.environ.get("DB_POOL_MAX_LIFETIME_SECONDS", "1800"))
+DB_POOL_HEALTHCHECK_IDLE_SECONDS = float(os.environ.get("DB_POOL_HEALTHCHECK_IDLE_SECONDS", "30"))
+DB_POOL_ACQUIRE_TIMEOUT_SECONDS = float(os.environ.get("DB_POOL_ACQUIRE_TIMEOUT_SECONDS", "10"))
+
+# Job scheduler (scheduler.py). `parse` is CPU-bound, the rest mostly wait on
+# Groq, so those caps are really an LLM-quota knob. `backfill` (embedding
+# imported history) is CPU-bound too and kept to one. JOB_MAX_IN_FLIGHT bounds
+# the total; each job may hold a session (see DB_POOL_REQUIRED_SIZE).
+STAGE_CONCURRENCY = {
+    "parse": int(os.environ.get("PARSE_CONCURRENCY", str(os.cpu_count() or 1))),
+    "extract": int(os.environ.get("EXTRACT_CONCURRENCY", "2")),
+    "diff": int(os.environ.get("DIFF_CONCURRENCY", "2")),
+    "generate": int(os.environ.get("GENERATE_CONCURRENCY", "2")),
+    "backfill": int(os.environ.get("BACKFILL_CONCURRENCY", "1")),
+}
+JOB_MAX_IN_FLIGHT = int(os.environ.get("JOB_MAX_IN_FLIGHT", "4"))
+# Let a job run the following stages itself when they have a free slot (scheduler.py).
+PIPELINE_FUSE_STAGES = os.environ.get("PIPELINE_FUSE_STAGES", "true").lower() not in ("0", "false", "no")
+JOB_CLAIM_BATCH_SIZE = int(os.environ.get("JOB_CLAIM_BATCH_SIZE", str(JOB_MAX_IN_FLIGHT)))
+
+# Job leases. A claimed job must be heartbeated within JOB_LEASE_SECONDS or the
+# reaper re-queues it (backoff doubling from JOB_RETRY_BACKOFF_SECONDS) until
+# it has been attempted JOB_MAX_ATTEMPTS times, after which it goes to 'dead'.
+WORKER_ID = os.environ.get("WORKER_ID", f"{socket.gethostname()}:{os.getpid()}")
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "120"))
+JOB_HEARTBEAT_SECONDS = float(os.environ.get("JOB_HEARTBEAT_SECONDS", "30"))
+JOB_REAPER_INTERVAL_SECONDS = float(os.environ.get("JOB_REAPER_INTERVAL_SECONDS", "60"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BACKOFF_SECONDS = float(os.environ.get("JOB_RETRY_BACKOFF_SECONDS", "30"))
+JOB_RETRY_BACKOFF_MAX_SECONDS = float(os.environ.get("JOB_RETRY_BACKOFF_MAX_SECONDS", "900"))
+
+# Page-level PDF parsing (parsing.py). Pages fan out to PARSE_WORKERS processes;
+# each page gets PARSE_PAGE_TIMEOUT_SECONDS, most of which OCR may consume.
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", str(os.cpu_count() or 1)))
+PARSE_PAGE_TIMEOUT_SECONDS = float(os.environ.get("PARSE_PAGE_TIMEOUT_SECONDS", "60"))
+PARSE_MAX_TASKS_PER_CHILD = int(os.environ.get("PARSE_MAX_TASKS_PER_CHILD", "200"))
+
+# Tiered OCR (ocr.py). "adaptive" checks at OCR_DETECT_RESOLUTION whether a page
+# holds text lines at all before OCRing only those regions; "full" OCRs every
+# flagged page whole at OCR_RESOLUTION.
+OCR_MODE = os.environ.get("OCR_MODE", "adaptive")
+OCR_RESOLUTION = int(os.environ.get("OCR_RESOLUTION", "300"))
+OCR_DETECT_RESOLUTION = int(os.environ.get("OCR_DETECT_RESOLUTION", "72"))
+OCR_BLANK_INK_RATIO = float(os.environ.get("OCR_BLANK_INK_RATIO", "0.002"))
+OCR_MIN_TEXT_LINES = int(os.environ.get("OCR_MIN_TEXT_LINES", "3"))
+# Share of a page's ink in bands too tall for a text line above which the page is OCR'd whole.
+OCR_TALL_BAND_INK_SHARE = float(os.environ.get("OCR_TALL_BAND_INK_SHARE", "0.3"))
+
+# Generated documents are streamed into pipeline_generated_docs at most this often.
+GENERATE_FLUSH_SECONDS = float(os.environ.get("GENERATE_FLUSH_SECONDS", "0.5"))
+
+# Embedding backfill jobs (backfill.py): rows per embed/write batch, and how
+# long a backfill that yielded to document jobs waits before continuing.
+BACKFILL_BATCH_SIZE = int(os.environ.get("BACKFILL_BATCH_SIZE", "256"))
+BACKFILL_YIELD_SECONDS = float(os.environ.get("BACKFILL_YIELD_SECONDS", "10"))
+
+# Vector search over historical projects (vector_search.py). Index type is
+# "hnsw" or "ivfflat", built per distance op in VECTOR_INDEX_OPS at startup.
+VECTOR_INDEX_TYPE = os.environ.get("VECTOR_INDEX_TYPE", "hnsw")
+VECTOR_INDEX_OPS = [op.strip() for op in os.environ.get("VECTOR_INDEX_OPS", "cosine").split(",") if op.strip()]
+VECTOR_HNSW_M = int(os.environ.get("VECTOR_HNSW_M", "16"))
+VECTOR_HNSW_EF_CONSTRUCTION = int(os.environ.get("VECTOR_HNSW_EF_CONSTRUCTION", "64"))
+VECTOR_IVFFLAT_LISTS = int(os.environ.get("VECTOR_IVFFLAT_LISTS", "100"))
+VECTOR_EF_SEARCH = int(os.environ.get("VECTOR_EF_SEARCH", "40"))
+VECTOR_IVFFLAT_PROBES = int(os.environ.get("VECTOR_IVFFLAT_PROBES", "10"))
+VECTOR_ITERATIVE_SCAN = os.environ.get("VECTOR_ITERATIVE_SCAN", "")
+# Companies with at most this many embedded projects are searched in memory (0 disables).
+VECTOR_LOCAL_MAX_ROWS = int(os.environ.get("VECTOR_LOCAL_MAX_ROWS", "5000"))
+VECTOR_LOCAL_TTL_SECONDS = float(os.environ.get("VECTOR_LOCAL_TTL_SECONDS", "300"))
+VECTOR_RECALL_SAMPLE_RATE = float(os.environ.get("VECTOR_RECALL_SAMPLE_RATE", "0.05"))
+
+# Groq response cache (llm_cache.py). LLM_CACHE_ENABLED=false bypasses it entirely.
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE_ENABLED", "true").lower() not in ("0", "false", "no")
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", "/var/lib/kostencheck/llm_cache.sqlite3")
+LLM_CACHE_TTL_SECONDS = float(os.environ.get("LLM_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+LLM_CACHE_MAX_MB = float(os.environ.get("LLM_CACHE_MAX_MB", "256"))
+
+# API intake (main.py): largest accepted upload, and the thread pool that runs
+# intake's database calls off the event loop.
+UPLOAD_MAX_MB = float(os.environ.get("UPLOAD_MAX_MB", "50"))
+INTAKE_DB_WORKERS = int(os.environ.get("INTAKE_DB_WORKERS", "4"))
+
+# Threads that can hold a pooled connection at the same time: job threads,
+# intake threads, the Groq gather pool (generated docs streamed into their
+# rows), the scheduler's claim/heartbeat/reaper calls, and a reserve for
+# sync API handlers (Starlette's threadpool). DB_POOL_MAX_SIZE defaults to
+# that sum; anything smaller risks PoolTimeout under load (db.warm_up_pool
+# warns at startup).
+DB_POOL_SYNC_HANDLER_RESERVE = int(os.environ.get("DB_POOL_SYNC_HANDLER_RESERVE", "2"))
+DB_POOL_REQUIRED_SIZE = (
+    JOB_MAX_IN_FLIGHT + INTAKE_DB_WORKERS + GROQ_MAX_CONCURRENCY + 3 + DB_POOL_SYNC_HANDLER_RESERVE
+)
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", str(DB_POOL_REQUIRED_SIZE)))
+# Bulk intake (POST /api/v1/documents/batch): cap on the request and on what
+# its files add up to once ZIPs are unpacked, and PDFs per batch.
+BATCH_UPLOAD_MAX_MB = float(os.environ.get("BATCH_UPLOAD_MAX_MB", "1024"))
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", "2000"))
+
+# API-key cache (tenant_cache.py). Unknown keys are cached separately, briefly
+# and in a bounded LRU.
+TENANT_CACHE_TTL_SECONDS = float(os.environ.get("TENANT_CACHE_TTL_SECONDS", "300"))
+TENANT_NEGATIVE_TTL_SECONDS = float(os.environ.get("TENANT_NEGATIVE_TTL_SECONDS", "30"))
+TENANT_NEGATIVE_CACHE_SIZE = int(os.environ.get("TENANT_NEGATIVE_CACHE_SIZE", "1024"))
+
+# Document progress streams (progress.py): events buffered per slow client,
+# and the keep-alive interval for idle streams.
+PROGRESS_QUEUE_SIZE = int(os.environ.get("PROGRESS_QUEUE_SIZE", "64"))
+PROGRESS_KEEPALIVE_SECONDS = float(os.environ.get("PROGRESS_KEEPALIVE_SECONDS", "15"))
+
+# Documents longer than this are extracted in parallel chunks (extraction.py)
+# instead of in one call; it's also the size of each chunk.
+EXTRACT_CHUNK_CHARS = int(os.environ.get("EXTRACT_CHUNK_CHARS", "12000"))
@@ -4,31 +4,245 @@ Uses a direct psycopg2 connection (the worker needs joins and jsonb writes
 that are simplest expressed as plain SQL) rather than the Supabase REST
 client. Connect via the Postgres connection string with the service role
 (bypasses RLS, which is expected for a trusted backend worker).
+
+Connections come from a small in-process pool: every fresh connect to the
+Supavisor pooler is a full TCP+TLS+auth handshake, which used to dominate
+a pipeline stage that issues dozens of statements. Wrap a unit of work in
+``session()`` to run all helpers below on one connection in one transaction.
 """
 
 from __future__ import annotations
 
 import json
+import logging
+import threading
+import time
 from contextlib import contextmanager
 from typing import Any, Iterator
 
 import psycopg2
 import psycopg2.extras
 
-from config import DATABASE_URL
+from config import (
+    DATABASE_URL,
+    DB_POOL_ACQUIRE_TIMEOUT_SECONDS,
+    DB_POOL_HEALTHCHECK_IDLE_SECONDS,
+    DB_POOL_MAX_LIFETIME_SECONDS,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_MIN_SIZE,
+    DB_POOL_REQUIRED_SIZE,
+    JOB_LEASE_SECONDS,
+    JOB_MAX_ATTEMPTS,
+    JOB_NOTIFY_CHANNEL,
+    JOB_RETRY_BACKOFF_MAX_SECONDS,
+    JOB_RETRY_BACKOFF_SECONDS,
+    VECTOR_EF_SEARCH,
+    VECTOR_ITERATIVE_SCAN,
+    VECTOR_IVFFLAT_PROBES,
+)
+
+logger = logging.getLogger("kostencheck.db")
+
+
+class PoolTimeout(RuntimeError):
+    """No connection became available within DB_POOL_ACQUIRE_TIMEOUT_SECONDS."""
+
+
+class _PooledConnection:
+    __slots__ = ("conn", "created_at", "last_used_at")
+
+    def __init__(self, conn: psycopg2.extensions.connection) -> None:
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used_at = self.created_at
+
+
+class ConnectionPool:
+    """Thread-safe bounded pool with idle health checks and a max connection lifetime.
+
+    psycopg2's own ThreadedConnectionPool neither validates connections nor
+    recycles them, and the Supavisor pooler drops idle sessions after a
+    while, so a connection can look open but fail on first use.
+    """
+
+    def __init__(self, dsn: str, min_size: int, max_size: int, max_lifetime: float,
+                 healthcheck_idle: float, acquire_timeout: float) -> None:
+        self._dsn = dsn
+        self._min_size = min_size
+        self._max_size = max(max_size, 1)
+        self._max_lifetime = max_lifetime
+        self._healthcheck_idle = healthcheck_idle
+        self._acquire_timeout = acquire_timeout
+        self._idle: list[_PooledConnection] = []
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._stats = {"connects": 0, "acquires": 0, "waits": 0, "timeouts": 0,
+                       "healthcheck_failures": 0, "recycled": 0, "discarded": 0}
+
+    def _connect(self) -> _PooledConnection:
+        conn = psycopg2.connect(self._dsn)
+        with self._cond:
+            self._stats["connects"] += 1
+        return _PooledConnection(conn)
+
+    def _expired(self, pooled: _PooledConnection) -> bool:
+        return time.monotonic() - pooled.created_at > self._max_lifetime
+
+    def _healthy(self, pooled: _PooledConnection) -> bool:
+        if pooled.conn.closed:
+            return False
+        if time.monotonic() - pooled.last_used_at < self._healthcheck_idle:
+            return True
+        try:
+            with pooled.conn.cursor() as cur:
+                cur.execute("select 1")
+            pooled.conn.rollback()
+            return True
+        except psycopg2.Error:
+            with self._cond:
+                self._stats["healthcheck_failures"] += 1
+            return False
+
+    @staticmethod
+    def _close(pooled: _PooledConnection) -> None:
+        try:
+            pooled.conn.close()
+        except psycopg2.Error:
+            pass
+
+    def acquire(self) -> _PooledConnection:
+        deadline = time.monotonic() + self._acquire_timeout
+        with self._cond:
+            self._stats["acquires"] += 1
+            while not self._idle and self._in_use >= self._max_size:
+                self._stats["waits"] += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    if not self._idle and self._in_use >= self._max_size:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(f"no database connection available after {self._acquire_timeout}s")
+            pooled = self._idle.pop() if self._idle else None
+            self._in_use += 1
+
+        try:
+            # Validate outside the lock so a slow health check doesn't block other threads.
+            while pooled is not None and (self._expired(pooled) or not self._healthy(pooled)):
+                self._close(pooled)
+                with self._cond:
+                    self._stats["recycled"] += 1
+                    pooled = self._idle.pop() if self._idle else None
+            if pooled is None:
+                pooled = self._connect()
+        except BaseException:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return pooled
+
+    def release(self, pooled: _PooledConnection, discard: bool = False) -> None:
+        pooled.last_used_at = time.monotonic()
+        keep = not discard and not pooled.conn.closed and not self._expired(pooled)
+        with self._cond:
+            self._in_use -= 1
+            if keep:
+                self._idle.append(pooled)
+            else:
+                self._stats["discarded"] += 1
+            self._cond.notify()
+        if not keep:
+            self._close(pooled)
+
+    def warm_up(self) -> None:
+        """Open min_size connections up front so the first jobs don't pay the handshake."""
+        with self._cond:
+            missing = self._min_size - len(self._idle) - self._in_use
+        for _ in range(max(missing, 0)):
+            pooled = self._connect()
+            with self._cond:
+                self._idle.append(pooled)
+                self._cond.notify()
+
+    def close(self) -> None:
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for pooled in idle:
+            self._close(pooled)
+
+    def stats(self) -> dict[str, Any]:
+        with self._cond:
+            return {
+                "min_size": self._min_size,
+                "max_size": self._max_size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                **self._stats,
+            }
+
+
+_pool = ConnectionPool(
+    DATABASE_URL,
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=DB_POOL_MAX_SIZE,
+    max_lifetime=DB_POOL_MAX_LIFETIME_SECONDS,
+    healthcheck_idle=DB_POOL_HEALTHCHECK_IDLE_SECONDS,
+    acquire_timeout=DB_POOL_ACQUIRE_TIMEOUT_SECONDS,
+)
+_local = threading.local()
+
+
+def warm_up_pool() -> None:
+    if DB_POOL_MAX_SIZE < DB_POOL_REQUIRED_SIZE:
+        logger.warning(
+            "DB_POOL_MAX_SIZE=%d is below the %d threads that can hold a connection at once "
+            "(see DB_POOL_REQUIRED_SIZE in config.py); expect PoolTimeout under load",
+            DB_POOL_MAX_SIZE, DB_POOL_REQUIRED_SIZE,
+        )
+    _pool.warm_up()
+
+
+def close_pool() -> None:
+    _pool.close()
+
+
+def pool_stats() -> dict[str, Any]:
+    return _pool.stats()
 
 
 @contextmanager
-def get_conn() -> Iterator[psycopg2.extensions.connection]:
-    conn = psycopg2.connect(DATABASE_URL)
+def session() -> Iterator[psycopg2.extensions.connection]:
+    """Unit of work: every helper called inside shares one connection and one transaction.
+
+    Commits on clean exit, rolls back on any exception. Nested session() calls
+    join the outer transaction rather than opening a second connection.
+    """
+    current = getattr(_local, "conn", None)
+    if current is not None:
+        yield current
+        return
+
+    pooled = _pool.acquire()
+    conn = pooled.conn
+    _local.conn = conn
+    broken = False
     try:
         yield conn
         conn.commit()
-    except Exception:
-        conn.rollback()
+    except BaseException:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            broken = True
         raise
     finally:
-        conn.close()
+        _local.conn = None
+        _pool.release(pooled, discard=broken or conn.closed != 0)
+
+
+@contextmanager
+def get_conn() -> Iterator[psycopg2.extensions.connection]:
+    with session() as conn:
+        yield conn
 
 
 def fetch_one(query: str, params: tuple = ()) -> dict[str, Any] | None:
@@ -63,50 +277,287 @@ def get_company_by_api_key(api_key: str) -> dict[str, Any] | None:
     return fetch_one("select * from pipeline_companies where api_key = %s", (api_key,))
 
 
-def insert_document(company_id: str, kind: str, doc_number: str | None, file_url: str | None) -> str:
+def insert_document(company_id: str, kind: str, doc_number: str | None, file_url: str | None,
+                    content_sha256: str | None = None) -> str:
     return execute_returning_id(
         """
-        insert into pipeline_documents (company_id, kind, doc_number, file_url, status)
-        values (%s, %s, %s, %s, 'uploaded')
+        insert into pipeline_documents (company_id, kind, doc_number, file_url, content_sha256, status)
+        values (%s, %s, %s, %s, %s, 'uploaded')
         returning id
         """,
-        (company_id, kind, doc_number, file_url),
+        (company_id, kind, doc_number, file_url, content_sha256),
     )
 
 
-def enqueue_job(document_id: str, stage: str) -> str:
-    return execute_returning_id(
-        "insert into pipeline_jobs (document_id, stage, status) values (%s, %s, 'queued') returning id",
-        (document_id, stage),
+def insert_documents(company_id: str, documents: list[tuple[str, str | None, str, str]]) -> list[str]:
+    """Insert (kind, doc_number, file_url, content_sha256) rows in one statement; ids in input order."""
+    if not documents:
+        return []
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            rows = psycopg2.extras.execute_values(
+                cur,
+                """
+                insert into pipeline_documents (company_id, kind, doc_number, file_url, content_sha256, status)
+                values %s
+                returning id
+                """,
+                [(company_id, *document) for document in documents],
+                template="(%s, %s, %s, %s, %s, 'uploaded')",
+                fetch=True,
+                page_size=len(documents),
+            )
+    return [str(row[0]) for row in rows]
+
+
+def referenced_files(file_urls: list[str]) -> set[str]:
+    """Which of `file_urls` some document row points at."""
+    if not file_urls:
+        return set()
+    rows = fetch_all(
+        "select distinct file_url from pipeline_documents where file_url = any(%s::text[])",
+        (list(file_urls),),
+    )
+    return {row["file_url"] for row in rows}
+
+
+def find_processed_duplicates(company_id: str, content_hashes: list[str],
+                              exclude_document_ids: list[str]) -> dict[str, dict[str, Any]]:
+    """Most useful earlier upload of each file for this company, keyed by hash: extracted beats merely parsed.
+
+    Returns id plus an `extracted` flag, not the rows themselves — raw_text
+    can be large and is copied server-side by clone_document_results.
+    """
+    if not content_hashes:
+        return {}
+    rows = fetch_all(
+        """
+        select distinct on (content_sha256)
+            content_sha256, id, coalesce(metadata ? 'clauses', false) as extracted
+        from pipeline_documents
+        where company_id = %s and content_sha256 = any(%s) and not (id::text = any(%s))
+          and raw_text is not null and status <> 'error'
+        order by content_sha256, coalesce(metadata ? 'clauses', false) desc, uploaded_at desc
+        """,
+        (company_id, list(set(content_hashes)), exclude_document_ids),
+    )
+    return {row["content_sha256"]: row for row in rows}
+
+
+def clone_document_results(source_id: str, target_id: str, include_extraction: bool) -> None:
+    """Copy parsed text (and optionally extracted metadata + line items) from one document to another."""
+    with session():
+        execute(
+            """
+            update pipeline_documents t
+            set raw_text = s.raw_text,
+                status = 'parsed',
+                metadata = case when %s
+                    then coalesce(s.metadata, '{}'::jsonb) || jsonb_build_object('duplicate_of', s.id)
+                    else coalesce(t.metadata, '{}'::jsonb) || jsonb_build_object('duplicate_of', s.id)
+                end
+            from pipeline_documents s
+            where s.id = %s and t.id = %s
+            """,
+            (include_extraction, source_id, target_id),
+        )
+        if include_extraction:
+            execute(
+                """
+                insert into pipeline_line_items
+                    (document_id, position_no, article_no, description, qty, unit_price, delivery_date, raw)
+                select %s, position_no, article_no, description, qty, unit_price, delivery_date, raw
+                from pipeline_line_items
+                where document_id = %s
+                """,
+                (target_id, source_id),
+            )
+
+
+# Lower is claimed first. Follow-up stages inherit their job's priority.
+JOB_PRIORITY_INTERACTIVE = 0
+JOB_PRIORITY_BATCH = 10
+
+
+def enqueue_job(document_id: str, stage: str, priority: int = JOB_PRIORITY_INTERACTIVE) -> str:
+    """Queue a stage and wake idle runners; the NOTIFY is delivered when this transaction commits."""
+    return enqueue_jobs([(document_id, stage)], priority)[0]
+
+
+def enqueue_jobs(jobs: list[tuple[str, str]], priority: int = JOB_PRIORITY_INTERACTIVE) -> list[str]:
+    """Queue (document_id, stage) pairs in one statement, with one NOTIFY per stage. Ids in input order."""
+    if not jobs:
+        return []
+    with session() as conn:
+        with conn.cursor() as cur:
+            rows = psycopg2.extras.execute_values(
+                cur,
+                "insert into pipeline_jobs (document_id, stage, status, priority) values %s returning id",
+                [(document_id, stage, priority) for document_id, stage in jobs],
+                template="(%s, %s, 'queued', %s)",
+                fetch=True,
+                page_size=len(jobs),
+            )
+        for stage in sorted({stage for _, stage in jobs}):
+            execute("select pg_notify(%s, %s)", (JOB_NOTIFY_CHANNEL, stage))
+    return [str(row[0]) for row in rows]
+
+
+# Exponential backoff for a job going back to the queue: base * 2^(attempts-1), capped.
+_RETRY_DELAY_SQL = "make_interval(secs => least(%s * power(2, greatest(attempts - 1, 0)), %s))"
+
+
+def claim_jobs(stage_slots: dict[str, int], limit: int, worker_id: str) -> list[dict[str, Any]]:
+    """Atomically claim up to `limit` queued jobs in one round-trip, so multiple worker instances don't race.
+
+    `stage_slots` caps how many jobs of each stage may be taken, so the
+    scheduler never claims work for a stage that's already at its concurrency
+    cap. Every claimed job gets a lease of JOB_LEASE_SECONDS that the owner
+    must keep extending (extend_leases) or the reaper hands it to someone else.
+    """
+    stages = [stage for stage, slots in stage_slots.items() if slots > 0]
+    if not stages or limit <= 0:
+        return []
+    return fetch_all(
+        """
+        update pipeline_jobs
+        set status = 'processing', attempts = attempts + 1, locked_by = %s,
+            lease_expires_at = now() + make_interval(secs => %s), updated_at = now()
+        where id in (
+            select c.id
+            from unnest(%s::text[], %s::int[]) as s(stage, slots)
+            cross join lateral (
+                select id, priority, created_at from pipeline_jobs
+                where status = 'queued' and stage = s.stage and run_after <= now()
+                order by priority, created_at
+                for update skip locked
+                limit s.slots
+            ) c
+            order by c.priority, c.created_at
+            limit %s
+        )
+        returning *
+        """,
+        (worker_id, JOB_LEASE_SECONDS, stages, [stage_slots[stage] for stage in stages], limit),
+    )
+
+
+def seconds_until_next_job(stages: list[str]) -> float | None:
+    """How long until the earliest queued job of `stages` becomes runnable (<= 0: it is); None if none is queued.
+
+    Delayed jobs (retries in backoff, throttled backfill continuations) send no
+    NOTIFY when they come due, so an idle scheduler wakes up for them itself.
+    """
+    if not stages:
+        return None
+    row = fetch_one(
+        """
+        select extract(epoch from min(run_after) - now())::float8 as seconds
+        from pipeline_jobs
+        where status = 'queued' and stage = any(%s::text[])
+        """,
+        (list(stages),),
+    )
+    return row["seconds"] if row else None
+
+
+def start_job(document_id: str, stage: str, worker_id: str,
+              priority: int = JOB_PRIORITY_INTERACTIVE) -> dict[str, Any]:
+    """Insert a stage job already claimed by `worker_id`, for a worker running it straight away.
+
+    It carries a lease like any claimed job, so if the worker dies the reaper
+    re-queues it and the stage runs again the normal way.
+    """
+    return fetch_one(
+        """
+        insert into pipeline_jobs (document_id, stage, status, priority, attempts, locked_by, lease_expires_at)
+        values (%s, %s, 'processing', %s, 1, %s, now() + make_interval(secs => %s))
+        returning *
+        """,
+        (document_id, stage, priority, worker_id, JOB_LEASE_SECONDS),
+    )
+
+
+def extend_leases(job_ids: list[str], worker_id: str) -> set[str]:
+    """Heartbeat for running jobs. Returns the ids still owned by this worker."""
+    if not job_ids:
+        return set()
+    rows = fetch_all(
+        """
+        update pipeline_jobs
+        set lease_expires_at = now() + make_interval(secs => %s), updated_at = now()
+        where id = any(%s::uuid[]) and status = 'processing' and locked_by = %s
+        returning id
+        """,
+        (JOB_LEASE_SECONDS, list(job_ids), worker_id),
     )
+    return {str(row["id"]) for row in rows}
 
 
-def claim_next_job() -> dict[str, Any] | None:
-    """Atomically claim the oldest queued job so multiple worker instances don't race."""
+def finish_job(job_id: str, worker_id: str, status: str, error_message: str | None = None) -> int:
+    """Close a job this worker holds. Returns 0 if it no longer does (lease lost and reaped), else 1."""
     with get_conn() as conn:
-        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        with conn.cursor() as cur:
             cur.execute(
                 """
                 update pipeline_jobs
-                set status = 'processing', updated_at = now()
-                where id = (
-                    select id from pipeline_jobs
-                    where status = 'queued'
-                    order by created_at
-                    for update skip locked
-                    limit 1
-                )
-                returning *
-                """
+                set status = %s, error_message = %s, lease_expires_at = null, locked_by = null, updated_at = now()
+                where id = %s and locked_by = %s
+                """,
+                (status, error_message, job_id, worker_id),
             )
-            row = cur.fetchone()
-            return dict(row) if row else None
+            return cur.rowcount
+
+
+def fail_job(job_id: str, worker_id: str, error_message: str) -> str | None:
+    """Re-queue a failed job with backoff, or dead-letter it after JOB_MAX_ATTEMPTS.
+
+    Returns the new status, or None if this worker no longer holds the job.
+    """
+    row = fetch_one(
+        f"""
+        update pipeline_jobs
+        set status = case when attempts >= %s then 'dead' else 'queued' end,
+            run_after = now() + {_RETRY_DELAY_SQL},
+            error_message = %s, lease_expires_at = null, locked_by = null, updated_at = now()
+        where id = %s and locked_by = %s
+        returning status
+        """,
+        (JOB_MAX_ATTEMPTS, JOB_RETRY_BACKOFF_SECONDS, JOB_RETRY_BACKOFF_MAX_SECONDS, error_message,
+         job_id, worker_id),
+    )
+    return row["status"] if row else None
 
 
-def finish_job(job_id: str, status: str, error_message: str | None = None) -> None:
-    execute(
-        "update pipeline_jobs set status = %s, error_message = %s, updated_at = now() where id = %s",
-        (status, error_message, job_id),
+def reap_expired_jobs() -> list[dict[str, Any]]:
+    """Recover jobs whose owner stopped heartbeating (crash, OOM, restart).
+
+    Expired leases go back to the queue with backoff, or to 'dead' once they've
+    used up their attempts — in which case the document is marked as errored
+    too. Safe to run from every worker at once: each row is updated by at most
+    one of them.
+    """
+    return fetch_all(
+        f"""
+        with reaped as (
+            update pipeline_jobs
+            set status = case when attempts >= %s then 'dead' else 'queued' end,
+                run_after = now() + {_RETRY_DELAY_SQL},
+                error_message = 'lease expired (worker ' || coalesce(locked_by, '?') || ' stopped heartbeating)',
+                lease_expires_at = null, locked_by = null, updated_at = now()
+            where status = 'processing' and lease_expires_at < now()
+            returning id, document_id, stage, status, attempts, error_message
+        ), dead_documents as (
+            update pipeline_documents d
+            set status = 'error'
+            from reaped r
+            where d.id = r.document_id and r.status = 'dead'
+        )
+        select r.id, r.document_id, d.company_id, r.stage, r.status, r.attempts, r.error_message
+        from reaped r
+        left join pipeline_documents d on d.id = r.document_id
+        """,
+        (JOB_MAX_ATTEMPTS, JOB_RETRY_BACKOFF_SECONDS, JOB_RETRY_BACKOFF_MAX_SECONDS),
     )
 
 
@@ -121,17 +572,23 @@ def update_document(document_id: str, **fields: Any) -> None:
     execute(f"update pipeline_documents set {set_clause} where id = %s", (*values, document_id))
 
 
-def insert_line_items(document_id: str, items: list[dict[str, Any]]) -> None:
+def delete_line_items(document_id: str) -> None:
+    execute("delete from pipeline_line_items where document_id = %s", (document_id,))
+
+
+def insert_line_items(document_id: str, items: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Insert a document's line items; returns the stored rows (with ids) in input order."""
     if not items:
-        return
+        return []
     with get_conn() as conn:
-        with conn.cursor() as cur:
-            psycopg2.extras.execute_values(
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            return psycopg2.extras.execute_values(
                 cur,
                 """
                 insert into pipeline_line_items
                     (document_id, position_no, article_no, description, qty, unit_price, delivery_date, raw)
                 values %s
+                returning *
                 """,
                 [
                     (
@@ -146,6 +603,8 @@ def insert_line_items(document_id: str, items: list[dict[str, Any]]) -> None:
                     )
                     for item in items
                 ],
+                fetch=True,
+                page_size=len(items),
             )
 
 
@@ -157,6 +616,25 @@ def get_document(document_id: str) -> dict[str, Any] | None:
     return fetch_one("select * from pipeline_documents where id = %s", (document_id,))
 
 
+def get_document_progress(document_id: str) -> dict[str, Any] | None:
+    """A document's status and its latest job — without raw_text/metadata — for progress.current_progress."""
+    return fetch_one(
+        """
+        select d.id, d.company_id, d.status,
+               j.stage as job_stage, j.status as job_status, j.error_message as job_error
+        from pipeline_documents d
+        left join lateral (
+            select stage, status, error_message from pipeline_jobs
+            where document_id = d.id
+            order by created_at desc
+            limit 1
+        ) j on true
+        where d.id = %s
+        """,
+        (document_id,),
+    )
+
+
 def find_matching_project(company_id: str, order_document_id: str) -> dict[str, Any] | None:
     return fetch_one(
         "select * from pipeline_projects where company_id = %s and order_document_id = %s",
@@ -188,17 +666,42 @@ def latest_quote_document(company_id: str) -> dict[str, Any] | None:
     )
 
 
-def insert_deviation(project_id: str, quote_line_item_id: str | None, order_line_item_id: str | None,
-                      dtype: str, severity: str, impact_eur: float, confidence: float,
-                      needs_review: bool, description: str) -> None:
-    execute(
-        """
-        insert into pipeline_deviations
-            (project_id, quote_line_item_id, order_line_item_id, type, severity, impact_eur, confidence, needs_review, description)
-        values (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """,
-        (project_id, quote_line_item_id, order_line_item_id, dtype, severity, impact_eur, confidence, needs_review, description),
-    )
+_DEVIATION_FIELDS = ("quote_line_item_id", "order_line_item_id", "type", "severity", "impact_eur",
+                     "confidence", "needs_review", "description")
+
+
+def insert_deviations(project_id: str, deviations: list[dict[str, Any]]) -> None:
+    """Bulk insert line-item and clause deviations (dicts keyed by _DEVIATION_FIELDS) in one statement.
+
+    created_at comes from clock_timestamp() per row, so get_deviations keeps
+    returning them in insertion order even though they share a transaction.
+    """
+    if not deviations:
+        return
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            psycopg2.extras.execute_values(
+                cur,
+                f"insert into pipeline_deviations (project_id, {', '.join(_DEVIATION_FIELDS)}, created_at) values %s",
+                [(project_id, *(d.get(f) for f in _DEVIATION_FIELDS)) for d in deviations],
+                template="(%s, %s, %s, %s, %s, %s, %s, %s, %s, clock_timestamp())",
+                page_size=1000,
+            )
+
+
+def replace_diff_results(project_id: str, deviations: list[dict[str, Any]],
+                         checklist_items: list[dict[str, Any]]) -> None:
+    """Swap in a project's complete diff output atomically.
+
+    Previous deviations are dropped, so re-running the diff stage replaces
+    rather than appends. Checklist items someone has already started or
+    finished are kept; only untouched ('open') ones are regenerated.
+    """
+    with session():
+        execute("delete from pipeline_deviations where project_id = %s", (project_id,))
+        execute("delete from pipeline_checklist_items where project_id = %s and status = 'open'", (project_id,))
+        insert_deviations(project_id, deviations)
+        insert_checklist_items(project_id, checklist_items)
 
 
 def get_deviations(project_id: str) -> list[dict[str, Any]]:
@@ -208,42 +711,198 @@ def get_deviations(project_id: str) -> list[dict[str, Any]]:
     )
 
 
-def insert_checklist_item(project_id: str, label: str, category: str, priority: str) -> None:
+def insert_checklist_items(project_id: str, items: list[dict[str, Any]]) -> None:
+    """Bulk insert checklist items, skipping labels the project already has."""
+    if not items:
+        return
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            psycopg2.extras.execute_values(
+                cur,
+                """
+                insert into pipeline_checklist_items (project_id, label, category, priority, created_at)
+                select v.project_id::uuid, v.label, v.category, v.priority, clock_timestamp()
+                from (values %s) as v(project_id, label, category, priority)
+                where not exists (
+                    select 1 from pipeline_checklist_items c
+                    where c.project_id = v.project_id::uuid and c.label = v.label
+                )
+                """,
+                [(project_id, i["label"], i["category"], i["priority"]) for i in items],
+                page_size=1000,
+            )
+
+
+def get_checklist_items(project_id: str) -> list[dict[str, Any]]:
+    return fetch_all(
+        "select * from pipeline_checklist_items where project_id = %s order by created_at",
+        (project_id,),
+    )
+
+
+def insert_generated_doc(project_id: str, kind: str, title: str, content: str, status: str = "done") -> str:
+    return execute_returning_id(
+        """
+        insert into pipeline_generated_docs (project_id, kind, title, content, status)
+        values (%s, %s, %s, %s, %s)
+        returning id
+        """,
+        (project_id, kind, title, content, status),
+    )
+
+
+def delete_generated_docs(project_id: str) -> None:
+    execute("delete from pipeline_generated_docs where project_id = %s", (project_id,))
+
+
+def update_generated_doc(doc_id: str, content: str, status: str = "streaming") -> None:
     execute(
-        "insert into pipeline_checklist_items (project_id, label, category, priority) values (%s, %s, %s, %s)",
-        (project_id, label, category, priority),
+        "update pipeline_generated_docs set content = %s, status = %s, updated_at = now() where id = %s",
+        (content, status, doc_id),
     )
 
 
-def insert_generated_doc(project_id: str, kind: str, title: str, content: str) -> None:
+def enqueue_backfill(company_id: str, cursor: str | None = None, delay_seconds: float = 0.0,
+                     embedded: int = 0) -> str | None:
+    """Queue an embedding backfill for a company, unless one is already queued or running.
+
+    `cursor` is the id of the last historical project already handled and
+    `embedded` the rows embedded so far, for a continuation job picking up
+    after a throttled one. Returns the job id, or None if a backfill was
+    already pending.
+    """
+    with session():
+        row = fetch_one(
+            """
+            insert into pipeline_jobs (company_id, stage, status, priority, payload, run_after)
+            select %s, 'backfill', 'queued', %s, %s, now() + make_interval(secs => %s)
+            where not exists (
+                select 1 from pipeline_jobs
+                where company_id = %s and stage = 'backfill' and status in ('queued', 'processing')
+            )
+            returning id
+            """,
+            (company_id, JOB_PRIORITY_BATCH, psycopg2.extras.Json({"cursor": cursor, "embedded": embedded}),
+             delay_seconds, company_id),
+        )
+        # A delayed job isn't claimable yet; idle schedulers wake for it via seconds_until_next_job.
+        if row is not None and delay_seconds <= 0:
+            execute("select pg_notify(%s, %s)", (JOB_NOTIFY_CHANNEL, "backfill"))
+    return row["id"] if row else None
+
+
+def checkpoint_job(job_id: str, payload: dict[str, Any]) -> None:
     execute(
-        "insert into pipeline_generated_docs (project_id, kind, title, content) values (%s, %s, %s, %s)",
-        (project_id, kind, title, content),
+        "update pipeline_jobs set payload = %s, updated_at = now() where id = %s",
+        (psycopg2.extras.Json(payload), job_id),
     )
 
 
-def historical_projects_missing_embeddings(company_id: str, limit: int = 20) -> list[dict[str, Any]]:
+def live_jobs_waiting() -> bool:
+    """Whether any document stage is queued and runnable — backfills yield to those."""
+    return fetch_one(
+        """
+        select exists (
+            select 1 from pipeline_jobs
+            where status = 'queued' and stage <> 'backfill' and run_after <= now()
+        ) as waiting
+        """
+    )["waiting"]
+
+
+def historical_projects_missing_embeddings(company_id: str, after_id: str | None,
+                                           limit: int) -> list[dict[str, Any]]:
+    """Next page of un-embedded historical projects in id order (keyset pagination)."""
     return fetch_all(
-        "select * from pipeline_historical_projects where company_id = %s and embedding is null limit %s",
-        (company_id, limit),
+        """
+        select id, title, summary, outcome
+        from pipeline_historical_projects
+        where company_id = %s and embedding is null and (%s::uuid is null or id > %s::uuid)
+        order by id
+        limit %s
+        """,
+        (company_id, after_id, after_id, limit),
     )
 
 
-def set_historical_embedding(row_id: str, embedding: list[float]) -> None:
-    execute(
-        "update pipeline_historical_projects set embedding = %s where id = %s",
-        (embedding, row_id),
-    )
+def vector_literal(embedding: Any) -> str:
+    return "[" + ",".join(f"{float(x):.7g}" for x in embedding) + "]"
 
 
-def search_similar_projects(company_id: str, embedding: list[float], limit: int = 5) -> list[dict[str, Any]]:
+def set_historical_embeddings(rows: list[tuple[str, Any]]) -> None:
+    """Write (row_id, embedding) pairs back in one statement per page."""
+    if not rows:
+        return
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            psycopg2.extras.execute_values(
+                cur,
+                """
+                update pipeline_historical_projects p
+                set embedding = v.embedding
+                from (values %s) as v(id, embedding)
+                where p.id = v.id
+                """,
+                [(row_id, vector_literal(embedding)) for row_id, embedding in rows],
+                template="(%s::uuid, %s::vector)",
+                page_size=500,
+            )
+
+
+def count_historical_vectors(company_id: str) -> int:
+    return fetch_one(
+        "select count(*) as n from pipeline_historical_projects where company_id = %s and embedding is not null",
+        (company_id,),
+    )["n"]
+
+
+def historical_project_vectors(company_id: str, limit: int) -> list[dict[str, Any]]:
+    """Embedded historical projects of a company, embedding as a float list (for the in-process index)."""
     return fetch_all(
         """
-        select id, title, summary, outcome, embedding <=> %s::vector as distance
+        select id, title, summary, outcome, embedding::real[] as embedding
         from pipeline_historical_projects
         where company_id = %s and embedding is not null
-        order by embedding <=> %s::vector
+        order by id
         limit %s
         """,
-        (embedding, company_id, embedding, limit),
+        (company_id, limit),
     )
+
+
+def search_similar_projects(company_id: str, embedding: Any, limit: int = 5,
+                            ef_search: int | None = None, exact: bool = False) -> list[dict[str, Any]]:
+    """Nearest historical projects by cosine distance.
+
+    Uses the ANN index with the configured ef_search/probes unless `exact`,
+    which disables index scans for this one query (the recall baseline) and
+    then restores the setting, so a caller's enclosing session isn't left
+    with sequential scans. The vector is sent once and the ORDER BY refers to
+    the selected distance, which still lets the planner use the index.
+    """
+    with session():
+        previous_indexscan = None
+        if exact:
+            previous_indexscan = fetch_one("select current_setting('enable_indexscan') as value")["value"]
+            execute("select set_config('enable_indexscan', 'off', true)")
+        else:
+            execute(
+                "select set_config('hnsw.ef_search', %s, true), set_config('ivfflat.probes', %s, true)",
+                (str(ef_search or VECTOR_EF_SEARCH), str(VECTOR_IVFFLAT_PROBES)),
+            )
+            if VECTOR_ITERATIVE_SCAN:
+                # Keeps scanning past ef_search when the company filter drops candidates (pgvector >= 0.8).
+                execute("select set_config('hnsw.iterative_scan', %s, true)", (VECTOR_ITERATIVE_SCAN,))
+        rows = fetch_all(
+            """
+            select id, title, summary, outcome, embedding <=> %s::vector as distance
+            from pipeline_historical_projects
+            where company_id = %s and embedding is not null
+            order by distance
+            limit %s
+            """,
+            (vector_literal(embedding), company_id, limit),
+        )
+        if previous_indexscan is not None:
+            execute("select set_config('enable_indexscan', %s, true)", (previous_indexscan,))
+        return rows
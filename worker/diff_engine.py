@@ -8,12 +8,27 @@ can't be diffed as structured rows.
 
 from __future__ import annotations
 
+import heapq
+import math
+import re
 from dataclasses import dataclass, field
 from typing import Any
 
-from rapidfuzz import fuzz
+import numpy as np
+from rapidfuzz import fuzz, process
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
 
 FUZZY_MATCH_THRESHOLD = 70
+# Above this many candidate pairs, fuzzy matching switches from a full score
+# matrix to inverted-index blocking (roughly a 2,000 x 2,000 position diff).
+DENSE_MATCH_MAX_PAIRS = 4_000_000
+BLOCKING_TOP_K = 25
+BLOCKING_MAX_POSTINGS = 50
+
+_ARTICLE_SEPARATORS = re.compile(r"[\s\-./_]")
+_TOKEN = re.compile(r"\w+")
 
 
 @dataclass
@@ -32,37 +47,167 @@ def _line_total(item: dict[str, Any]) -> float:
     return float(item.get("qty") or 0) * float(item.get("unit_price") or 0)
 
 
-def _match_by_article(order_items: list[dict], article_no: str | None) -> dict | None:
-    if not article_no:
-        return None
-    for item in order_items:
-        if item.get("article_no") == article_no:
-            return item
-    return None
+def normalise_article(article_no: str | None) -> str:
+    """'TM-75 001' / 'tm75-001' -> 'TM75001': ERP exports disagree on separators, not on the number."""
+    return _ARTICLE_SEPARATORS.sub("", article_no or "").upper()
+
+
+def _match_by_article(quote_items: list[dict], order_items: list[dict],
+                      used: set[int] | None = None) -> dict[int, int]:
+    """Article-number matches via a hash index, quote index -> order index.
+
+    Exact article numbers are tried first, then their normalised form. Each
+    order item is used at most once.
+    """
+    used = set() if used is None else used
+    exact: dict[str, list[int]] = {}
+    normalised: dict[str, list[int]] = {}
+    for j, item in enumerate(order_items):
+        if item.get("article_no"):
+            exact.setdefault(item["article_no"], []).append(j)
+            normalised.setdefault(normalise_article(item["article_no"]), []).append(j)
+
+    matches: dict[int, int] = {}
+    for index, key in ((exact, lambda a: a), (normalised, normalise_article)):
+        for i, item in enumerate(quote_items):
+            if i in matches or not item.get("article_no"):
+                continue
+            candidates = index.get(key(item["article_no"]))
+            while candidates and candidates[0] in used:
+                candidates.pop(0)
+            if candidates:
+                matches[i] = candidates.pop(0)
+                used.add(matches[i])
+    return matches
+
+
+def _assign(quote_idx: list[int], order_idx: list[int], scores: np.ndarray) -> dict[int, int]:
+    """Highest-total-score pairing over a dense score matrix (0 = no viable pair)."""
+    # Only rows/columns with at least one viable partner take part in the
+    # assignment, which keeps the (cubic) solver small.
+    rows = np.flatnonzero(scores.max(axis=1) >= FUZZY_MATCH_THRESHOLD)
+    cols = np.flatnonzero(scores.max(axis=0) >= FUZZY_MATCH_THRESHOLD)
+    if rows.size == 0:
+        return {}
+    sub = scores[np.ix_(rows, cols)]
+    assigned_rows, assigned_cols = linear_sum_assignment(sub, maximize=True)
+    return {
+        quote_idx[rows[r]]: order_idx[cols[c]]
+        for r, c in zip(assigned_rows, assigned_cols)
+        if sub[r, c] >= FUZZY_MATCH_THRESHOLD
+    }
+
+
+def _best_fuzzy_matches(quote_items: list[dict], order_items: list[dict],
+                        quote_idx: list[int], order_idx: list[int]) -> dict[int, int]:
+    """Globally optimal description matching among the still-unmatched items.
+
+    One rapidfuzz cdist call scores every pair at once (in C, on all cores),
+    then a linear assignment picks the pairing with the highest total score,
+    so an early quote item can't steal the best partner of a later one the
+    way a greedy first-come match would. Pairs below FUZZY_MATCH_THRESHOLD
+    never match. Past DENSE_MATCH_MAX_PAIRS the full matrix gets too big
+    and candidates are narrowed through an inverted index first.
+    """
+    if not quote_idx or not order_idx:
+        return {}
+    if len(quote_idx) * len(order_idx) > DENSE_MATCH_MAX_PAIRS:
+        return _blocked_fuzzy_matches(quote_items, order_items, quote_idx, order_idx)
+    scores = process.cdist(
+        [quote_items[i].get("description") or "" for i in quote_idx],
+        [order_items[j].get("description") or "" for j in order_idx],
+        scorer=fuzz.token_sort_ratio,
+        score_cutoff=FUZZY_MATCH_THRESHOLD,
+        dtype=np.float32,
+        workers=-1,
+    )
+    return _assign(quote_idx, order_idx, scores)
 
 
-def _best_fuzzy_match(order_items: list[dict], description: str) -> dict | None:
-    best_item, best_score = None, 0
-    for item in order_items:
-        score = fuzz.token_sort_ratio(description, item.get("description") or "")
-        if score > best_score:
-            best_item, best_score = item, score
-    if best_score >= FUZZY_MATCH_THRESHOLD:
-        return best_item
-    return None
+def _index_keys(description: str) -> set[str]:
+    """Word tokens plus a 5-char prefix of long ones, so 'Antriebsmotor' meets 'Antriebsmotoren'."""
+    tokens = {t for t in _TOKEN.findall(description.lower()) if len(t) >= 2}
+    return tokens | {f"{t[:5]}*" for t in tokens if len(t) > 6}
+
+
+def _blocked_fuzzy_matches(quote_items: list[dict], order_items: list[dict],
+                           quote_idx: list[int], order_idx: list[int]) -> dict[int, int]:
+    """Fuzzy matching for very large BOMs: inverted-index blocking + sparse assignment.
+
+    Each quote item is only scored against the BLOCKING_TOP_K order items
+    sharing the most (IDF-weighted) description tokens with it. Keys so
+    common they'd pull in a large share of the BOM ("Schraube", "DIN") are
+    ignored unless nothing rarer is shared. Time and memory grow with
+    n * BLOCKING_TOP_K rather than n * m.
+    """
+    order_texts = [order_items[j].get("description") or "" for j in order_idx]
+    postings: dict[str, list[int]] = {}
+    for col, text in enumerate(order_texts):
+        for key in _index_keys(text):
+            postings.setdefault(key, []).append(col)
+    max_df = max(BLOCKING_MAX_POSTINGS, len(order_idx) // 100)
+    total = len(order_idx)
+
+    rows: list[int] = []
+    cols: list[int] = []
+    costs: list[float] = []
+    for row, i in enumerate(quote_idx):
+        text = quote_items[i].get("description") or ""
+        keys = [k for k in _index_keys(text) if k in postings]
+        if not keys:
+            continue
+        weights: dict[int, float] = {}
+        usable = [k for k in keys if len(postings[k]) <= max_df]
+        if not usable:
+            # Only very common words in common: fall back to the rarest one.
+            usable = [min(keys, key=lambda k: len(postings[k]))]
+        for key in usable:
+            idf = math.log(1 + total / len(postings[key]))
+            for col in postings[key][:max_df]:
+                weights[col] = weights.get(col, 0.0) + idf
+        for col in heapq.nlargest(BLOCKING_TOP_K, weights, key=weights.__getitem__):
+            score = fuzz.token_sort_ratio(text, order_texts[col], score_cutoff=FUZZY_MATCH_THRESHOLD)
+            if score:
+                rows.append(row)
+                cols.append(col)
+                # Positive cost, lower is better; every real pair beats the "unmatched" dummy below.
+                costs.append(101.0 - score)
+
+    if not rows:
+        return {}
+    # One private dummy column per quote row guarantees a full matching exists;
+    # taking it means "leave this quote item unmatched".
+    n_rows, n_cols = len(quote_idx), len(order_idx)
+    rows.extend(range(n_rows))
+    cols.extend(range(n_cols, n_cols + n_rows))
+    costs.extend([102.0 - FUZZY_MATCH_THRESHOLD] * n_rows)
+    graph = csr_matrix((costs, (rows, cols)), shape=(n_rows, n_cols + n_rows))
+    matched_rows, matched_cols = min_weight_full_bipartite_matching(graph)
+    return {
+        quote_idx[r]: order_idx[c]
+        for r, c in zip(matched_rows, matched_cols)
+        if c < n_cols
+    }
+
+
+def match_line_items(quote_items: list[dict[str, Any]], order_items: list[dict[str, Any]]) -> dict[int, int]:
+    """Pair quote and order items (by index): article number first, then description similarity."""
+    used: set[int] = set()
+    matches = _match_by_article(quote_items, order_items, used)
+    matches.update(_best_fuzzy_matches(
+        quote_items, order_items,
+        [i for i in range(len(quote_items)) if i not in matches],
+        [j for j in range(len(order_items)) if j not in used],
+    ))
+    return matches
 
 
 def diff_line_items(quote_items: list[dict[str, Any]], order_items: list[dict[str, Any]]) -> list[Deviation]:
     deviations: list[Deviation] = []
-    matched_order_ids: set[Any] = set()
+    matches = match_line_items(quote_items, order_items)
 
-    for quote_item in quote_items:
-        order_item = _match_by_article(order_items, quote_item.get("article_no"))
-        if order_item is None:
-            order_item = _best_fuzzy_match(
-                [o for o in order_items if o.get("id") not in matched_order_ids],
-                quote_item.get("description") or "",
-            )
+    for i, quote_item in enumerate(quote_items):
+        order_item = order_items[matches[i]] if i in matches else None
 
         if order_item is None:
             deviations.append(
@@ -79,13 +224,12 @@ def diff_line_items(quote_items: list[dict[str, Any]], order_items: list[dict[st
             )
             continue
 
-        matched_order_ids.add(order_item.get("id"))
         qty_changed = float(quote_item.get("qty") or 0) != float(order_item.get("qty") or 0)
         price_changed = float(quote_item.get("unit_price") or 0) != float(order_item.get("unit_price") or 0)
         article_changed = (
             quote_item.get("article_no")
             and order_item.get("article_no")
-            and quote_item["article_no"] != order_item["article_no"]
+            and normalise_article(quote_item["article_no"]) != normalise_article(order_item["article_no"])
         )
         impact = _line_total(order_item) - _line_total(quote_item)
 
@@ -121,8 +265,9 @@ def diff_line_items(quote_items: list[dict[str, Any]], order_items: list[dict[st
             )
         # else: MATCH — no deviation row needed for the demo, but could be logged for completeness.
 
-    for order_item in order_items:
-        if order_item.get("id") in matched_order_ids:
+    matched_order_idx = set(matches.values())
+    for j, order_item in enumerate(order_items):
+        if j in matched_order_idx:
             continue
         deviations.append(
             Deviation(
@@ -0,0 +1,168 @@
+"""Two-tier cache of embedding vectors.
+
+The same historical summaries, project titles and recurring copilot
+queries get embedded over and over, and each one costs a transformer
+forward pass. Vectors are cached by (model, prefix, SHA-256 of the
+normalised text): an in-process LRU of EMBEDDING_CACHE_MEMORY_ITEMS
+vectors in front of a local SQLite file holding them as compact
+float16/float32 blobs, size-capped by evicting least-recently-used rows
+(a sqlite_lru.SqliteLruTable, shared with llm_cache).
+
+The model identity in the key includes the backend, since the quantized
+ONNX model's vectors are close to, but not identical with, torch's.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any
+
+import numpy as np
+
+from config import (
+    EMBEDDING_CACHE_DTYPE,
+    EMBEDDING_CACHE_ENABLED,
+    EMBEDDING_CACHE_MAX_MB,
+    EMBEDDING_CACHE_MEMORY_ITEMS,
+    EMBEDDING_CACHE_PATH,
+)
+from sqlite_lru import SQLITE_MAX_PARAMS, SqliteLruTable
+
+logger = logging.getLogger("kostencheck.embedding_cache")
+
+_EVICT_CHECK_EVERY = 1000  # rows written between size checks
+
+
+def normalise_text(text: str) -> str:
+    """NFC, collapsed whitespace — texts that only differ in layout share a vector."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class EmbeddingCache:
+    def __init__(self, path: str, memory_items: int, max_bytes: int, dtype: str = "float16",
+                 enabled: bool = True) -> None:
+        self._memory_items = memory_items
+        self._dtype = np.dtype(dtype)
+        self.enabled = enabled
+        self._memory: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._table = SqliteLruTable(
+            path, "embedding_cache", "dtype text not null, vector blob not null",
+            size_sql="length(vector)", max_bytes=max_bytes, evict_check_every=_EVICT_CHECK_EVERY,
+        )
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0, "errors": 0}
+
+    @staticmethod
+    def make_key(model: str, prefix: str, text: str) -> str:
+        digest = hashlib.sha256(normalise_text(text).encode("utf-8")).hexdigest()
+        return f"{model}|{prefix.strip()}|{digest}"
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        # Caller holds self._lock.
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, keys: list[str]) -> dict[str, np.ndarray]:
+        """Cached float32 vectors for whichever of `keys` are present."""
+        if not self.enabled or not keys:
+            return {}
+        found: dict[str, np.ndarray] = {}
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+            self._stats["memory_hits"] += len(found)
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        if missing:
+            try:
+                from_disk = self._read(missing)
+            except sqlite3.Error:
+                # The cache must never take embedding down with it.
+                logger.warning("embedding cache read failed", exc_info=True)
+                self._count("errors")
+                from_disk = {}
+            with self._lock:
+                for key, vector in from_disk.items():
+                    self._remember(key, vector)
+                self._stats["disk_hits"] += len(from_disk)
+                self._stats["misses"] += len(missing) - len(from_disk)
+            found.update(from_disk)
+        return found
+
+    def _read(self, keys: list[str]) -> dict[str, np.ndarray]:
+        conn = self._table.conn()
+        found: dict[str, np.ndarray] = {}
+        for start in range(0, len(keys), SQLITE_MAX_PARAMS):
+            chunk = keys[start:start + SQLITE_MAX_PARAMS]
+            placeholders = ", ".join("?" * len(chunk))
+            rows = conn.execute(
+                f"select key, dtype, vector from embedding_cache where key in ({placeholders})", chunk
+            ).fetchall()
+            for key, dtype, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=dtype).astype(np.float32)
+        if found:
+            self._table.touch(list(found))
+        return found
+
+    def put_many(self, items: dict[str, np.ndarray]) -> None:
+        if not self.enabled or not items:
+            return
+        with self._lock:
+            for key, vector in items.items():
+                self._remember(key, np.asarray(vector, dtype=np.float32))
+        now = time.time()
+        try:
+            self._table.conn().executemany(
+                "insert or replace into embedding_cache (key, dtype, vector, last_used_at) values (?, ?, ?, ?)",
+                [
+                    (key, self._dtype.name, np.asarray(vector, dtype=self._dtype).tobytes(), now)
+                    for key, vector in items.items()
+                ],
+            )
+        except sqlite3.Error:
+            logger.warning("embedding cache write failed", exc_info=True)
+            self._count("errors")
+            return
+        self._count("writes", len(items))
+        if self._table.wrote(len(items)):
+            self.evict()
+
+    def evict(self) -> None:
+        """Drop least-recently-used rows until the file's vectors fit under the size cap."""
+        try:
+            self._count("evictions", self._table.evict())
+        except sqlite3.Error:
+            logger.warning("embedding cache eviction failed", exc_info=True)
+            self._count("errors")
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._stats[name] += n
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            in_memory = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        return {"enabled": self.enabled, "in_memory": in_memory, **stats,
+                "hit_rate": hits / lookups if lookups else None}
+
+
+cache = EmbeddingCache(
+    EMBEDDING_CACHE_PATH,
+    memory_items=EMBEDDING_CACHE_MEMORY_ITEMS,
+    max_bytes=int(EMBEDDING_CACHE_MAX_MB * 1024 * 1024),
+    dtype=EMBEDDING_CACHE_DTYPE,
+    enabled=EMBEDDING_CACHE_ENABLED,
+)
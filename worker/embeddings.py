@@ -3,25 +3,91 @@
 multilingual-e5-small: ~470MB, runs comfortably on a small CPU VPS, and
 handles German text (unlike most English-only small embedding models).
 E5 models expect a "query: " / "passage: " prefix convention.
+
+Bulk work (backfills, indexing imported history) should go through
+embed_passages / embed_queries: texts are sorted by length and encoded in
+EMBEDDING_BATCH_SIZE batches, so each batch pads to similar lengths instead
+of to the longest text in the whole list.
+
+EMBEDDING_BACKEND=onnx runs the model on ONNX Runtime instead of torch,
+loading EMBEDDING_ONNX_FILE — by default the int8-quantized ARM64 export,
+which is several times faster on the Ampere box and needs a fraction of
+the memory. Needs `pip install "sentence-transformers[onnx]"`.
+
+Vectors are looked up in embedding_cache first; only misses reach the model.
 """
 
 from __future__ import annotations
 
+import logging
 from functools import lru_cache
 
-from config import EMBEDDING_MODEL
+import numpy as np
+
+from config import EMBEDDING_BACKEND, EMBEDDING_BATCH_SIZE, EMBEDDING_MODEL, EMBEDDING_ONNX_FILE
+from embedding_cache import cache, normalise_text
+
+logger = logging.getLogger("kostencheck.embeddings")
+
+QUERY_PREFIX = "query: "
+PASSAGE_PREFIX = "passage: "
+# Identifies the vectors this configuration produces, for embedding_cache keys.
+MODEL_ID = f"{EMBEDDING_MODEL}:{EMBEDDING_ONNX_FILE}" if EMBEDDING_BACKEND == "onnx" else EMBEDDING_MODEL
 
 
 @lru_cache(maxsize=1)
 def _model():
     from sentence_transformers import SentenceTransformer
 
+    if EMBEDDING_BACKEND == "onnx":
+        try:
+            return SentenceTransformer(EMBEDDING_MODEL, backend="onnx", model_kwargs={"file_name": EMBEDDING_ONNX_FILE})
+        except (OSError, ValueError):
+            # The hub repo may not ship that export; the plain ONNX graph is still faster than torch.
+            logger.warning("could not load %s for %s, using the unquantized ONNX model",
+                           EMBEDDING_ONNX_FILE, EMBEDDING_MODEL, exc_info=True)
+            return SentenceTransformer(EMBEDDING_MODEL, backend="onnx")
     return SentenceTransformer(EMBEDDING_MODEL)
 
 
+def _encode(texts: list[str], prefix: str, batch_size: int | None = None) -> np.ndarray:
+    """Normalized float32 embeddings, one row per text, in input order."""
+    texts = [normalise_text(text) for text in texts]
+    keys = [cache.make_key(MODEL_ID, prefix, text) for text in texts]
+    cached = cache.get_many(keys)
+    # Encode each distinct uncached text once.
+    todo = list({key: text for key, text in zip(keys, texts) if key not in cached}.items())
+    fresh: dict[str, np.ndarray] = {}
+    if todo:
+        batch_size = batch_size or EMBEDDING_BATCH_SIZE
+        model = _model()
+        todo.sort(key=lambda item: len(item[1]))
+        for start in range(0, len(todo), batch_size):
+            batch = todo[start:start + batch_size]
+            vectors = model.encode(
+                [prefix + text for _, text in batch],
+                batch_size=len(batch),
+                normalize_embeddings=True,
+                convert_to_numpy=True,
+            )
+            fresh.update((key, vector.astype(np.float32)) for (key, _), vector in zip(batch, vectors))
+        cache.put_many(fresh)
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.stack([cached[key] if key in cached else fresh[key] for key in keys])
+
+
+def embed_passages(texts: list[str], batch_size: int | None = None) -> np.ndarray:
+    return _encode(texts, PASSAGE_PREFIX, batch_size)
+
+
+def embed_queries(texts: list[str], batch_size: int | None = None) -> np.ndarray:
+    return _encode(texts, QUERY_PREFIX, batch_size)
+
+
 def embed_passage(text: str) -> list[float]:
-    return _model().encode(f"passage: {text}", normalize_embeddings=True).tolist()
+    return embed_passages([text])[0].tolist()
 
 
 def embed_query(text: str) -> list[float]:
-    return _model().encode(f"query: {text}", normalize_embeddings=True).tolist()
+    return embed_queries([text])[0].tolist()
@@ -1,14 +1,31 @@
 """Structured extraction: raw document text -> {metadata, line_items[], clauses{}}.
 
-One Groq call in JSON mode per document. This is the only place an LLM
-touches the raw text — everything downstream (the diff) is deterministic.
+One Groq call in JSON mode for a typical document. This is the only place
+an LLM touches the raw text — everything downstream (the diff) is
+deterministic. When the document has a position table in a known layout,
+line items are read straight from it (table_extraction.py) and the LLM is
+asked only for metadata and clauses — plus line items from whatever the
+tables can't account for: pipe tables without a usable header and OCR'd
+pages, whose positions never reach a pipe table.
+
+Documents longer than EXTRACT_CHUNK_CHARS are extracted map-reduce style
+instead of being truncated: the text is split on page/table boundaries,
+line items are extracted from every chunk in parallel and merged, and
+metadata/clauses come from one call over the most relevant passages (the
+document header plus the paragraphs that mention payment, delivery,
+warranty or penalties). Latency then tracks the largest chunk rather
+than the whole document, and no position past a cut-off is dropped.
 """
 
 from __future__ import annotations
 
-from typing import Any
+import re
+from functools import partial
+from typing import Any, Iterable
 
-from groq_client import complete_json
+from config import EXTRACT_CHUNK_CHARS
+from groq_client import complete_json, gather
+from table_extraction import extract_line_items_from_tables
 
 SYSTEM_PROMPT = """Du extrahierst strukturierte Daten aus deutschen Angeboten und Bestellungen \
 im Maschinenbau. Antworte ausschließlich mit JSON in exakt diesem Schema:
@@ -40,5 +57,204 @@ im Maschinenbau. Antworte ausschließlich mit JSON in exakt diesem Schema:
 Erfinde keine Werte. Wenn ein Feld nicht im Dokument steht, setze null."""
 
 
-def extract_document(raw_text: str) -> dict[str, Any]:
-    return complete_json(SYSTEM_PROMPT, raw_text[:24000])
+LINE_ITEMS_PROMPT = """Du extrahierst Positionen aus einem Ausschnitt eines deutschen Angebots oder \
+einer Bestellung im Maschinenbau. Der Ausschnitt kann mitten im Dokument beginnen oder enden. \
+Antworte ausschließlich mit JSON in exakt diesem Schema:
+{
+  "line_items": [
+    {
+      "position_no": number,
+      "article_no": string | null,
+      "description": string,
+      "qty": number,
+      "unit_price": number,
+      "delivery_date": string | null
+    }
+  ]
+}
+Gib nur Positionen zurück, die vollständig in diesem Ausschnitt stehen. Erfinde keine Werte. \
+Wenn ein Feld nicht im Ausschnitt steht, setze null. Gibt es keine Positionen, gib eine leere Liste zurück."""
+
+METADATA_PROMPT = """Du extrahierst Kopfdaten und Vertragsklauseln aus Auszügen eines deutschen \
+Angebots oder einer Bestellung im Maschinenbau. Antworte ausschließlich mit JSON in exakt diesem Schema:
+{
+  "metadata": {
+    "doc_number": string | null,
+    "customer": string | null,
+    "payment_terms": string | null,
+    "delivery_week": string | null,
+    "incoterms": string | null
+  },
+  "clauses": {
+    "payment_terms": string | null,
+    "delivery": string | null,
+    "warranty": string | null,
+    "penalties": string | null
+  }
+}
+Erfinde keine Werte. Wenn ein Feld nicht in den Auszügen steht, setze null."""
+
+_CLAUSE_KEYWORDS = re.compile(
+    r"zahlung|zahlbar|netto|skonto|liefer|incoterm|exw|fca|dap|ddp|gewährleistung|garantie|"
+    r"vertragsstrafe|pönale|konventionalstrafe|verzug|haftung|agb|bedingungen",
+    re.IGNORECASE,
+)
+
+
+def extract_document(raw_text: str, ocr_pages: Iterable[int] = ()) -> dict[str, Any]:
+    """`ocr_pages` are the page numbers (0-based) whose text came from OCR."""
+    tables = extract_line_items_from_tables(raw_text)
+    if tables.items:
+        pages = raw_text.split("\f")
+        leftovers = [*tables.unmapped, *(pages[i].strip() for i in sorted(set(ocr_pages)) if i < len(pages))]
+        chunks = _pack_chunks(_split_blocks("\f".join(leftovers)), EXTRACT_CHUNK_CHARS) if leftovers else []
+        # Position table recognised: the LLM is needed for header data and clauses, and only
+        # for line items in the leftovers.
+        header, *per_chunk = gather(
+            partial(complete_json, METADATA_PROMPT, _metadata_text(raw_text)),
+            *(partial(complete_json, LINE_ITEMS_PROMPT, chunk) for chunk in chunks),
+        )
+        line_items = tables.items
+        if per_chunk:
+            # Table rows are exact: keep them as read and add only the LLM items they don't already cover.
+            from_tables = {_item_key(item) for item in tables.items}
+            llm_items = merge_line_items([result.get("line_items") or [] for result in per_chunk])
+            line_items = [*tables.items, *(item for item in llm_items if _item_key(item) not in from_tables)]
+        return {
+            "metadata": header.get("metadata") or {},
+            "line_items": line_items,
+            "clauses": header.get("clauses") or {},
+        }
+    if len(raw_text) <= EXTRACT_CHUNK_CHARS:
+        return complete_json(SYSTEM_PROMPT, raw_text)
+    return _extract_chunked(raw_text)
+
+
+def _extract_chunked(raw_text: str) -> dict[str, Any]:
+    blocks = _split_blocks(raw_text)
+    chunks = _pack_chunks(blocks, EXTRACT_CHUNK_CHARS)
+    header, *per_chunk = gather(
+        partial(complete_json, METADATA_PROMPT, _metadata_text(raw_text)),
+        *(partial(complete_json, LINE_ITEMS_PROMPT, chunk) for chunk in chunks),
+    )
+    return {
+        "metadata": header.get("metadata") or {},
+        "line_items": merge_line_items([result.get("line_items") or [] for result in per_chunk]),
+        "clauses": header.get("clauses") or {},
+    }
+
+
+def _split_blocks(raw_text: str) -> list[str]:
+    """Pages (form-feed separated by parsing.py), then paragraphs/tables within a page."""
+    blocks: list[str] = []
+    for page in raw_text.split("\f"):
+        blocks.extend(block.strip() for block in re.split(r"\n\s*\n", page) if block.strip())
+    return blocks
+
+
+def _split_oversized(block: str, limit: int) -> list[str]:
+    """Cut a block that alone exceeds `limit` at line boundaries, repeating a table's header row."""
+    lines = block.splitlines()
+    header = lines[0] if " | " in lines[0] else None
+    pieces: list[str] = []
+    current: list[str] = []
+    size = 0
+    for line in lines:
+        if current and size + len(line) + 1 > limit:
+            pieces.append("\n".join(current))
+            current, size = ([header], len(header) + 1) if header else ([], 0)
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        pieces.append("\n".join(current))
+    return pieces
+
+
+def _pack_chunks(blocks: list[str], limit: int) -> list[str]:
+    chunks: list[str] = []
+    current: list[str] = []
+    size = 0
+    for block in blocks:
+        for piece in _split_oversized(block, limit) if len(block) > limit else [block]:
+            if current and size + len(piece) + 2 > limit:
+                chunks.append("\n\n".join(current))
+                current, size = [], 0
+            current.append(piece)
+            size += len(piece) + 2
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def _metadata_text(raw_text: str) -> str:
+    """What METADATA_PROMPT reads: the whole document when it fits in one request, else the relevant passages."""
+    if len(raw_text) <= EXTRACT_CHUNK_CHARS:
+        return raw_text
+    return _relevant_passages(_split_blocks(raw_text), EXTRACT_CHUNK_CHARS)
+
+
+def _relevant_passages(blocks: list[str], budget: int) -> str:
+    """The document header plus the blocks densest in clause vocabulary, kept in document order."""
+    chosen: set[int] = set()
+    used = 0
+    for i, block in enumerate(blocks[:3]):
+        if used + len(block) > budget // 3:
+            break
+        chosen.add(i)
+        used += len(block)
+    scored = sorted(
+        ((len(_CLAUSE_KEYWORDS.findall(block)), i) for i, block in enumerate(blocks) if i not in chosen),
+        reverse=True,
+    )
+    for score, i in scored:
+        if score == 0:
+            break
+        if used + len(blocks[i]) > budget:
+            continue
+        chosen.add(i)
+        used += len(blocks[i])
+    return "\n\n".join(blocks[i][:budget] for i in sorted(chosen))
+
+
+def merge_line_items(chunk_items: list[list[dict[str, Any]]]) -> list[dict[str, Any]]:
+    """Concatenate per-chunk line items, collapsing duplicates (see _item_key).
+
+    A row on a chunk boundary (or a repeated table header page) can be
+    extracted twice; the copy with more filled-in fields wins.
+    """
+    merged: dict[tuple, dict[str, Any]] = {}
+    for items in chunk_items:
+        for item in items:
+            key = _item_key(item)
+            existing = merged.get(key)
+            if existing is None or _filled(item) > _filled(existing):
+                merged[key] = item
+    return sorted(
+        merged.values(),
+        key=lambda item: (item.get("position_no") is None, _position_sort_key(item.get("position_no"))),
+    )
+
+
+def _item_key(item: dict[str, Any]) -> tuple:
+    """Identity of a line item: position and article number when it has an article number, else its row.
+
+    A position number alone isn't unique — sub-positions, or a second table
+    numbered from 1 again — so without an article number the description,
+    quantity and price have to match too.
+    """
+    article_no = (item.get("article_no") or "").strip().upper()
+    if article_no:
+        return ("pos", item.get("position_no"), article_no)
+    return ("row", item.get("position_no"), " ".join((item.get("description") or "").split()).lower(),
+            item.get("qty"), item.get("unit_price"))
+
+
+def _filled(item: dict[str, Any]) -> int:
+    return sum(value not in (None, "") for value in item.values())
+
+
+def _position_sort_key(position_no: Any) -> float:
+    try:
+        return float(position_no)
+    except (TypeError, ValueError):
+        return 0.0
@@ -1,20 +1,67 @@
-"""Thin wrapper around the Groq chat completions API."""
+"""Thin wrapper around the Groq chat completions API.
+
+Responses go through llm_cache (keyed on model, prompts and temperature),
+so a re-run stage or a repeated clause pair doesn't pay for the same
+completion twice. Pass cache=False to force a fresh call.
+
+stream_text() streams a completion, handing the text so far to a callback
+as tokens arrive, for output that's shown to users while it's written.
+
+Independent prompts (the four clause comparisons, the generated documents)
+can be fired together with gather(); at most GROQ_MAX_CONCURRENCY requests
+are in flight per process, whether they come from gather() or not. Every
+request is paced and retried by llm_scheduler against Groq's RPM/TPM limits.
+"""
 
 from __future__ import annotations
 
 import json
-from typing import Any
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
 
 from groq import Groq
 
-from config import GROQ_API_KEY, GROQ_MODEL
+from config import GROQ_API_KEY, GROQ_MAX_CONCURRENCY, GROQ_MODEL
+from llm_cache import cache as _cache
+from llm_scheduler import CHARS_PER_TOKEN, DEFAULT_COMPLETION_TOKENS, estimate_tokens, scheduler as _llm_scheduler
+
+T = TypeVar("T")
+
+# Retries are llm_scheduler's job (with a shared backoff), not the SDK's.
+_client = Groq(api_key=GROQ_API_KEY, max_retries=0)
+_in_flight = threading.BoundedSemaphore(GROQ_MAX_CONCURRENCY)
+_batch_pool = ThreadPoolExecutor(max_workers=GROQ_MAX_CONCURRENCY, thread_name_prefix="groq")
+
+
+def _create(**kwargs: Any):
+    def request():
+        with _in_flight:
+            return _client.chat.completions.create(**kwargs)
+
+    return _llm_scheduler.call(request, estimate_tokens(kwargs["messages"], kwargs.get("max_tokens")))
 
-_client = Groq(api_key=GROQ_API_KEY)
 
+def gather(*calls: Callable[[], T]) -> list[T]:
+    """Run independent LLM calls concurrently and return their results in order.
 
-def complete_json(system_prompt: str, user_prompt: str, temperature: float = 0.1) -> dict[str, Any]:
+    Each call is a zero-argument callable (typically a functools.partial of
+    complete_json/complete_text or a helper built on them). If any call
+    raises, the first failure in argument order is re-raised once all have
+    finished. Don't call gather() from inside a gathered call — the nested
+    batch would wait on the pool it's occupying.
+    """
+    futures = [_batch_pool.submit(call) for call in calls]
+    return [future.result() for future in futures]
+
+
+def complete_json(system_prompt: str, user_prompt: str, temperature: float = 0.1,
+                  cache: bool = True) -> dict[str, Any]:
     """Call Groq with JSON-mode and parse the response. Caller defines the schema in the prompt."""
-    response = _client.chat.completions.create(
+    key = _cache.make_key("json", GROQ_MODEL, system_prompt, user_prompt, temperature)
+    if cache and (cached := _cache.get(key)) is not None:
+        return cached
+    response = _create(
         model=GROQ_MODEL,
         temperature=temperature,
         response_format={"type": "json_object"},
@@ -23,11 +70,17 @@ def complete_json(system_prompt: str, user_prompt: str, temperature: float = 0.1
             {"role": "user", "content": user_prompt},
         ],
     )
-    return json.loads(response.choices[0].message.content)
+    result = json.loads(response.choices[0].message.content)
+    _cache.put(key, result)
+    return result
 
 
-def complete_text(system_prompt: str, user_prompt: str, temperature: float = 0.3) -> str:
-    response = _client.chat.completions.create(
+def complete_text(system_prompt: str, user_prompt: str, temperature: float = 0.3,
+                  cache: bool = True) -> str:
+    key = _cache.make_key("text", GROQ_MODEL, system_prompt, user_prompt, temperature)
+    if cache and (cached := _cache.get(key)) is not None:
+        return cached
+    response = _create(
         model=GROQ_MODEL,
         temperature=temperature,
         messages=[
@@ -35,4 +88,58 @@ def complete_text(system_prompt: str, user_prompt: str, temperature: float = 0.3
             {"role": "user", "content": user_prompt},
         ],
     )
-    return response.choices[0].message.content
+    result = response.choices[0].message.content
+    _cache.put(key, result)
+    return result
+
+
+def stream_text(system_prompt: str, user_prompt: str, on_text: Callable[[str], None],
+                temperature: float = 0.3, cache: bool = True) -> str:
+    """Like complete_text, but calls `on_text(text_so_far)` as chunks arrive. Returns the full text.
+
+    A cached response is delivered in one call. Only opening the stream is
+    retried; a connection dropped mid-stream raises.
+    """
+    key = _cache.make_key("text", GROQ_MODEL, system_prompt, user_prompt, temperature)
+    if cache and (cached := _cache.get(key)) is not None:
+        on_text(cached)
+        return cached
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+
+    def request():
+        # The concurrency slot is held until the stream is consumed, not just opened.
+        _in_flight.acquire()
+        try:
+            return _client.chat.completions.create(
+                model=GROQ_MODEL, temperature=temperature, messages=messages, stream=True,
+            )
+        except BaseException:
+            _in_flight.release()
+            raise
+
+    estimated = estimate_tokens(messages)
+    stream = _llm_scheduler.call(request, estimated)
+    parts: list[str] = []
+    usage = None
+    try:
+        for chunk in stream:
+            # Groq reports the usage on the last chunk, under x_groq (and top-level in newer API versions).
+            usage = getattr(chunk, "usage", None) or getattr(getattr(chunk, "x_groq", None), "usage", None) or usage
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                on_text("".join(parts))
+    finally:
+        _in_flight.release()
+        # call() can't settle a stream; without reported usage (e.g. a dropped stream), charge an estimate.
+        if usage is not None:
+            _llm_scheduler.settle(estimated, usage.prompt_tokens or 0, usage.completion_tokens or 0)
+        else:
+            _llm_scheduler.settle(estimated, estimated - DEFAULT_COMPLETION_TOKENS,
+                                  int(sum(map(len, parts)) / CHARS_PER_TOKEN))
+    result = "".join(parts)
+    _cache.put(key, result)
+    return result
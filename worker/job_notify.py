@@ -0,0 +1,124 @@
+"""Postgres LISTEN/NOTIFY wake-ups for the job runner.
+
+db.enqueue_job fires pg_notify on JOB_NOTIFY_CHANNEL in the same transaction
+as the insert, so the notification is delivered the moment the new job is
+committed. Idle runners block on JobNotifier.wait() instead of re-polling
+pipeline_jobs every few seconds; POLL_INTERVAL_SECONDS is only the fallback
+for a lost listener connection or a job inserted by something that doesn't
+notify (e.g. a manual SQL insert).
+
+Other modules can piggyback on the same connection with subscribe(), e.g.
+tenant_cache for API-key rotations.
+
+The listener holds one dedicated autocommit connection outside the pool —
+LISTEN needs a session-level connection, which the Supavisor *session*
+pooler provides (transaction mode would silently drop the subscription).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Callable
+
+import psycopg2
+import psycopg2.extensions
+
+from config import DATABASE_URL, JOB_NOTIFY_CHANNEL
+
+logger = logging.getLogger("kostencheck.job_notify")
+
+RECONNECT_BACKOFF_SECONDS = 5.0
+
+
+class JobNotifier:
+    def __init__(self, dsn: str = DATABASE_URL, channel: str = JOB_NOTIFY_CHANNEL) -> None:
+        self._dsn = dsn
+        self._channel = channel
+        self._conn: psycopg2.extensions.connection | None = None
+        self._event = asyncio.Event()
+        self._last_attempt = 0.0
+        self._subscribers: dict[str, Callable[[str | None], None]] = {}
+
+    def subscribe(self, channel: str, handler: Callable[[str | None], None]) -> None:
+        """Call `handler(payload)` on the event loop for NOTIFYs on `channel`. Call before start().
+
+        The handler also gets None whenever the listener (re)connects, since
+        notifications sent while it was down are lost.
+        """
+        self._subscribers[channel] = handler
+
+    def _connect(self) -> psycopg2.extensions.connection:
+        conn = psycopg2.connect(self._dsn)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            for channel in (self._channel, *self._subscribers):
+                cur.execute(f'listen "{channel}"')
+        return conn
+
+    async def start(self) -> None:
+        self._last_attempt = time.monotonic()
+        loop = asyncio.get_running_loop()
+        try:
+            self._conn = await loop.run_in_executor(None, self._connect)
+        except psycopg2.Error:
+            logger.warning("could not LISTEN on %s, falling back to polling", self._channel, exc_info=True)
+            return
+        loop.add_reader(self._conn.fileno(), self._on_readable)
+        # Anything enqueued while we weren't listening is picked up by the first claim anyway.
+        self._event.set()
+        for handler in self._subscribers.values():
+            handler(None)
+        logger.info("listening for new jobs on %s", self._channel)
+
+    def _on_readable(self) -> None:
+        assert self._conn is not None
+        try:
+            self._conn.poll()
+        except psycopg2.Error:
+            logger.warning("job listener connection lost, falling back to polling", exc_info=True)
+            self._drop()
+            return
+        for notify in self._conn.notifies:
+            handler = self._subscribers.get(notify.channel)
+            if handler is None:
+                self._event.set()
+                continue
+            try:
+                handler(notify.payload)
+            except Exception:  # noqa: BLE001 — one bad handler mustn't kill the listener
+                logger.exception("handler for %s failed", notify.channel)
+        self._conn.notifies.clear()
+
+    def _drop(self) -> None:
+        if self._conn is None:
+            return
+        try:
+            asyncio.get_running_loop().remove_reader(self._conn.fileno())
+        except (ValueError, OSError):
+            pass
+        try:
+            self._conn.close()
+        except psycopg2.Error:
+            pass
+        self._conn = None
+
+    async def wait(self, timeout: float) -> bool:
+        """Block until a job is announced or `timeout` elapses. True if woken by a notification."""
+        if self._conn is None and time.monotonic() - self._last_attempt >= RECONNECT_BACKOFF_SECONDS:
+            await self.start()
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._event.clear()
+
+    def wake(self) -> None:
+        """Wake a waiting runner without a NOTIFY, e.g. when a concurrency slot frees up."""
+        self._event.set()
+
+    def close(self) -> None:
+        self._drop()
@@ -0,0 +1,113 @@
+"""Persistent response cache for Groq completions.
+
+Identical prompts are common: a stage re-run after a failure, a re-posted
+document, or the same standard clause pair ("30 Tage netto") showing up in
+project after project. Responses are cached in a local SQLite file keyed by
+a hash of (mode, model, system prompt, user prompt, temperature), with a TTL
+and a size cap enforced by evicting least-recently-used entries.
+
+SQLite rather than a Postgres table on purpose: a hit should cost a local
+file read, not another round-trip to the remote pooler. The table itself
+is a sqlite_lru.SqliteLruTable, shared with embedding_cache.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any
+
+from config import LLM_CACHE_ENABLED, LLM_CACHE_MAX_MB, LLM_CACHE_PATH, LLM_CACHE_TTL_SECONDS
+from sqlite_lru import SqliteLruTable
+
+logger = logging.getLogger("kostencheck.llm_cache")
+
+_EVICT_CHECK_EVERY = 100  # puts between size checks
+
+
+class LlmCache:
+    def __init__(self, path: str, ttl_seconds: float, max_bytes: int, enabled: bool = True) -> None:
+        self._ttl = ttl_seconds
+        self.enabled = enabled
+        self._table = SqliteLruTable(
+            path, "llm_cache", "value text not null, size integer not null, created_at real not null",
+            size_sql="size", max_bytes=max_bytes, evict_check_every=_EVICT_CHECK_EVERY, ttl_seconds=ttl_seconds,
+        )
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "writes": 0, "evictions": 0, "errors": 0}
+
+    @staticmethod
+    def make_key(mode: str, model: str, system_prompt: str, user_prompt: str, temperature: float) -> str:
+        payload = json.dumps([mode, model, system_prompt, user_prompt, round(temperature, 4)], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._stats[name] += n
+
+    def get(self, key: str) -> Any | None:
+        if not self.enabled:
+            return None
+        try:
+            conn = self._table.conn()
+            row = conn.execute("select value, created_at from llm_cache where key = ?", (key,)).fetchone()
+            if row is None:
+                self._count("misses")
+                return None
+            if time.time() - row[1] > self._ttl:
+                conn.execute("delete from llm_cache where key = ?", (key,))
+                self._count("expired")
+                self._count("misses")
+                return None
+            self._table.touch([key])
+            self._count("hits")
+            return json.loads(row[0])
+        except sqlite3.Error:
+            # The cache must never take the pipeline down with it.
+            logger.warning("llm cache read failed", exc_info=True)
+            self._count("errors")
+            return None
+
+    def put(self, key: str, value: Any) -> None:
+        if not self.enabled:
+            return
+        encoded = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        try:
+            self._table.conn().execute(
+                "insert or replace into llm_cache (key, value, size, created_at, last_used_at) values (?, ?, ?, ?, ?)",
+                (key, encoded, len(encoded), now, now),
+            )
+        except sqlite3.Error:
+            logger.warning("llm cache write failed", exc_info=True)
+            self._count("errors")
+            return
+        self._count("writes")
+        if self._table.wrote(1):
+            self.evict()
+
+    def evict(self) -> None:
+        """Drop expired entries, then least-recently-used ones until under the size cap."""
+        try:
+            self._count("evictions", self._table.evict())
+        except sqlite3.Error:
+            logger.warning("llm cache eviction failed", exc_info=True)
+            self._count("errors")
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        return {"enabled": self.enabled, **stats, "hit_rate": stats["hits"] / lookups if lookups else None}
+
+
+cache = LlmCache(
+    LLM_CACHE_PATH,
+    ttl_seconds=LLM_CACHE_TTL_SECONDS,
+    max_bytes=int(LLM_CACHE_MAX_MB * 1024 * 1024),
+    enabled=LLM_CACHE_ENABLED,
+)
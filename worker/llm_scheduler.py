@@ -0,0 +1,154 @@
+"""Process-wide rate limiting and retries for all Groq traffic.
+
+Groq enforces requests-per-minute and tokens-per-minute limits. Without
+a budget on our side, a burst of documents ran straight into 429s, which
+surfaced in process_job and failed the stage. Every completion now goes
+through LlmScheduler.call(), which:
+
+- estimates the request's tokens up front and waits until both the RPM and
+  TPM token buckets can cover it (callers queue instead of failing),
+- retries 429 / 5xx / connection errors with full-jitter exponential
+  backoff, honouring Retry-After and pausing all callers on a 429,
+- settles the TPM bucket with the usage Groq actually reports.
+"""
+
+from __future__ import annotations
+
+import logging
+import random
+import threading
+import time
+from typing import Any, Callable
+
+import groq
+
+from config import GROQ_MAX_RETRIES, GROQ_RPM_LIMIT, GROQ_TPM_LIMIT
+
+logger = logging.getLogger("kostencheck.llm_scheduler")
+
+CHARS_PER_TOKEN = 3.5            # conservative for German prose + JSON
+DEFAULT_COMPLETION_TOKENS = 1024
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+
+_RETRYABLE = (groq.RateLimitError, groq.InternalServerError, groq.APIConnectionError, groq.APITimeoutError)
+
+
+class TokenBucket:
+    """Continuously refilling bucket holding at most `per_minute` units. Not thread-safe on its own."""
+
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self._rate = per_minute / 60.0
+        self._updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        # A request larger than the whole bucket is let through once the bucket is full.
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self._rate
+
+
+def estimate_tokens(messages: list[dict[str, str]], max_tokens: int | None = None) -> int:
+    prompt_chars = sum(len(m.get("content") or "") for m in messages)
+    return int(prompt_chars / CHARS_PER_TOKEN) + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+
+class LlmScheduler:
+    def __init__(self, rpm: int, tpm: int, max_retries: int) -> None:
+        self._requests = TokenBucket(rpm)
+        self._tokens = TokenBucket(tpm)
+        self._max_retries = max_retries
+        self._cond = threading.Condition()
+        self._paused_until = 0.0
+        self._stats = {"requests": 0, "retries": 0, "rate_limited": 0, "failures": 0,
+                       "prompt_tokens": 0, "completion_tokens": 0, "queued_seconds": 0.0}
+
+    def _acquire(self, tokens: int) -> None:
+        started = time.monotonic()
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._requests.refill(now)
+                self._tokens.refill(now)
+                wait = max(self._paused_until - now, self._requests.wait_time(1), self._tokens.wait_time(tokens))
+                if wait <= 0:
+                    self._requests.level -= 1
+                    self._tokens.level -= min(tokens, self._tokens.capacity)
+                    self._stats["queued_seconds"] += now - started
+                    return
+                self._cond.wait(wait)
+
+    def _settle(self, estimated: int, response: Any) -> None:
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            self.settle(estimated, usage.prompt_tokens or 0, usage.completion_tokens or 0)
+
+    def settle(self, estimated: int, prompt_tokens: int, completion_tokens: int) -> None:
+        """Record a request's real usage; call() does this itself unless the response is a stream."""
+        with self._cond:
+            self._stats["prompt_tokens"] += prompt_tokens
+            self._stats["completion_tokens"] += completion_tokens
+            # Refund an over-estimate (or charge an under-estimate) so the bucket tracks real usage.
+            self._tokens.level += min(estimated, self._tokens.capacity) - (prompt_tokens + completion_tokens)
+            self._cond.notify_all()
+
+    def _pause(self, seconds: float) -> None:
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    @staticmethod
+    def _retry_after(exc: Exception) -> float | None:
+        response = getattr(exc, "response", None)
+        header = response.headers.get("retry-after") if response is not None else None
+        try:
+            return float(header) if header else None
+        except ValueError:
+            return None
+
+    def call(self, request: Callable[[], Any], estimated_tokens: int) -> Any:
+        attempt = 0
+        while True:
+            self._acquire(estimated_tokens)
+            with self._cond:
+                self._stats["requests"] += 1
+            try:
+                response = request()
+            except _RETRYABLE as exc:
+                if attempt >= self._max_retries:
+                    with self._cond:
+                        self._stats["failures"] += 1
+                    raise
+                delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+                if isinstance(exc, groq.RateLimitError):
+                    delay = max(delay, self._retry_after(exc) or 0.0)
+                    self._pause(delay)
+                    with self._cond:
+                        self._stats["rate_limited"] += 1
+                with self._cond:
+                    self._stats["retries"] += 1
+                attempt += 1
+                logger.warning("groq call failed (%s), retry %d in %.1fs", type(exc).__name__, attempt, delay)
+                time.sleep(delay)
+                continue
+            self._settle(estimated_tokens, response)
+            return response
+
+    def stats(self) -> dict[str, Any]:
+        with self._cond:
+            now = time.monotonic()
+            self._requests.refill(now)
+            self._tokens.refill(now)
+            return {
+                **self._stats,
+                "rpm_available": round(self._requests.level, 1),
+                "tpm_available": round(self._tokens.level),
+                "paused_for": max(self._paused_until - now, 0.0),
+            }
+
+
+scheduler = LlmScheduler(rpm=GROQ_RPM_LIMIT, tpm=GROQ_TPM_LIMIT, max_retries=GROQ_MAX_RETRIES)
@@ -1,48 +1,99 @@
 """Kostencheck Copilot worker API.
 
 Exposes the public document-intake endpoint a customer's ERP posts to,
-plus a background job runner that walks pipeline_jobs through
-parse -> extract -> diff -> generate. Runs as a systemd service on the
+plus a background job scheduler (scheduler.py) that walks pipeline_jobs
+through parse -> extract -> diff -> generate. Runs as a systemd service on the
 Oracle VPS (see DEPLOY.md) alongside the existing thd-pipeline service.
+
+The job scheduler shares this event loop, so async endpoints must not
+block it: file I/O goes through upload_store's async path and database
+calls through the bounded _intake_executor.
 """
 
 from __future__ import annotations
 
 import asyncio
+import json
 import logging
-import shutil
-import uuid
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
-from pathlib import Path
+from functools import partial
+from typing import Any, AsyncIterator, Callable, TypeVar
 
-from fastapi import FastAPI, Header, HTTPException, UploadFile
+from fastapi import FastAPI, Header, HTTPException, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.datastructures import UploadFile as StarletteUploadFile
 
 import db
-from config import POLL_INTERVAL_SECONDS, PORT
-from pipeline import process_job
+import parsing
+import progress
+from batch_upload import (
+    BATCH_UPLOAD_MAX_BYTES,
+    KINDS,
+    MANIFEST_NAMES,
+    MAX_MANIFEST_BYTES,
+    BatchBudget,
+    BatchError,
+    BatchItem,
+    BatchTooLarge,
+    apply_manifest,
+    normalise_path,
+    parse_manifest,
+    store_zip,
+)
+from config import BATCH_MAX_FILES, INTAKE_DB_WORKERS, PORT, PROGRESS_KEEPALIVE_SECONDS
+from embedding_cache import cache as embedding_cache
+from job_notify import JobNotifier
+from llm_cache import cache as llm_cache
+from llm_scheduler import scheduler as llm_scheduler
+from pipeline import intake_document, intake_documents, process_job
+from scheduler import JobScheduler
+from tenant_cache import TENANT_NOTIFY_CHANNEL, tenant_cache
+from upload_store import MAX_UPLOAD_BYTES, UPLOAD_DIR, UploadTooLarge, store_upload_async
+from vector_search import ensure_vector_indexes, vector_search
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("kostencheck.main")
 
-UPLOAD_DIR = Path("/var/lib/kostencheck/uploads")
+T = TypeVar("T")
+
+_SIMILAR_PROJECTS_MAX_LIMIT = 20
+
+# Bounded, so an ERP burst queues here instead of piling onto the DB pool.
+_intake_executor = ThreadPoolExecutor(max_workers=INTAKE_DB_WORKERS, thread_name_prefix="intake")
+
 
+async def _in_db_thread(fn: Callable[..., T], *args: Any) -> T:
+    return await asyncio.get_running_loop().run_in_executor(_intake_executor, partial(fn, *args))
 
-async def _job_runner_loop() -> None:
-    while True:
-        job = db.claim_next_job()
-        if job is None:
-            await asyncio.sleep(POLL_INTERVAL_SECONDS)
-            continue
-        await asyncio.get_event_loop().run_in_executor(None, process_job, job)
+
+def _log_index_check(future: asyncio.Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("vector index check crashed", exc_info=future.exception())
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
-    task = asyncio.create_task(_job_runner_loop())
+    await asyncio.get_event_loop().run_in_executor(None, db.warm_up_pool)
+    # A first-time index build can take a while; don't hold up startup for it.
+    indexes = asyncio.get_event_loop().run_in_executor(None, ensure_vector_indexes)
+    indexes.add_done_callback(_log_index_check)
+    notifier = JobNotifier()
+    notifier.subscribe(TENANT_NOTIFY_CHANNEL, tenant_cache.on_notify)
+    notifier.subscribe(progress.PROGRESS_NOTIFY_CHANNEL, progress.hub.on_notify)
+    await notifier.start()
+    scheduler = JobScheduler(notifier, process_job)
+    app.state.scheduler = scheduler
+    task = asyncio.create_task(scheduler.run())
     yield
     task.cancel()
+    scheduler.shutdown()
+    parsing.shutdown_pool()
+    notifier.close()
+    _intake_executor.shutdown(wait=False, cancel_futures=True)
+    db.close_pool()
 
 
 app = FastAPI(title="Kostencheck Copilot Worker", version="0.1.0", lifespan=lifespan)
@@ -55,10 +106,25 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    """Turn away an oversized upload before its body is parsed, when the client says how big it is.
+
+    Endpoint code runs only after FastAPI has read the multipart body, so this
+    can't wait for the handler; store_upload_async enforces the limit anyway.
+    """
+    length = request.headers.get("content-length")
+    limit = BATCH_UPLOAD_MAX_BYTES if request.url.path == "/api/v1/documents/batch" else MAX_UPLOAD_BYTES
+    if request.method == "POST" and length and length.isdigit() and \
+            int(length) > limit + 64 * 1024:  # + multipart overhead
+        return JSONResponse(status_code=413, content={"detail": f"upload exceeds {limit} bytes"})
+    return await call_next(request)
+
+
 def _authenticate(x_api_key: str | None) -> dict:
     if not x_api_key:
         raise HTTPException(status_code=401, detail="missing X-API-Key")
-    company = db.get_company_by_api_key(x_api_key)
+    company = tenant_cache.get_company(x_api_key)
     if company is None:
         raise HTTPException(status_code=401, detail="invalid API key")
     return company
@@ -69,6 +135,54 @@ def health() -> dict:
     return {"status": "ok"}
 
 
+@app.get("/health/db-pool")
+def db_pool_health() -> dict:
+    """Connection pool counters, for sizing DB_POOL_MAX_SIZE against the Supavisor limit."""
+    return db.pool_stats()
+
+
+@app.get("/health/llm-cache")
+def llm_cache_health() -> dict:
+    """Groq response cache hit/miss counters."""
+    return llm_cache.stats()
+
+
+@app.get("/health/embedding-cache")
+def embedding_cache_health() -> dict:
+    """Embedding vector cache hits (memory / disk) and misses."""
+    return embedding_cache.stats()
+
+
+@app.get("/health/vector-search")
+def vector_search_health() -> dict:
+    """In-memory vs database similarity searches and sampled ANN recall against exact search."""
+    return vector_search.stats()
+
+
+@app.get("/health/tenant-cache")
+def tenant_cache_health() -> dict:
+    """API-key cache hits, negative hits and database lookups."""
+    return tenant_cache.stats()
+
+
+@app.get("/health/progress")
+def progress_health() -> dict:
+    """Progress events received and fanned out, events dropped for slow clients, open streams."""
+    return progress.hub.stats()
+
+
+@app.get("/health/llm-rate")
+def llm_rate_health() -> dict:
+    """Groq RPM/TPM budget left, queueing time, retries and reported token usage."""
+    return llm_scheduler.stats()
+
+
+@app.get("/health/jobs")
+def jobs_health() -> dict:
+    """Jobs currently running in this process, per stage, against their concurrency caps."""
+    return app.state.scheduler.stats()
+
+
 @app.post("/api/v1/documents")
 async def submit_document(
     file: UploadFile,
@@ -85,16 +199,195 @@ async def submit_document(
     if kind not in ("angebot", "bestellung"):
         raise HTTPException(status_code=422, detail="kind must be 'angebot' or 'bestellung'")
 
+    company = await _in_db_thread(_authenticate, x_api_key)
+
+    try:
+        upload = await store_upload_async(file, file.filename)
+    except UploadTooLarge as exc:
+        raise HTTPException(status_code=413, detail=str(exc)) from exc
+    intake = await _in_db_thread(intake_document, company["id"], kind, doc_number, upload)
+
+    return {**intake, "status": "queued"}
+
+
+@app.post("/api/v1/documents/batch")
+async def submit_document_batch(
+    request: Request,
+    kind: str | None = None,
+    x_api_key: str | None = Header(default=None),
+) -> dict:
+    """Bulk intake for migrations: many PDFs and/or ZIPs in one request (see batch_upload.py).
+
+    curl -X POST "https://<worker-host>/api/v1/documents/batch?kind=angebot" \\
+      -H "X-API-Key: <company api key>" \\
+      -F "files=@historie-2023.zip" -F "files=@A-1002.pdf" -F "manifest=@manifest.csv"
+
+    All accepted documents and their first jobs are inserted in one
+    transaction and queued below interactive uploads. Files that can't be
+    taken (too large, unknown kind) are listed with an error; the rest go ahead.
+    """
+    if kind is not None and kind not in KINDS:
+        raise HTTPException(status_code=422, detail="kind must be 'angebot' or 'bestellung'")
+
+    company = await _in_db_thread(_authenticate, x_api_key)
+
+    items: list[BatchItem] = []
+    manifest_entries: dict[str, dict] = {}
+    budget = BatchBudget()
+    # Parsed here rather than via UploadFile parameters: Starlette's default
+    # form limit of 1000 files would cap loose-file batches below BATCH_MAX_FILES.
+    async with request.form(max_files=BATCH_MAX_FILES + 1) as form:
+        manifest = form.get("manifest")
+        files = [upload for upload in form.getlist("files") if isinstance(upload, StarletteUploadFile)]
+        if not files:
+            raise HTTPException(status_code=422, detail="no files in the batch")
+        uploads = [manifest] if isinstance(manifest, StarletteUploadFile) else []
+        try:
+            for upload in [*uploads, *files]:
+                name = upload.filename or "upload.pdf"
+                if upload is manifest or name.lower() in MANIFEST_NAMES:
+                    data = await upload.read(MAX_MANIFEST_BYTES + 1)
+                    if len(data) > MAX_MANIFEST_BYTES:
+                        raise BatchError(f"manifest {name} is too large")
+                    manifest_entries.update(parse_manifest(data, name))
+                elif name.lower().endswith(".zip"):
+                    entries, archive_manifest = await asyncio.to_thread(
+                        store_zip, upload.file, name, BATCH_MAX_FILES - len(items), budget
+                    )
+                    items.extend(entries)
+                    manifest_entries.update(archive_manifest)
+                else:
+                    if len(items) >= BATCH_MAX_FILES:
+                        raise BatchError(f"at most {BATCH_MAX_FILES} files per batch")
+                    item = BatchItem(file=normalise_path(name))
+                    try:
+                        item.upload = await store_upload_async(upload, name, max_bytes=budget.file_limit())
+                        budget.add(item.upload)
+                    except UploadTooLarge as exc:
+                        if budget.over_budget():
+                            raise budget.too_large() from exc
+                        item.error = str(exc)
+                    items.append(item)
+        except BatchError as exc:
+            await asyncio.to_thread(budget.discard)
+            status = 413 if isinstance(exc, BatchTooLarge) else 422
+            raise HTTPException(status_code=status, detail=str(exc)) from exc
+
+    apply_manifest(items, manifest_entries, kind)
+    accepted = [item for item in items if item.error is None]
+    results = iter(await _in_db_thread(
+        intake_documents, company["id"], [(item.kind, item.doc_number, item.upload) for item in accepted]
+    ))
+    return {
+        "accepted": len(accepted),
+        "rejected": len(items) - len(accepted),
+        "items": [
+            {"file": item.file, "kind": item.kind, "doc_number": item.doc_number, "error": item.error}
+            if item.error is not None
+            else {"file": item.file, "kind": item.kind, "doc_number": item.doc_number, **next(results),
+                  "status": "queued"}
+            for item in items
+        ],
+    }
+
+
+@app.post("/api/v1/historical-projects/backfill")
+def backfill_historical_projects(x_api_key: str | None = Header(default=None)) -> dict:
+    """Queue embedding of the company's historical projects that don't have one yet.
+
+    Call after importing project history; a no-op if a backfill is already pending.
+    """
+    company = _authenticate(x_api_key)
+    job_id = db.enqueue_backfill(company["id"])
+    return {"job_id": job_id, "status": "queued" if job_id else "already_pending"}
+
+
+@app.get("/api/v1/historical-projects/similar")
+def similar_historical_projects(q: str, limit: int = 5, x_api_key: str | None = Header(default=None)) -> dict:
+    """The company's historical projects most similar to `q`, nearest first (cosine distance)."""
     company = _authenticate(x_api_key)
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="q must not be empty")
+    if not 1 <= limit <= _SIMILAR_PROJECTS_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {_SIMILAR_PROJECTS_MAX_LIMIT}")
+    return {"projects": vector_search.search(company["id"], q, limit)}
+
+
+def _sse(event: dict[str, Any] | None) -> str:
+    if event is None:
+        return "event: resync\ndata: {}\n\n"
+    return f"data: {json.dumps(event)}\n\n"
 
-    dest = UPLOAD_DIR / f"{uuid.uuid4()}_{file.filename}"
-    with dest.open("wb") as out:
-        shutil.copyfileobj(file.file, out)
 
-    document_id = db.insert_document(company["id"], kind, doc_number, str(dest))
-    job_id = db.enqueue_job(document_id, "parse")
+def _progress_stream(events: AsyncIterator[str]) -> StreamingResponse:
+    # X-Accel-Buffering: a buffering reverse proxy would hold events back.
+    return StreamingResponse(events, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def _next_event(queue: asyncio.Queue) -> dict[str, Any] | None | str:
+    """The next event from a hub queue, progress.RESYNC, or "" after PROGRESS_KEEPALIVE_SECONDS of quiet."""
+    try:
+        return await asyncio.wait_for(queue.get(), PROGRESS_KEEPALIVE_SECONDS)
+    except asyncio.TimeoutError:
+        return ""
+
+
+@app.get("/api/v1/documents/events")
+async def company_progress_events(x_api_key: str | None = Header(default=None)) -> StreamingResponse:
+    """Server-sent events for every document of the caller's company, e.g. to follow a batch upload.
+
+    curl -N https://<worker-host>/api/v1/documents/events -H "X-API-Key: <company api key>"
+
+    Each event is one compact progress.progress_event. An `event: resync`
+    means this worker's listener reconnected and events may have been
+    missed; re-read the documents you care about once.
+    """
+    company = await _in_db_thread(_authenticate, x_api_key)
+
+    async def events() -> AsyncIterator[str]:
+        with progress.hub.subscribe(company_id=str(company["id"])) as queue:
+            yield ": connected\n\n"
+            while True:
+                event = await _next_event(queue)
+                yield ": keep-alive\n\n" if event == "" else _sse(event)
+
+    return _progress_stream(events())
+
+
+@app.get("/api/v1/documents/{document_id}/events")
+async def document_progress_events(document_id: str,
+                                   x_api_key: str | None = Header(default=None)) -> StreamingResponse:
+    """Server-sent events for one document's progress, instead of polling GET /api/v1/documents/{id}.
+
+    curl -N https://<worker-host>/api/v1/documents/<id>/events -H "X-API-Key: <company api key>"
+
+    Starts with the current state, then pushes every transition
+    (queued/parsing/parsed/extract/diff/generate/retrying) and closes after
+    "done" or "error".
+    """
+    company = await _in_db_thread(_authenticate, x_api_key)
+    current = await _in_db_thread(progress.current_progress, document_id)
+    if current is None or current["company_id"] != str(company["id"]):
+        raise HTTPException(status_code=404, detail="document not found")
+
+    async def events() -> AsyncIterator[str]:
+        with progress.hub.subscribe(document_id=document_id) as queue:
+            # Subscribed first, so a transition between this read and the first event isn't lost.
+            event: dict[str, Any] | None | str = await _in_db_thread(progress.current_progress, document_id)
+            while event is not None:
+                if event == "":
+                    yield ": keep-alive\n\n"
+                else:
+                    yield _sse(event)
+                    if event["status"] in progress.TERMINAL_STATUSES:
+                        return
+                event = await _next_event(queue)
+                if event is progress.RESYNC:
+                    # Events may have been missed; start again from the database.
+                    event = await _in_db_thread(progress.current_progress, document_id)
 
-    return {"document_id": document_id, "job_id": job_id, "status": "queued"}
+    return _progress_stream(events())
 
 
 @app.get("/api/v1/documents/{document_id}")
@@ -0,0 +1,197 @@
+"""Tiered OCR for image-only PDF pages.
+
+OCR is the single biggest CPU cost in the worker, and most pages that fall
+through to it aren't scanned text at all — they're cover sheets, logo
+pages and signature pages. So before paying for a 300-DPI Tesseract pass:
+
+1. Render the page at OCR_DETECT_RESOLUTION (cheap) and binarize it.
+2. Skip it if there's essentially no ink (blank page).
+3. Estimate the skew angle and find ink bands via a row projection profile.
+   Too few line-shaped bands means a logo/signature/cover page, which is
+   skipped too — unless bands too tall to be a text line (a ruled table
+   whose vertical rules join its rows, lines that touch, a scanner edge
+   shadow) hold OCR_TALL_BAND_INK_SHARE of the ink, in which case the page
+   is OCR'd whole rather than risk losing its content.
+4. Otherwise render at OCR_RESOLUTION, grayscale + binarize + deskew, and
+   OCR only the detected text blocks (tall bands included) instead of the
+   whole page.
+
+OCR_MODE=full restores the old behaviour (whole page at OCR_RESOLUTION).
+"""
+
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+
+import numpy as np
+from PIL import Image
+
+from config import (
+    OCR_BLANK_INK_RATIO,
+    OCR_DETECT_RESOLUTION,
+    OCR_MIN_TEXT_LINES,
+    OCR_MODE,
+    OCR_RESOLUTION,
+    OCR_TALL_BAND_INK_SHARE,
+)
+
+OCR_LANG = "deu+eng"
+
+# Text lines are roughly 4-30pt tall; expressed in points so they scale with resolution.
+# Taller bands are still OCR'd; they just don't count as text lines.
+_MIN_LINE_PT, _MAX_LINE_PT = 4.0, 30.0
+_BLOCK_GAP_PT = 24.0
+_BLOCK_MARGIN_PT = 6.0
+_DESKEW_ANGLES = np.arange(-5.0, 5.01, 0.5)
+
+
+# _text_blocks result: OCR the page whole, with Tesseract's own layout analysis.
+FULL_PAGE = "full_page"
+
+
+@dataclass
+class OcrResult:
+    text: str
+    timed_out: bool = False
+    skipped: str | None = None  # "blank" / "no_text_lines" when the cheap tier ruled the page out
+
+
+def ocr_page(page, deadline: float) -> OcrResult:
+    try:
+        import pytesseract
+    except ImportError:
+        return OcrResult(text="")
+
+    if OCR_MODE == "full":
+        image = page.to_image(resolution=OCR_RESOLUTION).original
+        return _tesseract(pytesseract, [image], deadline, config="")
+
+    # Tier 1: cheap low-resolution look at the page.
+    small = _grayscale(page.to_image(resolution=OCR_DETECT_RESOLUTION).original)
+    ink = small < _otsu_threshold(small)
+    if ink.mean() < OCR_BLANK_INK_RATIO:
+        return OcrResult(text="", skipped="blank")
+
+    angle = _estimate_skew(ink)
+    if angle:
+        ink = _rotate_mask(ink, angle)
+    layout = _text_blocks(ink, OCR_DETECT_RESOLUTION)
+    if layout is None:
+        return OcrResult(text="", skipped="no_text_lines")
+
+    # Tier 2: full-resolution OCR of the detected text blocks only, or of the whole page.
+    gray = _grayscale(page.to_image(resolution=OCR_RESOLUTION).original)
+    image = Image.fromarray(np.where(gray < _otsu_threshold(gray), 0, 255).astype(np.uint8))
+    if angle:
+        image = image.rotate(angle, resample=Image.NEAREST, fillcolor=255)
+    if layout == FULL_PAGE:
+        return _tesseract(pytesseract, [image], deadline, config="")
+    blocks = layout
+    scale = OCR_RESOLUTION / OCR_DETECT_RESOLUTION
+    crops = [
+        image.crop((int(left * scale), int(top * scale), int(right * scale), int(bottom * scale)))
+        for left, top, right, bottom in blocks
+    ]
+    # psm 6: each crop is a single uniform block of text, no layout analysis needed.
+    return _tesseract(pytesseract, crops, deadline, config="--psm 6")
+
+
+def _tesseract(pytesseract, images: list[Image.Image], deadline: float, config: str) -> OcrResult:
+    texts: list[str] = []
+    for image in images:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return OcrResult(text="\n".join(texts), timed_out=True)
+        try:
+            texts.append(pytesseract.image_to_string(image, lang=OCR_LANG, config=config, timeout=remaining))
+        except RuntimeError:  # pytesseract kills Tesseract and raises RuntimeError on timeout
+            return OcrResult(text="\n".join(texts), timed_out=True)
+    return OcrResult(text="\n".join(t.strip() for t in texts if t.strip()))
+
+
+def _grayscale(image: Image.Image) -> np.ndarray:
+    return np.asarray(image.convert("L"), dtype=np.uint8)
+
+
+def _otsu_threshold(gray: np.ndarray) -> int:
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    total = hist.sum()
+    weight_bg = np.cumsum(hist)
+    weight_fg = total - weight_bg
+    cum_mean = np.cumsum(hist * np.arange(256))
+    mean_bg = cum_mean / np.maximum(weight_bg, 1)
+    mean_fg = (cum_mean[-1] - cum_mean) / np.maximum(weight_fg, 1)
+    between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    return int(np.argmax(between)) + 1
+
+
+def _rotate_mask(mask: np.ndarray, angle: float) -> np.ndarray:
+    image = Image.fromarray((mask * 255).astype(np.uint8))
+    return np.asarray(image.rotate(angle, resample=Image.NEAREST, fillcolor=0)) > 0
+
+
+def _estimate_skew(ink: np.ndarray) -> float:
+    """Angle (degrees) that makes text rows sharpest, i.e. maximizes row-profile variance."""
+    best_angle, best_score = 0.0, -1.0
+    for angle in _DESKEW_ANGLES:
+        rotated = _rotate_mask(ink, float(angle)) if angle else ink
+        score = float(np.var(rotated.sum(axis=1)))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+def _text_blocks(ink: np.ndarray, resolution: int) -> list[tuple[int, int, int, int]] | str | None:
+    """Bounding boxes (left, top, right, bottom) of the page's text blocks.
+
+    None if the page has no text lines (logo/signature/cover), FULL_PAGE if
+    bands too tall to be single lines hold so much of the ink that the page
+    is safer OCR'd whole.
+    """
+    px_per_pt = resolution / 72.0
+    height, width = ink.shape
+    row_ink = ink.sum(axis=1)
+    inked_rows = row_ink > max(1, width * 0.005)
+
+    bands: list[tuple[int, int]] = []
+    start = None
+    for y, inked in enumerate(inked_rows):
+        if inked and start is None:
+            start = y
+        elif not inked and start is not None:
+            bands.append((start, y))
+            start = None
+    if start is not None:
+        bands.append((start, height))
+
+    bands = [(top, bottom) for top, bottom in bands if bottom - top >= _MIN_LINE_PT * px_per_pt]
+    tall_bands = [(top, bottom) for top, bottom in bands if bottom - top > _MAX_LINE_PT * px_per_pt]
+    line_count = len(bands) - len(tall_bands)
+    total_ink = float(row_ink.sum())
+    tall_ink = float(sum(row_ink[top:bottom].sum() for top, bottom in tall_bands))
+    if total_ink and tall_ink / total_ink >= OCR_TALL_BAND_INK_SHARE:
+        return FULL_PAGE
+    # The line count only decides whether there's text at all; every band is OCR'd.
+    if line_count < OCR_MIN_TEXT_LINES:
+        return None
+
+    grouped: list[list[tuple[int, int]]] = [[bands[0]]]
+    for band in bands[1:]:
+        if band[0] - grouped[-1][-1][1] <= _BLOCK_GAP_PT * px_per_pt:
+            grouped[-1].append(band)
+        else:
+            grouped.append([band])
+
+    margin = int(_BLOCK_MARGIN_PT * px_per_pt)
+    blocks: list[tuple[int, int, int, int]] = []
+    for group in grouped:
+        top, bottom = group[0][0], group[-1][1]
+        columns = np.flatnonzero(ink[top:bottom].any(axis=0))
+        blocks.append((
+            max(int(columns[0]) - margin, 0),
+            max(top - margin, 0),
+            min(int(columns[-1]) + margin + 1, width),
+            min(bottom + margin, height),
+        ))
+    return blocks
@@ -3,37 +3,224 @@
 Deliberately CPU-only. pdfplumber handles the vast majority of Angebot/
 Bestellung PDFs (they're generated by ERP/office software, not scanned).
 Tesseract only kicks in when a page yields near-zero extractable text,
-which is the signature of a scanned/flattened page.
+which is the signature of a scanned/flattened page (see ocr.py for the
+cheap blank/cover/signature-page checks that run before it).
+
+Pages are independent, so multi-page documents fan out to a process pool
+(one page per task, each child keeps the PDF open between its pages) and
+are reassembled in page order. Every page gets a time budget: OCR is
+handed the remaining budget as Tesseract's own timeout, so one pathological
+scan can't stall the whole document, and a page stuck anywhere else has
+its worker process killed (the pool is recycled).
 """
 
 from __future__ import annotations
 
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict, dataclass, field
+
 import pdfplumber
 
+from config import PARSE_MAX_TASKS_PER_CHILD, PARSE_PAGE_TIMEOUT_SECONDS, PARSE_WORKERS
+from ocr import ocr_page
+
+logger = logging.getLogger("kostencheck.parsing")
+
+# Pages are joined with a form feed (as pdfminer does), so later stages can
+# split raw_text on page boundaries — see extraction._split_blocks.
+PAGE_SEPARATOR = "\n\f\n"
+
+
+@dataclass
+class PageResult:
+    page_no: int
+    text: str
+    tables: list[list[list[str | None]]] = field(default_factory=list)
+    ocr: bool = False
+    ocr_skipped: str | None = None
+    timed_out: bool = False
+    seconds: float = 0.0
+
+
+@dataclass
+class ParseResult:
+    text: str
+    pages: list[PageResult]
+    seconds: float
+
+    def timings(self) -> list[dict]:
+        """Per-page cost summary (no text), for logging and document metadata."""
+        return [
+            {k: v for k, v in asdict(page).items() if k not in ("text", "tables")}
+            for page in self.pages
+        ]
+
 
 def extract_text(file_path: str) -> str:
-    pages_text: list[str] = []
+    return parse_document(file_path).text
+
+
+def parse_document(file_path: str) -> ParseResult:
+    started = time.monotonic()
     with pdfplumber.open(file_path) as pdf:
-        for page in pdf.pages:
-            text = page.extract_text() or ""
-            if len(text.strip()) < 20:
-                text = _ocr_page(page)
-            pages_text.append(text)
-            for table in page.extract_tables() or []:
-                pages_text.append(_table_to_text(table))
-    return "\n\n".join(pages_text)
+        page_count = len(pdf.pages)
+        if page_count <= 1 or PARSE_WORKERS <= 1:
+            pages = [_parse_page(page, i, _deadline()) for i, page in enumerate(pdf.pages)]
+        else:
+            pages = None
+    if pages is None:
+        pages = _parse_pages_in_pool(file_path, page_count)
+
+    page_texts = [
+        "\n\n".join([page.text, *(_table_to_text(table) for table in page.tables)])
+        for page in pages
+    ]
+    return ParseResult(text=PAGE_SEPARATOR.join(page_texts), pages=pages, seconds=time.monotonic() - started)
+
+
+def _deadline() -> float:
+    return time.monotonic() + PARSE_PAGE_TIMEOUT_SECONDS
+
+
+def _parse_page(page, page_no: int, deadline: float) -> PageResult:
+    started = time.monotonic()
+    result = PageResult(page_no=page_no, text=page.extract_text() or "")
+    if len(result.text.strip()) < 20:
+        # An image-only page has no text layer for pdfplumber to find tables
+        # in, so extract_tables would only burn time on it.
+        ocr = ocr_page(page, deadline)
+        result.ocr = True
+        result.text, result.timed_out, result.ocr_skipped = ocr.text, ocr.timed_out, ocr.skipped
+    else:
+        result.tables = page.extract_tables() or []
+    result.seconds = time.monotonic() - started
+    return result
 
 
 def _table_to_text(table: list[list[str | None]]) -> str:
-    rows = [" | ".join(cell or "" for cell in row) for row in table]
+    # One line per row: wrapped cell text is flattened so table_extraction.py
+    # can read the rows back by splitting on " | ".
+    rows = [" | ".join(" ".join((cell or "").split()) for cell in row) for row in table]
     return "\n".join(rows)
 
 
-def _ocr_page(page) -> str:
-    try:
-        import pytesseract
-    except ImportError:
-        return ""
+# --- process pool -----------------------------------------------------------
+
+# The child enforces each page's budget itself (OCR gets it as Tesseract's
+# timeout); the parent kills a page stuck outside OCR, e.g. in a pathological
+# table. A task counts as running once it's handed to the pool's call queue,
+# where it may still wait out one other page's budget for a free child.
+_PAGE_HARD_LIMIT_SECONDS = 2 * PARSE_PAGE_TIMEOUT_SECONDS + 15
+_DEADLINE_POLL_SECONDS = 1.0
+_MAX_PAGE_RESUBMITS = 2
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # forkserver rather than fork: the parent is multi-threaded (job
+            # scheduler, DB pool), and forking a threaded process is unsafe.
+            _pool = ProcessPoolExecutor(
+                max_workers=PARSE_WORKERS,
+                mp_context=multiprocessing.get_context("forkserver"),
+                max_tasks_per_child=PARSE_MAX_TASKS_PER_CHILD,
+            )
+        return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
 
-    image = page.to_image(resolution=300).original
-    return pytesseract.image_to_string(image, lang="deu+eng")
+def _recycle_pool(stale: ProcessPoolExecutor) -> None:
+    """Kill `stale`'s children and let the next _get_pool() start afresh.
+
+    The only way to stop a page stuck in a child: Future.cancel() can't
+    interrupt a running task. Other documents' pages on the old pool fail
+    with BrokenProcessPool and are resubmitted by their own callers.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is stale:
+            _pool = None
+    processes = list((stale._processes or {}).values())  # no public accessor
+    stale.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.kill()
+
+
+def _parse_pages_in_pool(file_path: str, page_count: int) -> list[PageResult]:
+    pages: dict[int, PageResult] = {}
+    broken: dict[int, int] = {}
+    pending = list(range(page_count))
+    while pending:
+        pool = _get_pool()
+        futures = {pool.submit(_parse_page_in_child, file_path, i): i for i in pending}
+        pending = []
+        started: dict[Future, float] = {}
+        not_done = set(futures)
+        while not_done:
+            done, not_done = wait(not_done, timeout=_DEADLINE_POLL_SECONDS)
+            now = time.monotonic()
+            for future in done:
+                page_no = futures[future]
+                try:
+                    pages[page_no] = future.result()
+                except BrokenProcessPool:
+                    # Recycled under us (another document's page overran) or a child crashed.
+                    broken[page_no] = broken.get(page_no, 0) + 1
+                    if broken[page_no] > _MAX_PAGE_RESUBMITS:
+                        logger.warning("page %s of %s keeps crashing its worker, skipping", page_no + 1, file_path)
+                        pages[page_no] = PageResult(page_no=page_no, text="", timed_out=True)
+                    else:
+                        pending.append(page_no)
+            overrun = []
+            for future in not_done:
+                if future.running():
+                    started.setdefault(future, now)
+                    if now - started[future] > _PAGE_HARD_LIMIT_SECONDS:
+                        overrun.append(future)
+            if overrun:
+                for future in overrun:
+                    page_no = futures[future]
+                    logger.warning("page %s of %s exceeded its time budget, killing its worker", page_no + 1, file_path)
+                    pages[page_no] = PageResult(page_no=page_no, text="", timed_out=True,
+                                                seconds=now - started[future])
+                    not_done.discard(future)
+                # Everything else still on this pool is lost with it: resubmit on the fresh one.
+                pending.extend(futures[future] for future in not_done)
+                _recycle_pool(pool)
+                break
+    return [pages[i] for i in range(page_count)]
+
+
+# Each child keeps its most recently opened PDF, so consecutive pages of one
+# document don't re-open and re-parse the file's cross-reference table.
+_child_pdf: tuple[str, pdfplumber.PDF] | None = None
+
+
+def _parse_page_in_child(file_path: str, page_no: int) -> PageResult:
+    global _child_pdf
+    deadline = _deadline()
+    if _child_pdf is None or _child_pdf[0] != file_path:
+        if _child_pdf is not None:
+            _child_pdf[1].close()
+        _child_pdf = (file_path, pdfplumber.open(file_path))
+    page = _child_pdf[1].pages[page_no]
+    try:
+        return _parse_page(page, page_no, deadline)
+    finally:
+        page.close()
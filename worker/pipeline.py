@@ -1,19 +1,28 @@
 """Orchestrates one document through parse -> extract -> diff -> generate.
 
-Called by the job runner in main.py once per claimed pipeline_jobs row.
+Called by the job scheduler (scheduler.py) once per claimed pipeline_jobs row.
 Each stage is idempotent-ish and updates document/job status as it goes so
-the Infrastructure/Live Stack dashboard page reflects real progress.
+the Infrastructure/Live Stack dashboard page reflects real progress. A
+failing stage is re-queued with backoff (db.fail_job) and only marks the
+document as errored once the job is dead-lettered. Every transition is also
+published to API clients as a progress event (progress.py). Company-level
+'backfill' jobs share the queue and are handed to backfill.py.
 """
 
 from __future__ import annotations
 
 import logging
-from typing import Any
+import time
+from functools import partial
+from typing import Any, Callable
 
 import db
 import parsing
+import progress
+from backfill import run_backfill
 from clause_diff import compare_clause
-from diff_engine import diff_line_items
+from config import GENERATE_FLUSH_SECONDS
+from diff_engine import Deviation, diff_line_items
 from extraction import extract_document
 from generate import (
     generate_ab_draft,
@@ -21,6 +30,8 @@ from generate import (
     generate_kickoff_brief,
     generate_zusammenfassung,
 )
+from groq_client import gather
+from upload_store import StoredUpload
 
 logger = logging.getLogger("kostencheck.pipeline")
 
@@ -30,114 +41,284 @@ CHECKLIST_RULES = [
 ]
 
 
-def process_job(job: dict[str, Any]) -> None:
+def intake_document(company_id: str, kind: str, doc_number: str | None,
+                    upload: StoredUpload) -> dict[str, Any]:
+    """Register an upload and queue its first stage.
+
+    If this company already uploaded the identical file (same SHA-256), its
+    parsed text — and, if available, extracted metadata and line items — are
+    copied over and the document jumps straight to the stage after them
+    instead of paying for parse, OCR and LLM extraction again.
+    """
+    return intake_documents(company_id, [(kind, doc_number, upload)], db.JOB_PRIORITY_INTERACTIVE)[0]
+
+
+def intake_documents(company_id: str, items: list[tuple[str, str | None, StoredUpload]],
+                     priority: int = db.JOB_PRIORITY_BATCH) -> list[dict[str, Any]]:
+    """intake_document for many (kind, doc_number, upload) items in one transaction.
+
+    Documents and jobs go in as one multi-row insert each and duplicates are
+    looked up with one query, so a batch of thousands costs a handful of
+    round-trips. Results are in input order.
+    """
+    with db.session():
+        document_ids = db.insert_documents(
+            company_id, [(kind, doc_number, str(upload.path), upload.sha256) for kind, doc_number, upload in items]
+        )
+        duplicates = db.find_processed_duplicates(
+            company_id, [upload.sha256 for _, _, upload in items], exclude_document_ids=document_ids
+        )
+        results = []
+        for document_id, (kind, _, upload) in zip(document_ids, items):
+            duplicate = duplicates.get(upload.sha256)
+            if duplicate is None:
+                stage = "parse"
+            else:
+                db.clone_document_results(duplicate["id"], document_id, include_extraction=duplicate["extracted"])
+                stage = _stage_after_extract(kind) if duplicate["extracted"] else "extract"
+                logger.info("document %s duplicates %s, starting at %s", document_id, duplicate["id"], stage)
+            results.append({
+                "document_id": document_id,
+                "stage": stage,
+                "duplicate_of": str(duplicate["id"]) if duplicate else None,
+            })
+        job_ids = db.enqueue_jobs([(r["document_id"], r["stage"]) for r in results], priority)
+    return [{**result, "job_id": job_id} for result, job_id in zip(results, job_ids)]
+
+
+# Names the document's next stage. process_job queues it — or, with stages
+# fused, starts it in this same worker — once the current job is recorded done.
+Advance = Callable[[str], None]
+
+# Given the finished job and the next stage, returns a job row for that stage
+# already claimed by this worker, or None if the stage should be queued instead.
+ContinueWith = Callable[[dict[str, Any], str], "dict[str, Any] | None"]
+
+
+def process_job(job: dict[str, Any], continue_with: ContinueWith | None = None) -> None:
+    """Run a claimed job, and with `continue_with` (see JobScheduler) possibly its following stages too.
+
+    Fused stages reuse the in-memory document — raw text, metadata and the
+    stored line items — instead of re-reading it, while every stage still
+    gets its own pipeline_jobs row and document status updates.
+    """
+    if job["stage"] == "backfill":
+        _process_backfill(job)
+        return
+
     document = db.get_document(job["document_id"])
     if document is None:
-        db.finish_job(job["id"], "error", "document not found")
+        db.finish_job(job["id"], job["locked_by"], "error", "document not found")
         return
 
+    while job is not None:
+        # Only the job's current owner may hand the document on: if the lease
+        # was lost, the reaper has already re-queued this stage elsewhere.
+        next_stages: list[str] = []
+        next_job = None
+        stage = job["stage"]
+        try:
+            progress.publish(document, progress.running_status(stage), stage)
+            STAGE_RUNNERS[stage](document, next_stages.append)
+            with db.session():
+                if not db.finish_job(job["id"], job["locked_by"], "done"):
+                    logger.warning("job %s (%s) lost its lease while running; leaving it to its new owner",
+                                   job["id"], stage)
+                    return
+                for next_stage in next_stages:
+                    next_job = continue_with(job, next_stage) if continue_with is not None else None
+                    if next_job is None:
+                        db.enqueue_job(document["id"], next_stage,
+                                       job.get("priority", db.JOB_PRIORITY_INTERACTIVE))
+                if stage == "parse":
+                    progress.publish(document, "parsed", next_stages[0] if next_stages else stage)
+                elif not next_stages:
+                    progress.publish(document, "done", stage)
+                elif next_job is None:
+                    progress.publish(document, "queued", next_stages[0])
+        except Exception as exc:  # noqa: BLE001 — surface any failure onto the job row
+            logger.exception("job %s failed (attempt %s)", job["id"], job.get("attempts"))
+            with db.session():
+                status = db.fail_job(job["id"], job["locked_by"], str(exc))
+                if status is None:
+                    logger.warning("job %s (%s) lost its lease while running; leaving it to its new owner",
+                                   job["id"], stage)
+                elif status == "dead":
+                    db.update_document(document["id"], status="error")
+                    progress.publish(document, "error", stage, str(exc))
+                else:
+                    progress.publish(document, "retrying", stage, str(exc))
+            return
+        job = next_job
+
+
+def _process_backfill(job: dict[str, Any]) -> None:
     try:
-        if job["stage"] == "parse":
-            _run_parse(document)
-        elif job["stage"] == "extract":
-            _run_extract(document)
-        elif job["stage"] == "diff":
-            _run_diff(document)
-        elif job["stage"] == "generate":
-            _run_generate(document)
-        db.finish_job(job["id"], "done")
-    except Exception as exc:  # noqa: BLE001 — surface any failure onto the job row
-        logger.exception("job %s failed", job["id"])
-        db.finish_job(job["id"], "error", str(exc))
-        db.update_document(document["id"], status="error")
-
-
-def _run_parse(document: dict[str, Any]) -> None:
+        run_backfill(job)
+    except Exception as exc:  # noqa: BLE001 — the retry resumes from the job's checkpoint
+        logger.exception("backfill job %s failed (attempt %s)", job["id"], job.get("attempts"))
+        db.fail_job(job["id"], job["locked_by"], str(exc))
+
+
+def _run_parse(document: dict[str, Any], advance: Advance) -> None:
     db.update_document(document["id"], status="parsing")
-    raw_text = parsing.extract_text(document["file_url"])
-    db.update_document(document["id"], raw_text=raw_text, status="parsed")
-    db.enqueue_job(document["id"], "extract")
+    parsed = parsing.parse_document(document["file_url"])
+    slowest = max(parsed.pages, key=lambda p: p.seconds, default=None)
+    logger.info(
+        "parsed %s: %d pages in %.1fs (slowest: page %s, %.1fs)", document["id"], len(parsed.pages),
+        parsed.seconds, slowest.page_no + 1 if slowest else "-", slowest.seconds if slowest else 0,
+    )
+    metadata = {**(document.get("metadata") or {}), "parse_timings": parsed.timings()}
+    db.update_document(document["id"], raw_text=parsed.text, metadata=metadata, status="parsed")
+    document.update(raw_text=parsed.text, metadata=metadata, status="parsed")
+    advance("extract")
 
 
-def _run_extract(document: dict[str, Any]) -> None:
-    extracted = extract_document(document["raw_text"] or "")
+def _run_extract(document: dict[str, Any], advance: Advance) -> None:
+    ocr_pages = [page["page_no"] for page in document.get("metadata", {}).get("parse_timings", []) if page.get("ocr")]
+    extracted = extract_document(document["raw_text"] or "", ocr_pages)
     merged_metadata = {**document.get("metadata", {}), **extracted["metadata"], "clauses": extracted["clauses"]}
-    db.update_document(document["id"], metadata=merged_metadata)
-    db.insert_line_items(document["id"], extracted["line_items"])
-    if document["kind"] == "bestellung":
-        db.enqueue_job(document["id"], "diff")
-    else:
-        db.enqueue_job(document["id"], "generate")
+    # One transaction, and replacing rather than adding: a retried or reaped
+    # extract must not duplicate the items, and find_processed_duplicates
+    # treats metadata with clauses as "extracted", so it must never be
+    # visible without its items.
+    with db.session():
+        db.update_document(document["id"], metadata=merged_metadata)
+        db.delete_line_items(document["id"])
+        line_items = db.insert_line_items(document["id"], extracted["line_items"])
+    # Not a column: lets a fused diff stage skip re-reading the rows just written.
+    document.update(metadata=merged_metadata, line_items=line_items)
+    advance(_stage_after_extract(document["kind"]))
+
 
+def _stage_after_extract(kind: str) -> str:
+    return "diff" if kind == "bestellung" else "generate"
 
-def _run_diff(document: dict[str, Any]) -> None:
+
+def _run_diff(document: dict[str, Any], advance: Advance) -> None:
     quote_document = db.latest_quote_document(document["company_id"])
     if quote_document is None:
         raise RuntimeError("no matching Angebot found for this Bestellung")
 
     quote_items = db.get_line_items(quote_document["id"])
-    order_items = db.get_line_items(document["id"])
-
-    project = db.find_matching_project(document["company_id"], document["id"])
-    if project is None:
-        project_id = db.create_project(
-            company_id=document["company_id"],
-            name=f'{document.get("metadata", {}).get("customer", "Unbekannt")} – Kostencheck',
-            customer_name=document.get("metadata", {}).get("customer"),
-            quote_document_id=quote_document["id"],
-            order_document_id=document["id"],
-        )
-    else:
-        project_id = project["id"]
-
-    for deviation in diff_line_items(quote_items, order_items):
-        db.insert_deviation(
-            project_id=project_id,
-            quote_line_item_id=deviation.quote_item.get("id") if deviation.quote_item else None,
-            order_line_item_id=deviation.order_item.get("id") if deviation.order_item else None,
-            dtype=deviation.type,
-            severity=deviation.severity,
-            impact_eur=deviation.impact_eur,
-            confidence=deviation.confidence,
-            needs_review=deviation.needs_review,
-            description=deviation.description,
-        )
-        _maybe_add_checklist_item(project_id, deviation)
+    order_items = document["line_items"] if "line_items" in document else db.get_line_items(document["id"])
 
+    # Everything slow (matching, LLM clause comparisons) happens before the
+    # transaction opens; the transaction only writes.
+    line_deviations = diff_line_items(quote_items, order_items)
     quote_clauses = quote_document.get("metadata", {}).get("clauses", {})
     order_clauses = document.get("metadata", {}).get("clauses", {})
-    for label in ("payment_terms", "delivery", "warranty", "penalties"):
-        result = compare_clause(label, quote_clauses.get(label), order_clauses.get(label))
-        if result:
-            db.insert_deviation(
-                project_id=project_id, quote_line_item_id=None, order_line_item_id=None,
-                dtype="CLAUSE_CHANGED", severity=result["severity"], impact_eur=0,
-                confidence=result["confidence"], needs_review=result["confidence"] < 0.8,
-                description=result["description"],
-            )
+    labels = ("payment_terms", "delivery", "warranty", "penalties")
+    clause_results = gather(*(
+        partial(compare_clause, label, quote_clauses.get(label), order_clauses.get(label)) for label in labels
+    ))
 
-    db.enqueue_job(document["id"], "generate")
+    deviation_rows = [
+        {
+            "quote_line_item_id": deviation.quote_item.get("id") if deviation.quote_item else None,
+            "order_line_item_id": deviation.order_item.get("id") if deviation.order_item else None,
+            "type": deviation.type,
+            "severity": deviation.severity,
+            "impact_eur": deviation.impact_eur,
+            "confidence": deviation.confidence,
+            "needs_review": deviation.needs_review,
+            "description": deviation.description,
+        }
+        for deviation in line_deviations
+    ]
+    deviation_rows += [
+        {
+            "quote_line_item_id": None, "order_line_item_id": None, "type": "CLAUSE_CHANGED",
+            "severity": result["severity"], "impact_eur": 0, "confidence": result["confidence"],
+            "needs_review": result["confidence"] < 0.8, "description": result["description"],
+        }
+        for result in clause_results if result
+    ]
+    checklist_items = _checklist_items(line_deviations)
+
+    with db.session():
+        project = db.find_matching_project(document["company_id"], document["id"])
+        if project is None:
+            project_id = db.create_project(
+                company_id=document["company_id"],
+                name=f'{document.get("metadata", {}).get("customer", "Unbekannt")} – Kostencheck',
+                customer_name=document.get("metadata", {}).get("customer"),
+                quote_document_id=quote_document["id"],
+                order_document_id=document["id"],
+            )
+        else:
+            project_id = project["id"]
+        db.replace_diff_results(project_id, deviation_rows, checklist_items)
+    advance("generate")
 
 
-def _maybe_add_checklist_item(project_id: str, deviation) -> None:
-    for needle, template, category, priority in CHECKLIST_RULES:
+def _checklist_items(deviations: list[Deviation]) -> list[dict[str, Any]]:
+    items: dict[str, dict[str, Any]] = {}
+    for deviation in deviations:
         article = (deviation.order_item or deviation.quote_item or {}).get("article_no", "")
-        if needle in (article or ""):
-            db.insert_checklist_item(project_id, template.format(article=article), category, priority)
+        for needle, template, category, priority in CHECKLIST_RULES:
+            if needle in (article or ""):
+                label = template.format(article=article)
+                items.setdefault(label, {"label": label, "category": category, "priority": priority})
+    return list(items.values())
 
 
-def _run_generate(document: dict[str, Any]) -> None:
+def _run_generate(document: dict[str, Any], advance: Advance) -> None:
+    """Write all generated documents at once, streaming the LLM ones into their rows.
+
+    Deliberately not one transaction: the deterministic Abweichungsbericht
+    is committed right away together with an empty row per LLM document,
+    which is then filled in as its completion streams — the dashboard shows
+    output within a second instead of after the slowest completion.
+    """
     project = db.find_matching_project(document["company_id"], document["id"])
     if project is None:
         return  # a lone Angebot with no order yet — nothing to generate
 
     deviations = db.get_deviations(project["id"])
-    zusammenfassung = generate_zusammenfassung(project["name"], deviations)
-    db.insert_generated_doc(project["id"], "zusammenfassung", f'Zusammenfassung – {project["name"]}', zusammenfassung)
+    checklist = db.get_checklist_items(project["id"])
+    needs_review = [d for d in deviations if d.get("needs_review")]
+    name = project["name"]
 
-    report = generate_deviation_report(deviations)
-    db.insert_generated_doc(project["id"], "deviation_report", f'Abweichungsbericht – {project["name"]}', report)
+    streamed = [
+        ("zusammenfassung", f"Zusammenfassung – {name}",
+         partial(generate_zusammenfassung, name, deviations)),
+        ("kickoff_brief", f"KickOff-Brief – {name}",
+         partial(generate_kickoff_brief, name, project.get("customer_name") or "", checklist)),
+        ("ab_draft", "Auftragsbestätigung (Entwurf)",
+         partial(generate_ab_draft, document.get("doc_number", ""), needs_review)),
+    ]
+    with db.session():
+        db.delete_generated_docs(project["id"])  # a re-run replaces, not appends
+        db.insert_generated_doc(project["id"], "deviation_report", f"Abweichungsbericht – {name}",
+                                generate_deviation_report(deviations))
+        doc_ids = [db.insert_generated_doc(project["id"], kind, title, "", status="streaming")
+                   for kind, title, _ in streamed]
+    gather(*(partial(_stream_generated_doc, doc_id, generator)
+             for doc_id, (_, _, generator) in zip(doc_ids, streamed)))
 
-    needs_review = [d for d in deviations if d.get("needs_review")]
-    ab_draft = generate_ab_draft(document.get("doc_number", ""), needs_review)
-    db.insert_generated_doc(project["id"], "ab_draft", f'Auftragsbestätigung (Entwurf)', ab_draft)
+
+def _stream_generated_doc(doc_id: str, generator: Callable[..., str]) -> None:
+    last_flush = 0.0
+
+    def on_text(text: str) -> None:
+        nonlocal last_flush
+        now = time.monotonic()
+        if now - last_flush >= GENERATE_FLUSH_SECONDS:
+            db.update_generated_doc(doc_id, text)
+            last_flush = now
+
+    try:
+        text = generator(on_text=on_text)
+    except Exception:
+        db.update_generated_doc(doc_id, "", status="error")
+        raise
+    db.update_generated_doc(doc_id, text, status="done")
+
+
+STAGE_RUNNERS: dict[str, Callable[[dict[str, Any], Advance], None]] = {
+    "parse": _run_parse,
+    "extract": _run_extract,
+    "diff": _run_diff,
+    "generate": _run_generate,
+}
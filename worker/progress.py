@@ -0,0 +1,151 @@
+"""Push-based document progress for API clients (the .../events SSE endpoints).
+
+Clients used to learn progress by polling GET /api/v1/documents/{id},
+which returns the whole pipeline_documents row, raw_text included, every
+time. Now process_job publishes each transition as a small event:
+
+    {"document_id": "...", "company_id": "...", "status": "extract", "stage": "extract", "error": null}
+
+status runs queued -> parsing -> parsed -> extract -> diff -> generate ->
+done, with "retrying" while a failed stage waits out its backoff and
+"error" once it is dead-lettered. "queued" means `stage` is waiting for a
+free slot.
+
+publish() sends the event as a pg_notify on PROGRESS_NOTIFY_CHANNEL, inside
+the transaction that records the transition when there is one, so it only
+goes out once committed and reaches every worker instance, whichever one
+ran the job. Each process's JobNotifier hands it to the one ProgressHub,
+which fans it out to however many streams are open: one LISTEN connection
+per process instead of one query per polling client.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+import db
+from config import PROGRESS_QUEUE_SIZE
+
+logger = logging.getLogger("kostencheck.progress")
+
+PROGRESS_NOTIFY_CHANNEL = "pipeline_document_progress"
+
+# Put on subscriber queues when the listener (re)connects: events may have been missed.
+RESYNC = None
+
+TERMINAL_STATUSES = ("done", "error")
+
+_MAX_ERROR_CHARS = 200  # NOTIFY payloads are capped at 8000 bytes
+
+
+def running_status(stage: str) -> str:
+    return "parsing" if stage == "parse" else stage
+
+
+def progress_event(document_id: str, company_id: str, status: str, stage: str | None = None,
+                   error: str | None = None) -> dict[str, Any]:
+    return {
+        "document_id": str(document_id),
+        "company_id": str(company_id),
+        "status": status,
+        "stage": stage,
+        "error": error[:_MAX_ERROR_CHARS] if error else None,
+    }
+
+
+def publish(document: dict[str, Any], status: str, stage: str | None = None, error: str | None = None) -> None:
+    """Announce a transition of `document`. Blocking; joins the caller's db.session() if there is one."""
+    event = progress_event(document["id"], document["company_id"], status, stage, error)
+    db.execute("select pg_notify(%s, %s)", (PROGRESS_NOTIFY_CHANNEL, json.dumps(event)))
+
+
+def current_progress(document_id: str) -> dict[str, Any] | None:
+    """The document's progress as an event, worked out from its latest job; None if there's no such document."""
+    row = db.get_document_progress(document_id)
+    if row is None:
+        return None
+    stage, job_status = row["job_stage"], row["job_status"]
+    if row["status"] == "error" or job_status in ("dead", "error"):
+        status = "error"
+    elif job_status is None:
+        status, stage = "queued", "parse"
+    elif job_status == "processing":
+        status = running_status(stage)
+    elif job_status == "queued" and row["job_error"]:
+        status = "retrying"
+    elif job_status == "queued":
+        # The document row stays 'parsed' for the rest of the pipeline; only
+        # the wait for extract is "parsed" (as in the live event).
+        status = "parsed" if stage == "extract" and row["status"] == "parsed" else "queued"
+    else:
+        # A stage's successor is queued in the transaction that finishes it, so a finished latest job is the last.
+        status = "done"
+    return progress_event(row["id"], row["company_id"], status, stage,
+                          row["job_error"] if status in ("error", "retrying") else None)
+
+
+class ProgressHub:
+    """Fans progress events out to subscriber queues. Lives on the event loop; not thread-safe."""
+
+    def __init__(self, queue_size: int) -> None:
+        self._queue_size = queue_size
+        self._by_document: dict[str, set[asyncio.Queue]] = {}
+        self._by_company: dict[str, set[asyncio.Queue]] = {}
+        self._stats = {"events": 0, "delivered": 0, "dropped": 0, "resyncs": 0}
+
+    @contextmanager
+    def subscribe(self, *, document_id: str | None = None,
+                  company_id: str | None = None) -> Iterator[asyncio.Queue]:
+        """A queue of events for one document, or for every document of a company, while the block runs."""
+        subscribers, key = (self._by_document, document_id) if document_id else (self._by_company, company_id)
+        if key is None:
+            raise ValueError("subscribe() needs a document_id or a company_id")
+        queue: asyncio.Queue = asyncio.Queue(self._queue_size)
+        subscribers.setdefault(str(key), set()).add(queue)
+        try:
+            yield queue
+        finally:
+            queues = subscribers.get(str(key))
+            if queues is not None:
+                queues.discard(queue)
+                if not queues:
+                    del subscribers[str(key)]
+
+    def on_notify(self, payload: str | None) -> None:
+        if payload is None:
+            self._stats["resyncs"] += 1
+            for queues in (*self._by_document.values(), *self._by_company.values()):
+                for queue in queues:
+                    self._put(queue, RESYNC)
+            return
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            logger.warning("ignoring malformed progress event %r", payload[:200])
+            return
+        self._stats["events"] += 1
+        for queue in (*self._by_document.get(event.get("document_id"), ()),
+                      *self._by_company.get(event.get("company_id"), ())):
+            self._put(queue, event)
+
+    def _put(self, queue: asyncio.Queue, item: dict[str, Any] | None) -> None:
+        if queue.full():
+            # A client that can't keep up only needs the latest state; drop its oldest event.
+            queue.get_nowait()
+            self._stats["dropped"] += 1
+        queue.put_nowait(item)
+        self._stats["delivered"] += 1
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            **self._stats,
+            "document_streams": sum(len(queues) for queues in self._by_document.values()),
+            "company_streams": sum(len(queues) for queues in self._by_company.values()),
+        }
+
+
+hub = ProgressHub(queue_size=PROGRESS_QUEUE_SIZE)
@@ -0,0 +1,225 @@
+"""Concurrent job scheduler: keeps several pipeline_jobs in flight at once.
+
+The runner used to await one process_job before claiming the next, so a
+slow OCR parse or Groq extraction held up every other customer's document.
+Now each stage has its own concurrency cap — `parse` is CPU-bound and
+capped at the core count, `extract`/`diff`/`generate` mostly wait on the
+LLM and are capped by what the Groq quota tolerates — and the scheduler
+only claims jobs for stages that have a free slot, several per round-trip.
+
+Claims still go through `for update skip locked` (db.claim_jobs), so any
+number of schedulers (processes or VPS instances) can share the queue.
+Each claimed job carries a lease; the scheduler heartbeats the leases of
+everything it is running, and every scheduler also runs the reaper that
+re-queues jobs whose owner died mid-stage.
+
+With PIPELINE_FUSE_STAGES, a job that finishes its stage may carry straight
+on with the next one (continue_with) when that stage has a free slot here:
+no re-claim and no re-read of the document. The next stage still gets its
+own leased pipeline_jobs row, so per-stage jobs remain the fallback for
+retries, crashes and spreading work across instances.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable
+
+import db
+import progress
+from config import (
+    JOB_CLAIM_BATCH_SIZE,
+    JOB_HEARTBEAT_SECONDS,
+    JOB_MAX_IN_FLIGHT,
+    JOB_REAPER_INTERVAL_SECONDS,
+    PIPELINE_FUSE_STAGES,
+    POLL_INTERVAL_SECONDS,
+    STAGE_CONCURRENCY,
+    WORKER_ID,
+)
+from job_notify import JobNotifier
+
+logger = logging.getLogger("kostencheck.scheduler")
+
+# Backoff after a failed claim (database down, pooler restart), doubling up to POLL_INTERVAL_SECONDS.
+_CLAIM_RETRY_MIN_SECONDS = 1.0
+# Shortest idle wait: a due job another scheduler holds locked mustn't make this one spin.
+_MIN_WAIT_SECONDS = 0.5
+
+
+def _reap_expired_jobs() -> list[dict[str, Any]]:
+    # One transaction, so progress events go out only if the reaping commits.
+    with db.session():
+        reaped = db.reap_expired_jobs()
+        for job in reaped:
+            if job["document_id"] is not None:
+                document = {"id": job["document_id"], "company_id": job["company_id"]}
+                status = "error" if job["status"] == "dead" else "retrying"
+                progress.publish(document, status, job["stage"], job["error_message"])
+    return reaped
+
+
+class JobScheduler:
+    def __init__(self, notifier: JobNotifier, handler: Callable[..., None],
+                 stage_limits: dict[str, int] = STAGE_CONCURRENCY,
+                 max_in_flight: int = JOB_MAX_IN_FLIGHT,
+                 worker_id: str = WORKER_ID,
+                 fuse_stages: bool = PIPELINE_FUSE_STAGES) -> None:
+        """`handler(job, continue_with)` runs one claimed job; continue_with is None unless fusing."""
+        self._notifier = notifier
+        self._handler = handler
+        self._limits = dict(stage_limits)
+        self._max_in_flight = max_in_flight
+        self._worker_id = worker_id
+        self._fuse_stages = fuse_stages
+        # _in_flight/_running are also updated from job threads (continue_with).
+        self._lock = threading.Lock()
+        self._in_flight = {stage: 0 for stage in self._limits}
+        self._running: dict[str, dict[str, Any]] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="job")
+        self._stats = {"claimed": 0, "claim_round_trips": 0, "claim_errors": 0, "leases_lost": 0, "reaped": 0, "fused": 0}
+
+    def _free_slots(self) -> tuple[dict[str, int], int]:
+        with self._lock:
+            total = self._max_in_flight - sum(self._in_flight.values())
+            if total <= 0:
+                return {}, 0
+            slots = {stage: min(limit - self._in_flight[stage], total) for stage, limit in self._limits.items()}
+        return {stage: n for stage, n in slots.items() if n > 0}, min(total, JOB_CLAIM_BATCH_SIZE)
+
+    async def run(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        background = [asyncio.create_task(self._heartbeat_loop()), asyncio.create_task(self._reaper_loop())]
+        try:
+            await self._dispatch_loop()
+        finally:
+            for task in background:
+                task.cancel()
+
+    async def _dispatch_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        backoff = _CLAIM_RETRY_MIN_SECONDS
+        while True:
+            slots, limit = self._free_slots()
+            jobs = []
+            timeout = POLL_INTERVAL_SECONDS
+            if slots:
+                try:
+                    jobs = await loop.run_in_executor(None, db.claim_jobs, slots, limit, self._worker_id)
+                    if not jobs:
+                        due = await loop.run_in_executor(None, db.seconds_until_next_job, list(slots))
+                        if due is not None:
+                            timeout = min(timeout, max(due, _MIN_WAIT_SECONDS))
+                except Exception:  # noqa: BLE001 — a dead dispatcher would stop this worker for good
+                    self._stats["claim_errors"] += 1
+                    logger.warning("claiming jobs failed; retrying in %.0fs", backoff, exc_info=True)
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, max(POLL_INTERVAL_SECONDS, _CLAIM_RETRY_MIN_SECONDS))
+                    continue
+                backoff = _CLAIM_RETRY_MIN_SECONDS
+                self._stats["claim_round_trips"] += 1
+            if not jobs:
+                # Woken by NOTIFY for new work, by _run_job when a slot frees up, or
+                # when the earliest delayed job (retry backoff, backfill continuation) comes due.
+                await self._notifier.wait(timeout)
+                continue
+            for job in jobs:
+                self._start(job)
+
+    def _start(self, job: dict[str, Any]) -> None:
+        self._stats["claimed"] += 1
+        with self._lock:
+            self._in_flight[job["stage"]] += 1
+            self._running[str(job["id"])] = job
+        task = asyncio.create_task(self._run_job(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_job(self, job: dict[str, Any]) -> None:
+        chain = [job]  # the claimed job, then any stages fused onto it; the last one holds the slot
+        continue_with = partial(self._continue_with, chain) if self._fuse_stages else None
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._handler, job, continue_with)
+        except Exception:  # noqa: BLE001 — process_job records its own failures; this is a last resort
+            logger.exception("job %s crashed outside process_job", chain[-1]["id"])
+        finally:
+            with self._lock:
+                self._running.pop(str(chain[-1]["id"]), None)
+                self._in_flight[chain[-1]["stage"]] -= 1
+            self._notifier.wake()
+
+    def _continue_with(self, chain: list[dict[str, Any]], current: dict[str, Any], stage: str) -> dict[str, Any] | None:
+        """Called from the job thread: claim `stage` for this worker if it has a free slot, else None."""
+        with self._lock:
+            if stage not in self._limits or self._in_flight[stage] >= self._limits[stage]:
+                return None
+            self._in_flight[stage] += 1
+        try:
+            next_job = db.start_job(current["document_id"], stage, self._worker_id,
+                                    current.get("priority", db.JOB_PRIORITY_INTERACTIVE))
+        except Exception:
+            with self._lock:
+                self._in_flight[stage] -= 1
+            raise
+        with self._lock:
+            self._running.pop(str(current["id"]), None)
+            self._in_flight[current["stage"]] -= 1
+            self._running[str(next_job["id"])] = next_job
+            self._stats["fused"] += 1
+        chain.append(next_job)
+        # The finished stage's slot is free for a queued job now. We're on a
+        # job thread, and the notifier's asyncio.Event belongs to the loop.
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._notifier.wake)
+        return next_job
+
+    async def _heartbeat_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            with self._lock:
+                job_ids = list(self._running)
+            if not job_ids:
+                continue
+            try:
+                owned = await loop.run_in_executor(None, db.extend_leases, job_ids, self._worker_id)
+            except Exception:  # noqa: BLE001 — a missed heartbeat is retried next tick
+                logger.warning("lease heartbeat failed", exc_info=True)
+                continue
+            for job_id in set(job_ids) - owned:
+                if job_id in self._running:
+                    self._stats["leases_lost"] += 1
+                    logger.warning("lost lease on job %s; it may be re-run elsewhere", job_id)
+
+    async def _reaper_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                reaped = await loop.run_in_executor(None, _reap_expired_jobs)
+            except Exception:  # noqa: BLE001 — try again next interval
+                logger.warning("reaping expired jobs failed", exc_info=True)
+                reaped = []
+            for job in reaped:
+                self._stats["reaped"] += 1
+                logger.warning("reaped job %s (%s, attempt %s) -> %s",
+                               job["id"], job["stage"], job["attempts"], job["status"])
+            if any(job["status"] == "queued" for job in reaped):
+                self._notifier.wake()
+            await asyncio.sleep(JOB_REAPER_INTERVAL_SECONDS)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            in_flight = dict(self._in_flight)
+        return {"worker_id": self._worker_id, "in_flight": in_flight, "fuse_stages": self._fuse_stages,
+                "limits": dict(self._limits), "max_in_flight": self._max_in_flight, **self._stats}
+
+    def shutdown(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,106 @@
+"""A size-capped, least-recently-used SQLite table: the storage under llm_cache and embedding_cache.
+
+Each thread gets its own connection (sqlite3 connections can't be shared
+across threads) in WAL mode, so the job threads read concurrently with
+one writer. Rows are keyed by `key` and carry `last_used_at`; callers
+touch() the keys they read and report what they write, and every
+`evict_check_every` written rows the table is shrunk to EVICT_TARGET of
+its byte cap, least-recently-used rows first (after expired ones, when
+there is a TTL).
+
+Error handling stays with the caller: a cache must never take the
+pipeline down with it, so sqlite3.Error is logged and counted there.
+"""
+
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+EVICT_TARGET = 0.9  # shrink to this fraction of the cap once it's exceeded
+SQLITE_MAX_PARAMS = 500
+
+
+class SqliteLruTable:
+    def __init__(self, path: str, table: str, columns: str, size_sql: str, max_bytes: int,
+                 evict_check_every: int, ttl_seconds: float | None = None) -> None:
+        """`columns` is the DDL of the value columns; `size_sql` an expression for a row's size in bytes.
+
+        With `ttl_seconds`, `columns` must include `created_at real`, and rows
+        older than that are dropped before anything is evicted by size.
+        """
+        self._path = path
+        self._table = table
+        self._columns = columns
+        self._size_sql = size_sql
+        self._max_bytes = max_bytes
+        self._evict_check_every = evict_check_every
+        self._ttl = ttl_seconds
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._written_since_check = 0
+
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            Path(self._path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            conn.execute("pragma journal_mode=wal")
+            conn.execute("pragma synchronous=normal")
+            conn.execute(
+                f"""
+                create table if not exists {self._table} (
+                    key text primary key,
+                    {self._columns},
+                    last_used_at real not null
+                )
+                """
+            )
+            conn.execute(f"create index if not exists {self._table}_last_used on {self._table} (last_used_at)")
+            self._local.conn = conn
+        return conn
+
+    def touch(self, keys: list[str]) -> None:
+        """Mark `keys` as just used."""
+        conn = self.conn()
+        now = time.time()
+        for start in range(0, len(keys), SQLITE_MAX_PARAMS):
+            chunk = keys[start:start + SQLITE_MAX_PARAMS]
+            conn.execute(
+                f"update {self._table} set last_used_at = ? where key in ({', '.join('?' * len(chunk))})",
+                [now, *chunk],
+            )
+
+    def wrote(self, rows: int) -> bool:
+        """Count `rows` written; True when it's time for the caller to evict()."""
+        with self._lock:
+            self._written_since_check += rows
+            if self._written_since_check < self._evict_check_every:
+                return False
+            self._written_since_check = 0
+            return True
+
+    def evict(self) -> int:
+        """Drop expired rows, then least-recently-used ones until under the size cap. Returns rows dropped."""
+        conn = self.conn()
+        dropped = 0
+        if self._ttl is not None:
+            dropped += conn.execute(f"delete from {self._table} where created_at < ?",
+                                    (time.time() - self._ttl,)).rowcount
+        total = conn.execute(f"select coalesce(sum({self._size_sql}), 0) from {self._table}").fetchone()[0]
+        if total <= self._max_bytes:
+            return dropped
+        to_free = total - int(self._max_bytes * EVICT_TARGET)
+        freed = 0
+        doomed: list[str] = []
+        for key, size in conn.execute(
+            f"select key, {self._size_sql} from {self._table} order by last_used_at"
+        ).fetchall():
+            doomed.append(key)
+            freed += size
+            if freed >= to_free:
+                break
+        conn.executemany(f"delete from {self._table} where key = ?", [(key,) for key in doomed])
+        return dropped + len(doomed)
@@ -0,0 +1,177 @@
+"""Deterministic line-item extraction from position tables — no LLM.
+
+Most Angebote/Bestellungen come out of a handful of ERP templates with a
+clean position table, which parsing.py already writes into raw_text as
+pipe-separated rows. Re-reading those rows here is exact, instant and
+free, so extraction.extract_document only asks the LLM for line items
+that can't come from a table with a recognisable header (Pos, Artikel-Nr,
+Bezeichnung, Menge, Einzelpreis, Liefertermin): pipe tables left
+unmapped and OCR'd pages.
+
+A table continued on the next page without repeating its header shows up
+as a separate header-less block; it inherits the previous block's columns
+when it has the same number of them.
+"""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Any
+
+# Normalised header cell -> line-item field. Matched on the cell with
+# spaces, dots, dashes and slashes removed, lower-cased.
+HEADER_ALIASES: dict[str, tuple[str, ...]] = {
+    "position_no": ("pos", "position", "posnr", "lfdnr", "nr"),
+    "article_no": ("artikelnr", "artnr", "artikelnummer", "artikel", "materialnr", "material",
+                   "teilenr", "sachnr", "sachnummer", "identnr"),
+    "description": ("bezeichnung", "beschreibung", "artikelbezeichnung", "benennung", "text",
+                    "leistung", "kurztext"),
+    "qty": ("menge", "anzahl", "stk", "stück", "stueck", "qty"),
+    "unit_price": ("einzelpreis", "ep", "epreis", "preiseinheit", "stückpreis", "stueckpreis",
+                   "preisje", "einzelpreiseur", "epeur", "preis"),
+    "delivery_date": ("liefertermin", "lieferdatum", "termin", "lieferkw", "lieferwoche", "liefertermine"),
+}
+REQUIRED_FIELDS = ("description", "qty", "unit_price")
+SUMMARY_ROW = re.compile(r"^(zwischen)?summe|^gesamt|^netto|^brutto|^mwst|^übertrag|^uebertrag", re.IGNORECASE)
+_NUMBER = re.compile(r"-?\d[\d.,' ]*")
+_GERMAN_DATE = re.compile(r"^(\d{1,2})\.(\d{1,2})\.(\d{2,4})$")
+
+
+def _normalise_header(cell: str) -> str:
+    return re.sub(r"[\s.\-/:()€]", "", cell.lower())
+
+
+def _map_header(cells: list[str]) -> dict[str, int] | None:
+    columns: dict[str, int] = {}
+    for index, cell in enumerate(cells):
+        key = _normalise_header(cell)
+        if not key:
+            continue
+        for name, aliases in HEADER_ALIASES.items():
+            if name not in columns and key in aliases:
+                columns[name] = index
+                break
+    if all(name in columns for name in REQUIRED_FIELDS) and (
+        "position_no" in columns or "article_no" in columns
+    ):
+        return columns
+    return None
+
+
+def parse_german_number(value: str | None) -> float | None:
+    """'1.234,50 €' -> 1234.5, '3 Stk' -> 3.0, '12,5' -> 12.5. None if there's no number."""
+    if not value:
+        return None
+    match = _NUMBER.search(value)
+    if not match:
+        return None
+    text = match.group(0).strip().replace(" ", "").replace("'", "")
+    if "," in text:
+        text = text.replace(".", "").replace(",", ".")
+    elif text.count(".") > 1 or re.fullmatch(r"-?\d{1,3}\.\d{3}", text):
+        # "1.234" / "1.234.567" are thousands separators in German documents.
+        text = text.replace(".", "")
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def _position(value: str | None) -> int | float | None:
+    number = parse_german_number(value)
+    if number is None:
+        return None
+    return int(number) if number.is_integer() else number
+
+
+def _delivery_date(value: str | None) -> str | None:
+    value = (value or "").strip()
+    match = _GERMAN_DATE.match(value)
+    if match:
+        day, month, year = (int(part) for part in match.groups())
+        year += 2000 if year < 100 else 0
+        try:
+            return date(year, month, day).isoformat()
+        except ValueError:
+            return value
+    return value or None
+
+
+def _table_blocks(raw_text: str) -> list[list[list[str]]]:
+    """Runs of consecutive pipe-separated lines with a consistent column count."""
+    tables: list[list[list[str]]] = []
+    current: list[list[str]] = []
+    for line in raw_text.splitlines():
+        cells = [cell.strip() for cell in line.split(" | ")] if " | " in line else None
+        if cells and (not current or len(cells) == len(current[0])):
+            current.append(cells)
+            continue
+        if len(current) > 1:
+            tables.append(current)
+        current = [cells] if cells else []
+    if len(current) > 1:
+        tables.append(current)
+    return tables
+
+
+def _cell(row: list[str], columns: dict[str, int], name: str) -> str | None:
+    index = columns.get(name)
+    if index is None or index >= len(row):
+        return None
+    return row[index] or None
+
+
+@dataclass
+class TableLineItems:
+    items: list[dict[str, Any]] = field(default_factory=list)
+    unmapped: list[str] = field(default_factory=list)  # pipe tables without a usable header, as text
+
+
+def extract_line_items_from_tables(raw_text: str) -> TableLineItems:
+    """Line items from every recognisable position table, in document order, plus the tables left over."""
+    result = TableLineItems()
+    previous: tuple[list[str], dict[str, int]] | None = None  # header and columns of the block just read
+    for table in _table_blocks(raw_text):
+        columns = _map_header(table[0])
+        if columns is not None:
+            header, rows = table[0], table[1:]
+        elif previous is not None and len(table[0]) == len(previous[0]):
+            (header, columns), rows = previous, table  # continuation page without a header row
+        else:
+            result.unmapped.append("\n".join(" | ".join(row) for row in table))
+            previous = None
+            continue
+        previous = (header, columns)
+        _read_rows(rows, header, columns, result.items)
+    return result
+
+
+def _read_rows(rows: list[list[str]], header: list[str], columns: dict[str, int],
+               items: list[dict[str, Any]]) -> None:
+    for row in rows:
+        if row == header or not any(row):
+            continue  # header repeated on a continuation page, or spacer row
+        description = _cell(row, columns, "description")
+        qty = parse_german_number(_cell(row, columns, "qty"))
+        unit_price = parse_german_number(_cell(row, columns, "unit_price"))
+        position_no = _position(_cell(row, columns, "position_no"))
+        article_no = _cell(row, columns, "article_no")
+        first_cell = next((cell for cell in row if cell), "")
+        if SUMMARY_ROW.match(first_cell) or (description and SUMMARY_ROW.match(description)):
+            continue
+        if qty is None and unit_price is None and position_no is None and not article_no:
+            # Wrapped description text continuing the previous position.
+            if items and description:
+                items[-1]["description"] = f'{items[-1]["description"]} {description}'.strip()
+            continue
+        items.append({
+            "position_no": position_no,
+            "article_no": article_no,
+            "description": description or "",
+            "qty": qty,
+            "unit_price": unit_price,
+            "delivery_date": _delivery_date(_cell(row, columns, "delivery_date")),
+            "source": "table",
+        })
@@ -0,0 +1,118 @@
+"""In-process cache of API key -> company for request authentication.
+
+ERP clients poll document status several times a second, and every
+request used to look its key up in pipeline_companies first. Known keys
+are now cached for TENANT_CACHE_TTL_SECONDS; unknown keys are remembered
+for TENANT_NEGATIVE_TTL_SECONDS in a separate LRU capped at
+TENANT_NEGATIVE_CACHE_SIZE entries, so someone trying random keys can
+neither hammer the database with repeats nor grow the cache without bound.
+
+Keys are held as SHA-256 digests, not in plaintext. When a company's key
+changes or the company is deleted, a trigger NOTIFYs TENANT_NOTIFY_CHANNEL
+(fixed in the migration) with its id and the entry is dropped at once (see
+job_notify.subscribe); the TTL only bounds staleness while the listener is
+disconnected.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+
+import db
+from config import (
+    TENANT_CACHE_TTL_SECONDS,
+    TENANT_NEGATIVE_CACHE_SIZE,
+    TENANT_NEGATIVE_TTL_SECONDS,
+)
+
+logger = logging.getLogger("kostencheck.tenant_cache")
+
+TENANT_NOTIFY_CHANNEL = "pipeline_companies_changed"
+
+
+def _digest(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+class TenantCache:
+    def __init__(self, lookup: Callable[[str], dict[str, Any] | None], ttl_seconds: float,
+                 negative_ttl_seconds: float, negative_max_entries: int) -> None:
+        self._lookup = lookup
+        self._ttl = ttl_seconds
+        self._negative_ttl = negative_ttl_seconds
+        self._negative_max = negative_max_entries
+        self._known: dict[str, tuple[dict[str, Any], float]] = {}
+        self._unknown: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0  # bumped by invalidate(), so a lookup racing it isn't cached
+        self._stats = {"hits": 0, "negative_hits": 0, "misses": 0, "invalidations": 0}
+
+    def get_company(self, api_key: str) -> dict[str, Any] | None:
+        """The company owning `api_key`, or None if there is none. Hits the database only on a miss."""
+        key = _digest(api_key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._known.get(key)
+            if entry is not None and entry[1] > now:
+                self._stats["hits"] += 1
+                return entry[0]
+            expires = self._unknown.get(key)
+            if expires is not None and expires > now:
+                self._unknown.move_to_end(key)
+                self._stats["negative_hits"] += 1
+                return None
+            self._stats["misses"] += 1
+            generation = self._generation
+
+        company = self._lookup(api_key)
+        with self._lock:
+            if generation == self._generation:
+                self._store(key, company, now)
+        return company
+
+    def _store(self, key: str, company: dict[str, Any] | None, now: float) -> None:
+        # Caller holds self._lock.
+        if company is None:
+            self._known.pop(key, None)
+            self._unknown[key] = now + self._negative_ttl
+            self._unknown.move_to_end(key)
+            while len(self._unknown) > self._negative_max:
+                self._unknown.popitem(last=False)
+        else:
+            self._unknown.pop(key, None)
+            self._known[key] = (company, now + self._ttl)
+
+    def invalidate(self, company_id: str | None = None) -> None:
+        """Forget one company's cached key (after a rotation), or everything if `company_id` is None."""
+        with self._lock:
+            self._stats["invalidations"] += 1
+            self._generation += 1
+            if company_id is None:
+                self._known.clear()
+                self._unknown.clear()
+                return
+            for key, (company, _) in list(self._known.items()):
+                if str(company["id"]) == company_id:
+                    del self._known[key]
+            # The new key may have been probed (and cached as unknown) just before the rotation landed.
+            self._unknown.clear()
+
+    def on_notify(self, payload: str | None) -> None:
+        self.invalidate(payload or None)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "known": len(self._known), "unknown": len(self._unknown)}
+
+
+tenant_cache = TenantCache(
+    db.get_company_by_api_key,
+    ttl_seconds=TENANT_CACHE_TTL_SECONDS,
+    negative_ttl_seconds=TENANT_NEGATIVE_TTL_SECONDS,
+    negative_max_entries=TENANT_NEGATIVE_CACHE_SIZE,
+)
@@ -0,0 +1,10 @@
+"""Shared test setup: the worker's modules import flat (see main.py), and config requires these two."""
+
+import os
+import sys
+from pathlib import Path
+
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/kostencheck_test")
+os.environ.setdefault("GROQ_API_KEY", "test")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,31 @@
+import pytest
+
+import batch_upload
+from batch_upload import BatchBudget
+from upload_store import StoredUpload
+
+
+@pytest.fixture
+def budget(tmp_path):
+    budget = BatchBudget(max_bytes=1_000)
+    for name, created in (("new.pdf", True), ("shared.pdf", True), ("existing.pdf", False)):
+        path = tmp_path / name
+        path.write_bytes(b"%PDF")
+        budget.add(StoredUpload(path=path, sha256=name, size=4, created=created))
+    return budget
+
+
+def test_discard_keeps_files_a_document_points_at(budget, tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_upload.db, "referenced_files", lambda paths: {str(tmp_path / "shared.pdf")})
+    budget.discard()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["existing.pdf", "shared.pdf"]
+    assert budget.stored == []
+
+
+def test_discard_keeps_everything_when_the_check_fails(budget, tmp_path, monkeypatch):
+    def unavailable(paths):
+        raise OSError("database unavailable")
+
+    monkeypatch.setattr(batch_upload.db, "referenced_files", unavailable)
+    budget.discard()
+    assert len(list(tmp_path.iterdir())) == 3
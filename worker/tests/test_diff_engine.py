@@ -0,0 +1,94 @@
+import numpy as np
+
+import diff_engine
+from diff_engine import (
+    FUZZY_MATCH_THRESHOLD,
+    _assign,
+    _best_fuzzy_matches,
+    _blocked_fuzzy_matches,
+    _match_by_article,
+    match_line_items,
+)
+
+
+def test_assign_maximises_total_score_over_greedy():
+    # Greedy row-by-row would give quote 0 its best partner (order 0) and leave quote 1 unmatched.
+    scores = np.array([[95, 90], [92, 0]], dtype=np.float32)
+    assert _assign([10, 11], [20, 21], scores) == {10: 21, 11: 20}
+
+
+def test_assign_drops_pairs_below_threshold():
+    below = FUZZY_MATCH_THRESHOLD - 1
+    scores = np.array([[below, 0], [0, 80]], dtype=np.float32)
+    assert _assign([0, 1], [0, 1], scores) == {1: 1}
+
+
+def test_assign_without_viable_pairs():
+    assert _assign([0], [0, 1], np.zeros((1, 2), dtype=np.float32)) == {}
+
+
+def test_match_by_article_prefers_exact_then_normalised():
+    quote = [{"article_no": "TM-75 001"}, {"article_no": "tm75-001"}]
+    order = [{"article_no": "TM75001"}, {"article_no": "tm75-001"}]
+    # Quote 1 takes its exact twin first, so quote 0 gets the remaining normalised match.
+    assert _match_by_article(quote, order) == {1: 1, 0: 0}
+
+
+def test_match_by_article_uses_each_order_item_once():
+    quote = [{"article_no": "A-1"}, {"article_no": "A-1"}]
+    order = [{"article_no": "A-1"}]
+    used: set[int] = set()
+    assert _match_by_article(quote, order, used) == {0: 0}
+    assert used == {0}
+
+
+def test_match_by_article_skips_used_and_missing_numbers():
+    quote = [{"article_no": "B2"}, {"article_no": None}]
+    order = [{"article_no": "B2"}, {"article_no": "B2"}]
+    assert _match_by_article(quote, order, {0}) == {0: 1}
+
+
+def test_match_line_items_falls_back_to_descriptions():
+    quote = [{"article_no": "X1", "description": "Welle"}, {"description": "Antriebsmotor 5,5 kW"}]
+    order = [{"description": "Antriebsmotor 5.5 kW"}, {"article_no": "x-1", "description": "Welle gehärtet"}]
+    assert match_line_items(quote, order) == {0: 1, 1: 0}
+
+
+def _items(descriptions):
+    return [{"description": d} for d in descriptions]
+
+
+def test_blocked_matches_agree_with_dense_on_small_input():
+    quote = _items(["Antriebsmotor 5,5 kW", "Zahnriemen HTD 8M", "Lagerbock Guss", "Schutzhaube"])
+    order = _items(["Zahnriemen HTD-8M", "Antriebsmotoren 5,5 kW", "Lagerbock GG25", "Steuerung SPS"])
+    idx_q, idx_o = list(range(len(quote))), list(range(len(order)))
+    blocked = _blocked_fuzzy_matches(quote, order, idx_q, idx_o)
+    assert blocked == _best_fuzzy_matches(quote, order, idx_q, idx_o)
+    assert blocked[0] == 1 and blocked[1] == 0
+    assert 3 not in blocked
+
+
+def test_blocked_matches_leave_items_without_shared_tokens_unmatched():
+    assert _blocked_fuzzy_matches(_items(["Hydraulikaggregat"]), _items(["Schaltschrank"]), [0], [0]) == {}
+
+
+def test_blocked_matches_keep_original_indices():
+    quote = _items(["", "Welle 40x300", "", "Passfeder DIN 6885"])
+    order = _items(["Passfeder DIN 6885 A", "", "Welle 40x300 mm"])
+    assert _blocked_fuzzy_matches(quote, order, [1, 3], [0, 2]) == {1: 2, 3: 0}
+
+
+def test_best_fuzzy_matches_switches_to_blocking_past_the_pair_limit(monkeypatch):
+    calls = []
+    monkeypatch.setattr(diff_engine, "DENSE_MATCH_MAX_PAIRS", 1)
+    monkeypatch.setattr(diff_engine, "_blocked_fuzzy_matches", lambda *args: calls.append(args) or {})
+    _best_fuzzy_matches(_items(["a", "b"]), _items(["a"]), [0, 1], [0])
+    assert len(calls) == 1
+
+
+def test_blocked_matches_fall_back_to_rarest_common_key(monkeypatch):
+    monkeypatch.setattr(diff_engine, "BLOCKING_MAX_POSTINGS", 1)
+    # "schraube" is in every order item, so only the fallback can find the pair.
+    quote = _items(["Schraube M8"])
+    order = _items(["Schraube M8", "Schraube M10", "Schraube M12"])
+    assert _blocked_fuzzy_matches(quote, order, [0], [0, 1, 2]) == {0: 0}
@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+import pytest
+
+import llm_scheduler
+from llm_scheduler import LlmScheduler, TokenBucket, estimate_tokens
+
+START = 1000.0
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    monkeypatch.setattr(llm_scheduler.time, "monotonic", lambda: START)
+    return TokenBucket(per_minute=60)  # one unit per second
+
+
+def test_bucket_starts_full_and_waits_for_the_shortfall(bucket):
+    assert bucket.wait_time(60) == 0.0
+    bucket.level -= 50
+    assert bucket.wait_time(10) == 0.0
+    assert bucket.wait_time(15) == pytest.approx(5.0)
+
+
+def test_bucket_refills_at_its_rate_up_to_capacity(bucket):
+    bucket.level = 0.0
+    bucket.refill(START + 30)
+    assert bucket.level == pytest.approx(30.0)
+    bucket.refill(START + 600)
+    assert bucket.level == 60.0
+
+
+def test_oversized_request_waits_only_for_a_full_bucket(bucket):
+    bucket.level = 30.0
+    assert bucket.wait_time(1000) == pytest.approx(30.0)
+
+
+def test_estimate_tokens_adds_the_completion_budget():
+    messages = [{"role": "system", "content": "x" * 35}, {"role": "user", "content": "y" * 70}]
+    assert estimate_tokens(messages) == 30 + llm_scheduler.DEFAULT_COMPLETION_TOKENS
+    assert estimate_tokens(messages, max_tokens=10) == 40
+
+
+def test_call_settles_the_bucket_with_reported_usage(monkeypatch):
+    monkeypatch.setattr(llm_scheduler.time, "monotonic", lambda: START)
+    scheduler = LlmScheduler(rpm=10, tpm=10_000, max_retries=0)
+    usage = SimpleNamespace(prompt_tokens=300, completion_tokens=200, total_tokens=500)
+    scheduler.call(lambda: SimpleNamespace(usage=usage), estimated_tokens=2_000)
+    stats = scheduler.stats()
+    assert stats["tpm_available"] == 9_500  # the 2,000 reserved, 1,500 refunded
+    assert (stats["prompt_tokens"], stats["completion_tokens"], stats["requests"]) == (300, 200, 1)
+
+
+def test_call_retries_rate_limits_then_gives_up(monkeypatch):
+    monkeypatch.setattr(llm_scheduler.time, "sleep", lambda seconds: None)
+    monkeypatch.setattr(llm_scheduler, "BACKOFF_MAX_SECONDS", 0.0)
+    scheduler = LlmScheduler(rpm=100, tpm=100_000, max_retries=2)
+    error = llm_scheduler.groq.APIConnectionError(request=SimpleNamespace())
+    attempts = []
+
+    def request():
+        attempts.append(1)
+        raise error
+
+    with pytest.raises(llm_scheduler.groq.APIConnectionError):
+        scheduler.call(request, estimated_tokens=10)
+    assert len(attempts) == 3
+    assert scheduler.stats()["retries"] == 2 and scheduler.stats()["failures"] == 1
@@ -0,0 +1,59 @@
+import pytest
+
+import progress
+
+
+def _row(status="parsing", job_stage=None, job_status=None, job_error=None):
+    return {"id": "doc-1", "company_id": "co-1", "status": status,
+            "job_stage": job_stage, "job_status": job_status, "job_error": job_error}
+
+
+@pytest.fixture
+def document(monkeypatch):
+    rows = {}
+    monkeypatch.setattr(progress.db, "get_document_progress", rows.get)
+
+    def set_row(**fields):
+        rows["doc-1"] = _row(**fields)
+        return progress.current_progress("doc-1")
+
+    return set_row
+
+
+def test_unknown_document(monkeypatch):
+    monkeypatch.setattr(progress.db, "get_document_progress", lambda document_id: None)
+    assert progress.current_progress("missing") is None
+
+
+@pytest.mark.parametrize("fields, status, stage", [
+    (dict(status="uploaded"), "queued", "parse"),
+    (dict(job_stage="parse", job_status="queued"), "queued", "parse"),
+    (dict(job_stage="parse", job_status="processing"), "parsing", "parse"),
+    (dict(status="parsed", job_stage="extract", job_status="queued"), "parsed", "extract"),
+    (dict(status="parsed", job_stage="diff", job_status="queued"), "queued", "diff"),
+    (dict(status="parsed", job_stage="extract", job_status="processing"), "extract", "extract"),
+    (dict(status="parsed", job_stage="generate", job_status="done"), "done", "generate"),
+])
+def test_status_follows_the_latest_job(document, fields, status, stage):
+    event = document(**fields)
+    assert (event["status"], event["stage"], event["error"]) == (status, stage, None)
+    assert (event["document_id"], event["company_id"]) == ("doc-1", "co-1")
+
+
+def test_queued_job_with_an_error_is_retrying(document):
+    event = document(status="parsed", job_stage="extract", job_status="queued", job_error="groq timeout")
+    assert (event["status"], event["error"]) == ("retrying", "groq timeout")
+
+
+@pytest.mark.parametrize("fields", [
+    dict(status="parsed", job_stage="diff", job_status="dead", job_error="boom"),
+    dict(status="error", job_stage="parse", job_status="processing", job_error="boom"),
+])
+def test_dead_job_or_errored_document_is_error(document, fields):
+    event = document(**fields)
+    assert (event["status"], event["error"]) == ("error", "boom")
+
+
+def test_long_errors_are_truncated_for_notify(document):
+    event = document(job_stage="parse", job_status="dead", job_error="x" * 1000)
+    assert len(event["error"]) == progress._MAX_ERROR_CHARS
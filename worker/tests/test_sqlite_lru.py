@@ -0,0 +1,63 @@
+import time
+
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+from llm_cache import LlmCache
+from sqlite_lru import SqliteLruTable
+
+
+def _table(tmp_path, **kwargs):
+    return SqliteLruTable(str(tmp_path / "cache.sqlite"), "t", "value text not null, created_at real not null",
+                          size_sql="length(value)", evict_check_every=2, **kwargs)
+
+
+def _put(table, key, value, used_at, created_at=None):
+    table.conn().execute("insert into t (key, value, created_at, last_used_at) values (?, ?, ?, ?)",
+                         (key, value, created_at or time.time(), used_at))
+
+
+def _keys(table):
+    return {row[0] for row in table.conn().execute("select key from t")}
+
+
+def test_evicts_least_recently_used_rows_down_to_the_target(tmp_path):
+    table = _table(tmp_path, max_bytes=150)
+    for i, key in enumerate("abc"):
+        _put(table, key, "x" * 100, used_at=i)
+    table.touch(["a"])
+    assert table.evict() == 2  # 300 bytes -> at most 135: b and c go, a was just used
+    assert _keys(table) == {"a"}
+
+
+def test_evicts_expired_rows_first(tmp_path):
+    table = _table(tmp_path, max_bytes=10_000, ttl_seconds=60)
+    _put(table, "old", "x", used_at=time.time(), created_at=time.time() - 120)
+    _put(table, "new", "x", used_at=0)
+    assert table.evict() == 1
+    assert _keys(table) == {"new"}
+
+
+def test_wrote_signals_every_n_rows(tmp_path):
+    table = _table(tmp_path, max_bytes=1)
+    assert [table.wrote(1), table.wrote(1), table.wrote(1), table.wrote(5)] == [False, True, False, True]
+
+
+def test_llm_cache_round_trip_and_ttl(tmp_path):
+    cache = LlmCache(str(tmp_path / "llm.sqlite"), ttl_seconds=60, max_bytes=1_000_000)
+    key = cache.make_key("json", "model", "system", "user", 0.1)
+    assert cache.get(key) is None
+    cache.put(key, {"a": 1})
+    assert cache.get(key) == {"a": 1}
+    cache._ttl = -1
+    assert cache.get(key) is None
+    assert cache.stats()["expired"] == 1
+
+
+def test_embedding_cache_survives_a_restart(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    key = EmbeddingCache.make_key("e5", "query:", "Welle  gehärtet")
+    EmbeddingCache(path, memory_items=10, max_bytes=1_000_000).put_many({key: np.array([0.5, -1.0])})
+    fresh = EmbeddingCache(path, memory_items=10, max_bytes=1_000_000)
+    assert fresh.get_many([key])[key].tolist() == [0.5, -1.0]
+    assert fresh.stats()["disk_hits"] == 1
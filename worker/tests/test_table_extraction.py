@@ -0,0 +1,90 @@
+import pytest
+
+from table_extraction import _map_header, extract_line_items_from_tables, parse_german_number
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("1.234,50 €", 1234.5),
+    ("3 Stk", 3.0),
+    ("12,5", 12.5),
+    ("1.234", 1234.0),
+    ("1.234.567", 1234567.0),
+    ("12.5", 12.5),
+    ("1'250,00", 1250.0),
+    ("-4,20", -4.2),
+    ("", None),
+    (None, None),
+    ("n. a.", None),
+])
+def test_parse_german_number(value, expected):
+    assert parse_german_number(value) == expected
+
+
+def test_map_header_normalises_cells():
+    assert _map_header(["Pos.", "Art.-Nr.", "Bezeichnung", "Menge", "EP (€)", "Liefertermin"]) == {
+        "position_no": 0, "article_no": 1, "description": 2, "qty": 3, "unit_price": 4, "delivery_date": 5,
+    }
+
+
+def test_map_header_needs_the_required_columns_and_an_identifier():
+    assert _map_header(["Pos", "Bezeichnung", "Menge"]) is None  # no price
+    assert _map_header(["Bezeichnung", "Menge", "Einzelpreis"]) is None  # neither position nor article
+
+
+def test_map_header_keeps_the_first_matching_column():
+    columns = _map_header(["Pos", "Text", "Bezeichnung", "Menge", "Preis"])
+    assert columns is not None and columns["description"] == 1
+
+
+HEADER = "Pos | Artikel-Nr | Bezeichnung | Menge | Einzelpreis"
+
+
+def test_reads_rows_skipping_summaries_and_joining_wrapped_text():
+    raw = "\n".join([
+        "Angebot 4711",
+        "",
+        HEADER,
+        "1 | TM-75 | Antriebsmotor | 2 | 1.250,00",
+        " |  | 5,5 kW, IE3 |  | ",
+        "2 | ZR-8 | Zahnriemen | 4 Stk | 38,90",
+        "Summe |  |  |  | 2.655,60",
+    ])
+    result = extract_line_items_from_tables(raw)
+    assert [(i["position_no"], i["article_no"], i["description"], i["qty"], i["unit_price"]) for i in result.items] == [
+        (1, "TM-75", "Antriebsmotor 5,5 kW, IE3", 2.0, 1250.0),
+        (2, "ZR-8", "Zahnriemen", 4.0, 38.9),
+    ]
+    assert result.unmapped == []
+
+
+def test_continuation_table_without_header_inherits_columns():
+    raw = "\n\f\n".join([
+        f"{HEADER}\n1 | A1 | Welle | 1 | 10,00\n2 | A2 | Nabe | 1 | 20,00",
+        "3 | A3 | Passfeder | 2 | 1,50\n4 | A4 | Sicherungsring | 2 | 0,80",
+    ])
+    result = extract_line_items_from_tables(raw)
+    assert [item["position_no"] for item in result.items] == [1, 2, 3, 4]
+    assert result.unmapped == []
+
+
+def test_repeated_header_on_continuation_page_is_skipped():
+    raw = "\n\f\n".join([
+        f"{HEADER}\n1 | A1 | Welle | 1 | 10,00\n2 | A2 | Nabe | 1 | 20,00",
+        f"{HEADER}\n3 | A3 | Passfeder | 2 | 1,50",
+    ])
+    assert [item["position_no"] for item in extract_line_items_from_tables(raw).items] == [1, 2, 3]
+
+
+def test_headerless_table_with_other_shape_stays_unmapped():
+    raw = "\n\f\n".join([
+        f"{HEADER}\n1 | A1 | Welle | 1 | 10,00\n2 | A2 | Nabe | 1 | 20,00",
+        "Zahlungsziel | 30 Tage\nSkonto | 2 %",
+    ])
+    result = extract_line_items_from_tables(raw)
+    assert len(result.items) == 2
+    assert result.unmapped == ["Zahlungsziel | 30 Tage\nSkonto | 2 %"]
+
+
+def test_delivery_dates_become_iso():
+    raw = "Pos | Bezeichnung | Menge | Preis | Liefertermin\n1 | Welle | 1 | 10,00 | 3.2.26\n2 | Nabe | 1 | 5 | KW 12"
+    assert [item["delivery_date"] for item in extract_line_items_from_tables(raw).items] == ["2026-02-03", "KW 12"]
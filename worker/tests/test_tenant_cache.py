@@ -0,0 +1,96 @@
+import pytest
+
+import tenant_cache as tenant_cache_module
+from tenant_cache import TenantCache
+
+COMPANIES = {"key-a": {"id": "a", "name": "THD GmbH"}, "key-b": {"id": "b", "name": "MK Anlagenbau GmbH"}}
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(tenant_cache_module.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def lookups():
+    return []
+
+
+@pytest.fixture
+def cache(clock, lookups):
+    def lookup(api_key):
+        lookups.append(api_key)
+        return COMPANIES.get(api_key)
+
+    return TenantCache(lookup, ttl_seconds=60, negative_ttl_seconds=5, negative_max_entries=2)
+
+
+def test_known_key_is_looked_up_once_until_it_expires(cache, clock, lookups):
+    assert cache.get_company("key-a") == COMPANIES["key-a"]
+    assert cache.get_company("key-a") == COMPANIES["key-a"]
+    assert lookups == ["key-a"]
+    clock.now += 61
+    cache.get_company("key-a")
+    assert lookups == ["key-a", "key-a"]
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+
+
+def test_unknown_key_is_negatively_cached_for_its_own_ttl(cache, clock, lookups):
+    assert cache.get_company("nope") is None
+    assert cache.get_company("nope") is None
+    assert lookups == ["nope"]
+    clock.now += 6
+    cache.get_company("nope")
+    assert lookups == ["nope", "nope"]
+
+
+def test_negative_cache_is_bounded_lru(cache, lookups):
+    for key in ("x", "y", "x", "z"):  # "x" is used again, so "y" is the one evicted
+        cache.get_company(key)
+    assert cache.stats()["unknown"] == 2
+    lookups.clear()
+    cache.get_company("x")
+    cache.get_company("y")
+    assert lookups == ["y"]
+
+
+def test_keys_are_not_held_in_plaintext(cache):
+    cache.get_company("key-a")
+    assert "key-a" not in cache._known
+
+
+def test_invalidate_drops_one_company_and_all_unknown_keys(cache, lookups):
+    for key in ("key-a", "key-b", "nope"):
+        cache.get_company(key)
+    cache.on_notify("a")
+    lookups.clear()
+    for key in ("key-a", "key-b", "nope"):
+        cache.get_company(key)
+    assert lookups == ["key-a", "nope"]
+
+
+def test_notify_without_payload_clears_everything(cache, lookups):
+    cache.get_company("key-a")
+    cache.on_notify(None)
+    assert cache.stats()["known"] == 0
+
+
+def test_lookup_racing_an_invalidation_is_not_cached(clock, lookups):
+    def lookup(api_key):
+        lookups.append(api_key)
+        racing.invalidate("a")  # the key was rotated while this lookup was in flight
+        return COMPANIES.get(api_key)
+
+    racing = TenantCache(lookup, ttl_seconds=60, negative_ttl_seconds=5, negative_max_entries=2)
+    assert racing.get_company("key-a") == COMPANIES["key-a"]
+    assert racing.stats()["known"] == 0
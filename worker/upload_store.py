@@ -0,0 +1,110 @@
+"""Content-addressed store for uploaded documents.
+
+Uploads are hashed (SHA-256) while they're copied to disk and stored as
+UPLOAD_DIR/<aa>/<sha256><suffix>, so an ERP that re-posts the same PDF after
+a retry or resend doesn't leave a second copy behind — and the hash is what
+pipeline.intake_document uses to skip parse/extract for a file it has
+already processed for that company.
+
+store_upload_async is the same for the API: chunks come off the request
+and go to disk without blocking the event loop, and an upload over
+UPLOAD_MAX_MB is cut off with UploadTooLarge instead of filling the disk.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Protocol
+
+from config import UPLOAD_MAX_MB
+
+UPLOAD_DIR = Path("/var/lib/kostencheck/uploads")
+CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(UPLOAD_MAX_MB * 1024 * 1024)
+
+
+class UploadTooLarge(ValueError):
+    """The upload exceeded the size limit; nothing was stored."""
+
+
+class AsyncReadable(Protocol):
+    async def read(self, size: int = -1) -> bytes: ...
+
+
+@dataclass
+class StoredUpload:
+    path: Path
+    sha256: str
+    size: int
+    created: bool = False  # False if an identical file was already stored
+
+
+def content_path(sha256: str, filename: str | None) -> Path:
+    suffix = Path(filename or "").suffix.lower()
+    return UPLOAD_DIR / sha256[:2] / f"{sha256}{suffix}"
+
+
+class _UploadWriter:
+    """Temp file + running hash; commit() moves the file to its content address."""
+
+    def __init__(self, max_bytes: int | None) -> None:
+        UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+        self._max_bytes = max_bytes
+        self._digest = hashlib.sha256()
+        self.size = 0
+        fd, self._tmp_name = tempfile.mkstemp(dir=UPLOAD_DIR, prefix=".upload-")
+        self._out = os.fdopen(fd, "wb")
+
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self._max_bytes is not None and self.size > self._max_bytes:
+            raise UploadTooLarge(f"upload exceeds {self._max_bytes} bytes")
+        self._digest.update(chunk)
+        self._out.write(chunk)
+
+    def commit(self, filename: str | None) -> StoredUpload:
+        self._out.close()
+        sha256 = self._digest.hexdigest()
+        dest = content_path(sha256, filename)
+        created = not dest.exists()
+        if created:
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(self._tmp_name, dest)
+        else:
+            os.unlink(self._tmp_name)
+        return StoredUpload(path=dest, sha256=sha256, size=self.size, created=created)
+
+    def abort(self) -> None:
+        self._out.close()
+        if os.path.exists(self._tmp_name):
+            os.unlink(self._tmp_name)
+
+
+def store_upload(source: BinaryIO, filename: str | None, max_bytes: int | None = None) -> StoredUpload:
+    """Stream `source` to disk while hashing it; the file lands at its content address."""
+    writer = _UploadWriter(max_bytes)
+    try:
+        while chunk := source.read(CHUNK_SIZE):
+            writer.write(chunk)
+        return writer.commit(filename)
+    except BaseException:
+        writer.abort()
+        raise
+
+
+async def store_upload_async(source: AsyncReadable, filename: str | None,
+                             max_bytes: int | None = MAX_UPLOAD_BYTES) -> StoredUpload:
+    """store_upload for async sources (e.g. FastAPI's UploadFile); file I/O runs off the event loop."""
+    writer = await asyncio.to_thread(_UploadWriter, max_bytes)
+    try:
+        while chunk := await source.read(CHUNK_SIZE):
+            await asyncio.to_thread(writer.write, chunk)
+        return await asyncio.to_thread(writer.commit, filename)
+    except BaseException:
+        writer.abort()  # close + unlink; quick enough to do inline, and safe on cancellation
+        raise
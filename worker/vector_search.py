@@ -0,0 +1,203 @@
+"""Similar-project search over pipeline_historical_projects embeddings.
+
+Without an ANN index, `order by embedding <=> q` is a sequential scan that
+gets slower with every imported project. ensure_vector_indexes() runs at
+startup and builds an HNSW (or IVFFlat) index per configured distance op,
+CONCURRENTLY and on its own autocommit connection, rebuilding one left
+invalid by an interrupted build. Searches set hnsw.ef_search /
+ivfflat.probes per transaction.
+
+Small tenants skip the database entirely: if a company has at most
+VECTOR_LOCAL_MAX_ROWS embedded projects, their vectors are held in memory
+(refreshed after VECTOR_LOCAL_TTL_SECONDS, or when a backfill touches the
+company) and searched exactly with one matrix-vector product.
+
+ANN results trade recall for speed, so a VECTOR_RECALL_SAMPLE_RATE fraction
+of database searches is repeated as an exact scan and the overlap recorded;
+measure_recall() does the same over a set of queries for tuning ef_search.
+"""
+
+from __future__ import annotations
+
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+import psycopg2
+import psycopg2.extensions
+
+import db
+from config import (
+    DATABASE_URL,
+    VECTOR_HNSW_EF_CONSTRUCTION,
+    VECTOR_HNSW_M,
+    VECTOR_INDEX_OPS,
+    VECTOR_INDEX_TYPE,
+    VECTOR_IVFFLAT_LISTS,
+    VECTOR_LOCAL_MAX_ROWS,
+    VECTOR_LOCAL_TTL_SECONDS,
+    VECTOR_RECALL_SAMPLE_RATE,
+)
+from embeddings import embed_query
+
+logger = logging.getLogger("kostencheck.vector_search")
+
+# Distance name -> pgvector operator class.
+OPCLASSES = {"cosine": "vector_cosine_ops", "l2": "vector_l2_ops", "ip": "vector_ip_ops"}
+
+
+def _index_name(op: str) -> str:
+    return f"pipeline_historical_projects_embedding_{VECTOR_INDEX_TYPE}_{op}_idx"
+
+
+def _index_ddl(op: str) -> str:
+    if VECTOR_INDEX_TYPE == "ivfflat":
+        method, options = "ivfflat", f"lists = {int(VECTOR_IVFFLAT_LISTS)}"
+    else:
+        method, options = "hnsw", f"m = {int(VECTOR_HNSW_M)}, ef_construction = {int(VECTOR_HNSW_EF_CONSTRUCTION)}"
+    return (
+        f"create index concurrently if not exists {_index_name(op)} "
+        f"on public.pipeline_historical_projects using {method} (embedding {OPCLASSES[op]}) with ({options})"
+    )
+
+
+def ensure_vector_indexes(dsn: str = DATABASE_URL) -> None:
+    """Create missing ANN indexes and rebuild invalid ones. Logs instead of raising."""
+    try:
+        conn = psycopg2.connect(dsn)
+    except psycopg2.Error:
+        logger.warning("could not connect to check vector indexes", exc_info=True)
+        return
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction block.
+    conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    try:
+        for op in VECTOR_INDEX_OPS:
+            name = _index_name(op)
+            with conn.cursor() as cur:
+                cur.execute(
+                    "select i.indisvalid from pg_class c join pg_index i on i.indexrelid = c.oid where c.relname = %s",
+                    (name,),
+                )
+                row = cur.fetchone()
+                if row is not None and row[0]:
+                    continue
+                if row is not None:
+                    logger.warning("vector index %s is invalid (interrupted build?), rebuilding", name)
+                    cur.execute(f"drop index concurrently if exists {name}")
+                started = time.monotonic()
+                logger.info("building vector index %s", name)
+                cur.execute(_index_ddl(op))
+                logger.info("built vector index %s in %.1fs", name, time.monotonic() - started)
+    except psycopg2.Error:
+        logger.warning("could not create vector indexes", exc_info=True)
+    finally:
+        conn.close()
+
+
+@dataclass
+class _LocalIndex:
+    rows: list[dict[str, Any]]
+    matrix: np.ndarray | None  # (n, dim) unit vectors; None when the company is too large to hold
+    loaded_at: float
+
+
+class VectorSearch:
+    def __init__(self, local_max_rows: int, local_ttl_seconds: float, recall_sample_rate: float) -> None:
+        self._local_max_rows = local_max_rows
+        self._local_ttl = local_ttl_seconds
+        self._recall_sample_rate = recall_sample_rate
+        self._local: dict[str, _LocalIndex] = {}
+        self._lock = threading.Lock()
+        self._stats = {"local_searches": 0, "db_searches": 0, "local_loads": 0,
+                       "recall_samples": 0, "recall_sum": 0.0}
+
+    def _local_index(self, company_id: str) -> _LocalIndex | None:
+        if self._local_max_rows <= 0:
+            return None
+        with self._lock:
+            index = self._local.get(company_id)
+        if index is None or time.monotonic() - index.loaded_at > self._local_ttl:
+            # Count first: a company too large to hold costs a count per TTL, not a vector download.
+            if db.count_historical_vectors(company_id) > self._local_max_rows:
+                index = _LocalIndex(rows=[], matrix=None, loaded_at=time.monotonic())
+            else:
+                rows = db.historical_project_vectors(company_id, limit=self._local_max_rows)
+                matrix = np.array([row.pop("embedding") for row in rows], dtype=np.float32).reshape(len(rows), -1)
+                index = _LocalIndex(rows=rows, matrix=matrix, loaded_at=time.monotonic())
+            with self._lock:
+                self._local[company_id] = index
+                self._stats["local_loads"] += 1
+        return index if index.matrix is not None else None
+
+    def invalidate(self, company_id: str) -> None:
+        with self._lock:
+            self._local.pop(company_id, None)
+
+    def search(self, company_id: str, query: str, limit: int = 5) -> list[dict[str, Any]]:
+        """Most similar historical projects to `query`, nearest first, with cosine `distance`."""
+        embedding = np.asarray(embed_query(query), dtype=np.float32)
+        index = self._local_index(company_id)
+        if index is not None:
+            with self._lock:
+                self._stats["local_searches"] += 1
+            return _top_k(index, embedding, limit)
+
+        results = db.search_similar_projects(company_id, embedding, limit)
+        with self._lock:
+            self._stats["db_searches"] += 1
+        if results and random.random() < self._recall_sample_rate:
+            exact = db.search_similar_projects(company_id, embedding, limit, exact=True)
+            self._record_recall(_recall(results, exact))
+        return results
+
+    def measure_recall(self, company_id: str, queries: list[str], limit: int = 5,
+                       ef_search: int | None = None) -> float | None:
+        """Mean recall@limit of the ANN index against exact search over `queries` (for tuning ef_search)."""
+        recalls = []
+        for query in queries:
+            embedding = np.asarray(embed_query(query), dtype=np.float32)
+            exact = db.search_similar_projects(company_id, embedding, limit, exact=True)
+            if exact:
+                approximate = db.search_similar_projects(company_id, embedding, limit, ef_search=ef_search)
+                recalls.append(_recall(approximate, exact))
+        return sum(recalls) / len(recalls) if recalls else None
+
+    def _record_recall(self, recall: float) -> None:
+        with self._lock:
+            self._stats["recall_samples"] += 1
+            self._stats["recall_sum"] += recall
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            local_companies = sum(1 for index in self._local.values() if index.matrix is not None)
+        recall_sum = stats.pop("recall_sum")
+        samples = stats["recall_samples"]
+        return {**stats, "local_companies": local_companies,
+                "sampled_recall": recall_sum / samples if samples else None}
+
+
+def _top_k(index: _LocalIndex, embedding: np.ndarray, limit: int) -> list[dict[str, Any]]:
+    scores = index.matrix @ embedding
+    limit = min(limit, len(scores))
+    if limit <= 0:
+        return []
+    top = np.argpartition(-scores, limit - 1)[:limit]
+    top = top[np.argsort(-scores[top])]
+    return [{**index.rows[i], "distance": float(1.0 - scores[i])} for i in top]
+
+
+def _recall(approximate: list[dict[str, Any]], exact: list[dict[str, Any]]) -> float:
+    expected = {row["id"] for row in exact}
+    return len(expected & {row["id"] for row in approximate}) / len(expected) if expected else 1.0
+
+
+vector_search = VectorSearch(
+    local_max_rows=VECTOR_LOCAL_MAX_ROWS,
+    local_ttl_seconds=VECTOR_LOCAL_TTL_SECONDS,
+    recall_sample_rate=VECTOR_RECALL_SAMPLE_RATE,
+)